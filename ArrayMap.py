@@ -0,0 +1,424 @@
+#! /usr/bin/env python3
+# A NumPy implementation of the 'battleships' map.
+#
+#   Copyright 2012 Olaf Ohlenmacher
+#
+#   This file is part of battleships.
+#
+#   Battleships is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Battleships is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with battleships.  If not, see <http://www.gnu.org/licenses/>.
+
+# This map holds the status of all fields in a 2-dimensional NumPy array
+# with one byte (uint8) per field. The array is indexed [y, x], so one
+# row of the array is one row of the printed map.
+#
+# The nice thing about arrays: I can ask questions for all fields at
+# once. The free regions of the map are found with a few array
+# operations, and the rates of all regions (see calc_points() in
+# battleships.py) are computed in one step, too. This scales to maps
+# with thousands of fields per side.
+#
+# NumPy is not needed to play 'battleships'. Only this module needs it.
+
+import sys
+import unittest
+
+import numpy
+
+from battleships import X_SET, Y_SET, STATUS_SET, SHIP_STATUS, render_map, \
+    random_map
+
+
+# The status and its code in the array. The index of a status in this
+# tuple is its code, so unknown fields are 0.
+STATUS = (None, 'water', 'hit', 'sunk', 'ship')
+CODE = {status: code for code, status in enumerate(STATUS)}
+
+
+class ArrayMap(object):
+    """
+    Create a map object which holds the field status in a NumPy array.
+    It has the same interface as battleships.Map and can be used as
+    drop-in for the maps of a Player.
+    """
+
+    def __init__(self, newmap=None, width=None, height=None):
+        if width == None: width = len(X_SET)
+        if height == None: height = len(Y_SET)
+
+        self.width  = width
+        self.height = height
+        self.array  = numpy.zeros((height, width), dtype=numpy.uint8)
+
+        if newmap != None:
+            for koor, status in newmap.items():
+                self.set(koor, status)
+
+
+    def _status_array(self, status):
+        """
+        Returns a boolean array of all fields with 'status', which may be
+        a single status or a set of status.
+        """
+        if not isinstance(status, set):
+            return self.array == CODE[status]
+        return numpy.isin(self.array, [CODE[s] for s in status])
+
+
+    def _as_array(self, fields):
+        """
+        Returns a boolean array with all 'fields' set.
+        """
+        result = numpy.zeros(self.array.shape, dtype=bool)
+        if len(fields) > 0:
+            xs, ys = zip(*fields)
+            result[list(ys), list(xs)] = True
+        return result
+
+
+    def _as_fields(self, array):
+        """
+        Returns the set of fields of a boolean array.
+        """
+        ys, xs = numpy.nonzero(array)
+        return set(zip(xs.tolist(), ys.tolist()))
+
+
+    def _grow(self, array):
+        """
+        Returns 'array' together with all of its 8 neighbours.
+        """
+        padded = numpy.pad(array, 1)
+        h, w = array.shape
+        result = numpy.zeros(array.shape, dtype=bool)
+        for dy in (0, 1, 2):
+            for dx in (0, 1, 2):
+                result |= padded[dy:dy+h, dx:dx+w]
+        return result
+
+
+    ## the interface of battleships.Map
+
+    def get(self, koor):
+        """
+        Returns status of a field.
+        """
+        assert isinstance(koor,tuple),	"request tuple for coordinates"
+        assert len(koor) == 2,			"need two coordinates"
+
+        return STATUS[self.array[koor[1], koor[0]]]
+
+
+    def get_fields(self, status=None):
+        """
+        Returns fields with 'status' (default: unknown status)
+        """
+        return self._as_fields(self._status_array(status))
+
+
+    def count(self, status=None):
+        """
+        Returns the number of fields with 'status'.
+        """
+        return int(numpy.count_nonzero(self.array == CODE[status]))
+
+
+    def set(self, koor, status):
+        """
+        Set status of a field.
+        """
+        assert isinstance(koor,tuple),	"request tuple for coordinates"
+        assert len(koor) == 2,			"need two coordinates"
+        assert status in STATUS_SET,	"status must be STATUS_SET element"
+
+        self.array[koor[1], koor[0]] = CODE[status]
+        return
+
+
+    def set_fields(self, fields, status):
+        """
+        Set a list of fields to given status
+        """
+        assert isinstance(fields, (set,list,tuple)), \
+            "'fields' must be a list or tuple of coordinates eg. '[(1,4)]'"
+
+        if len(fields) > 0:
+            xs, ys = zip(*fields)
+            self.array[list(ys), list(xs)] = CODE[status]
+        return
+
+
+    def print(self):
+        sys.stdout.write(self.render())
+
+
+    def render(self):
+        """
+        Returns the map as string, as print() shows it.
+        """
+        return render_map(self)
+
+
+    __str__ = render
+
+
+    def neighbours(self, fields, status=None, include=False, recursive=False, check=None):
+        """
+        Returns all neighbour fields of the given field list.
+        If 'status' is not None, only fields which status is 'status' will be
+        returned.
+        If 'include' is True, fields will be included into the result.
+        If 'recursive' is True, all reachable fields are returned.
+        """
+        assert isinstance(fields, set), "'fields' must be set of coordinates"
+        assert check == None or check != None and len(fields) == 1,\
+            "check only supported for single fields yet"
+        assert check == None or check == 'odd' or check == 'even',\
+            "check only supports values: None, odd, even"
+
+        start = self._as_array(fields)
+        if status == None:
+            allowed = numpy.ones(self.array.shape, dtype=bool)
+        else:
+            allowed = self._status_array(status)
+
+        result = self._grow(start) & allowed
+        if recursive:
+            while True:
+                grown = self._grow(result) & allowed
+                if numpy.array_equal(grown, result): break
+                result = grown
+
+        if not include:
+            result &= ~start
+
+        if check != None:
+            (x, y) = next(iter(fields))
+            qsum = (x + y) % 2
+            if check == 'even':
+                qsum = (x + y + 1) % 2
+            ys, xs = numpy.indices(self.array.shape)
+            result &= (xs + ys) % 2 == qsum
+
+        return self._as_fields(result)
+
+
+    def surround_with(self, field, status, what=None):
+        """
+        Set the surrounding fields of a region. The region is calculated from
+        one field and all neighbouring fields with equal status.
+        Returns the fields which were set.
+        """
+        fields = self.neighbours(self.get_region(field), status=what)
+        self.set_fields(fields, status)
+
+        return fields
+
+
+    def find_ship(self, koor):
+        """
+        Returns the identifier (a field) of the ship at 'koor' or None if
+        there is no ship field.
+        """
+        ship = self.get_ship(koor)
+        if len(ship) == 0: return None
+        return min(ship)
+
+
+    def get_ship(self, koor):
+        """
+        Returns all fields of the ship at 'koor' -- all connected fields
+        with a status of SHIP_STATUS.
+        """
+        if self.get(koor) not in SHIP_STATUS: return set()
+        return self.neighbours(
+            {koor}, SHIP_STATUS, include=True, recursive=True
+        )
+
+
+    def get_region(self, field, what=None):
+        """
+        Returns a region containing 'field' and all fields with equal
+        status surrounding it.
+        If 'what' is set surrounding fields must have field status 'what'.
+        """
+        if what == None:
+            what = self.get(field)
+
+        return self.neighbours(
+            {field}, what, include=True, recursive=True
+        )
+
+
+    def runs(self, size=1, status=None):
+        """
+        Returns all free runs of a minimal size as three arrays: the
+        first field (as index into the flattened array), the step to the
+        next field and the length of the run.
+        Vertical runs come first (column by column), then the horizontal
+        ones (row by row) -- the same order as regions() has.
+        """
+        free = self._status_array(status)
+
+        # The rows of 'free' give the horizontal runs, the rows of the
+        # transposed array the vertical ones.
+        columns, ys, vlen = _runs(free.T, size)
+        rows, xs, hlen = _runs(free, size)
+
+        starts = numpy.concatenate((ys * self.width + columns, rows * self.width + xs))
+        steps = numpy.concatenate((
+            numpy.full(len(vlen), self.width), numpy.ones(len(hlen), dtype=numpy.intp)
+        ))
+        return starts, steps, numpy.concatenate((vlen, hlen))
+
+
+    def regions(self, size=1, status=None):
+        """
+        Returns a list of regions of a minimal size with fields status
+        (default :None).
+        """
+        assert size >  0, "size must be > 0"
+        assert size <= max(self.width, self.height), \
+            "size must not be greater then Y_SET and X_SET"
+
+        starts, steps, lengths = self.runs(size, status)
+        w = self.width
+        return [
+            [((s + i*step) % w, (s + i*step) // w) for i in range(n)]
+            for s, step, n in zip(starts.tolist(), steps.tolist(), lengths.tolist())
+        ]
+
+
+    def rate_array(self, size=1, rate=1, status=None):
+        """
+        Returns an array with the summed up rates of all free regions of a
+        minimal size, like Player._rate_unknown_fields() computes them.
+        """
+        starts, steps, lengths = self.runs(size, status)
+        fields, values = calc_points_array(starts, steps, lengths, rate)
+
+        result = numpy.zeros(self.width * self.height, dtype=numpy.int64)
+        numpy.add.at(result, fields, values)
+        return result.reshape(self.array.shape)
+
+
+    def rate_map(self, size=1, rate=1, status=None):
+        """
+        Returns the <target map> of all free regions of a minimal size.
+        """
+        rates = self.rate_array(size, rate, status)
+        ys, xs = numpy.nonzero(rates)
+        return dict(zip(
+            zip(xs.tolist(), ys.tolist()), rates[ys, xs].tolist()
+        ))
+
+
+def _runs(free, size):
+    """
+    Returns row, first column and length of all runs of True in the rows
+    of the boolean array 'free' which have a minimal length of 'size'.
+    """
+    # I put a False at both ends of every row. Then a run begins where
+    # the difference of two neighbouring fields is +1 and ends where it
+    # is -1. Because numpy.nonzero() works row by row, the n-th begin
+    # and the n-th end belong to the same run.
+    h, w = free.shape
+    padded = numpy.zeros((h, w + 2), dtype=numpy.int8)
+    padded[:, 1:-1] = free
+    diff = numpy.diff(padded, axis=1)
+
+    rows, first = numpy.nonzero(diff == 1)
+    _, end = numpy.nonzero(diff == -1)
+    lengths = end - first
+
+    keep = lengths >= size
+    return rows[keep], first[keep], lengths[keep]
+
+
+def calc_points_array(starts, steps, lengths, rate=1):
+    """
+    Returns the fields (as index into the flattened array) and the values
+    of all given runs. This is calc_points() of battleships.py for many
+    regions at once.
+    """
+    # For every field of every run I need its run and its position 'i'
+    # inside of the run...
+    total = int(lengths.sum())
+    run = numpy.repeat(numpy.arange(len(lengths)), lengths)
+    offset = numpy.cumsum(lengths) - lengths
+    i = numpy.arange(total) - offset[run]
+
+    # ...then the value is (like calc_points() does) the distance from the
+    # nearer edge of the run plus one, times 'rate', plus the length.
+    n = lengths[run]
+    values = rate * (numpy.minimum(i, n - 1 - i) + 1) + n
+    fields = starts[run] + i * steps[run]
+
+    return fields, values
+
+
+class Test_ArrayMap(unittest.TestCase):
+    def setUp(self):
+        self.dict_map = random_map(4711)
+        self.array_map = ArrayMap(dict(self.dict_map.map))
+
+    def test_get_fields(self):
+        for status in (None, 'water', 'hit', 'sunk', 'ship'):
+            self.assertEqual(
+                self.dict_map.get_fields(status),
+                self.array_map.get_fields(status)
+            )
+            self.assertEqual(
+                self.dict_map.count(status),
+                self.array_map.count(status)
+            )
+
+    def test_neighbours(self):
+        for field in ((0,0), (4,5), (9,9)):
+            self.assertEqual(
+                self.dict_map.neighbours({field}, None),
+                self.array_map.neighbours({field}, None)
+            )
+            self.assertEqual(
+                self.dict_map.get_region(field, {'hit', 'ship'}),
+                self.array_map.get_region(field, {'hit', 'ship'})
+            )
+            self.assertEqual(
+                self.dict_map.neighbours({field}, check='odd'),
+                self.array_map.neighbours({field}, check='odd')
+            )
+
+    def test_regions(self):
+        for size in range(1, 6):
+            self.assertEqual(
+                self.dict_map.regions(size),
+                self.array_map.regions(size)
+            )
+
+    def test_rate_map(self):
+        from battleships import calc_points
+
+        for size in range(1, 6):
+            t_map = dict()
+            for region in self.dict_map.regions(size):
+                for k,v in calc_points(region).items():
+                    t_map[k] = t_map.get(k, 0) + v
+            self.assertEqual(t_map, self.array_map.rate_map(size))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#EOF
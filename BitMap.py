@@ -0,0 +1,464 @@
+#! /usr/bin/env python3
+# A bitboard implementation of the 'battleships' map.
+#
+#   Copyright 2012 Olaf Ohlenmacher
+#
+#   This file is part of battleships.
+#
+#   Battleships is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Battleships is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with battleships.  If not, see <http://www.gnu.org/licenses/>.
+
+# The Map class in battleships.py holds a dictionary with one entry per
+# field. That is easy to read, but every question like "give me all
+# neighbours" or "where are the free regions" walks through the fields
+# one by one.
+#
+# Here I try another way: python integers can be as long as I want, so I
+# use one integer per status and let each bit stand for one field. A
+# set bit means "this field has this status". Many questions become a
+# handful of shifts and ANDs on these integers.
+#
+# The bits are numbered row by row:
+#
+#     bit = y * stride + x      with    stride = width + 1
+#
+# The additional bit at the end of each row (x == width) is a guard. It
+# is never set, so shifting a row to the left or right can not wrap
+# around into the next row.
+
+import sys
+import unittest
+
+from battleships import X_SET, Y_SET, STATUS_SET, SHIP_STATUS, render_map, \
+    random_map
+
+
+class BitMap(object):
+    """
+    Create a map object which holds one bitmask per field status.
+    It has the same interface as battleships.Map and can be used as
+    drop-in for the maps of a Player.
+    """
+
+    # The status which are stored as bitmask. Fields without any of these
+    # status are unknown (None).
+    STATUS = ('water', 'hit', 'sunk', 'ship')
+
+    def __init__(self, newmap=None, width=None, height=None):
+        if width == None: width = len(X_SET)
+        if height == None: height = len(Y_SET)
+
+        self.width  = width
+        self.height = height
+        self.stride = width + 1
+
+        # 'full' has a bit for every valid field, the guard bits are
+        # missing. Every result of a shift is ANDed with it.
+        row = (1 << width) - 1
+        self.full = 0
+        for y in range(height):
+            self.full |= row << (y * self.stride)
+
+        # The parity masks are used for the 'odd' and 'even' checks of
+        # neighbours(): 'parity[0]' holds all fields with (x+y)%2 == 0.
+        self.parity = [0, 0]
+        for y in range(height):
+            for x in range(width):
+                self.parity[(x + y) % 2] |= 1 << self._bit((x, y))
+
+        # A table with the coordinate for every bit number. So I do not
+        # have to compute (and allocate) the tuples again and again.
+        self.koors = [
+            (bit % self.stride, bit // self.stride)
+            for bit in range(height * self.stride)
+        ]
+
+        # one bitmask per status, the unknown fields are the rest
+        self.bits = {status: 0 for status in self.STATUS}
+        self.unknown = self.full
+
+        if newmap != None:
+            for koor, status in newmap.items():
+                self.set(koor, status)
+
+
+    ## bit helpers
+
+    def _bit(self, koor):
+        """
+        Returns the bit number of a coordinate.
+        """
+        return koor[1] * self.stride + koor[0]
+
+
+    def _koor(self, bit):
+        """
+        Returns the coordinate of a bit number.
+        """
+        return self.koors[bit]
+
+
+    def _mask(self, fields):
+        """
+        Returns the bitmask of a collection of fields.
+        """
+        mask = 0
+        stride = self.stride
+        for (x, y) in fields:
+            mask |= 1 << (y * stride + x)
+        return mask
+
+
+    def _fields(self, mask):
+        """
+        Returns the set of fields of a bitmask.
+        """
+        fields = set()
+        koors = self.koors
+        while mask:
+            low = mask & -mask
+            fields.add(koors[low.bit_length() - 1])
+            mask ^= low
+        return fields
+
+
+    def _status_mask(self, status):
+        """
+        Returns the bitmask of all fields with 'status', which may be a
+        single status or a set of status.
+        """
+        if not isinstance(status, set):
+            status = {status}
+        mask = 0
+        for s in status:
+            mask |= self.unknown if s == None else self.bits[s]
+        return mask
+
+
+    def _grow(self, mask):
+        """
+        Returns 'mask' together with all of its 8 neighbours.
+        """
+        row = mask | (mask << 1) | (mask >> 1)
+        return (row | (row << self.stride) | (row >> self.stride)) & self.full
+
+
+    ## the interface of battleships.Map
+
+    def get(self, koor):
+        """
+        Returns status of a field.
+        """
+        assert isinstance(koor,tuple),	"request tuple for coordinates"
+        assert len(koor) == 2,			"need two coordinates"
+
+        bit = 1 << self._bit(koor)
+        for status, mask in self.bits.items():
+            if mask & bit: return status
+        return None
+
+
+    def get_fields(self, status=None):
+        """
+        Returns fields with 'status' (default: unknown status)
+        """
+        return self._fields(self._status_mask(status))
+
+
+    def count(self, status=None):
+        """
+        Returns the number of fields with 'status'.
+        """
+        return bin(self._status_mask(status)).count('1')
+
+
+    def set(self, koor, status):
+        """
+        Set status of a field.
+        """
+        assert isinstance(koor,tuple),	"request tuple for coordinates"
+        assert len(koor) == 2,			"need two coordinates"
+        assert status in STATUS_SET,	"status must be STATUS_SET element"
+
+        self._set_mask(1 << self._bit(koor), status)
+        return
+
+
+    def set_fields(self, fields, status):
+        """
+        Set a list of fields to given status
+        """
+        assert isinstance(fields, (set,list,tuple)), \
+            "'fields' must be a list or tuple of coordinates eg. '[(1,4)]'"
+
+        self._set_mask(self._mask(fields), status)
+        return
+
+
+    def _set_mask(self, mask, status):
+        # clear the fields in every bitmask first, then set them for the
+        # new status
+        bits = self.bits
+        for s in self.STATUS:
+            bits[s] &= ~mask
+        self.unknown &= ~mask
+        if status == None:
+            self.unknown |= mask
+        else:
+            bits[status] |= mask
+
+
+    def print(self):
+        sys.stdout.write(self.render())
+
+
+    def render(self):
+        """
+        Returns the map as string, as print() shows it.
+        """
+        return render_map(self)
+
+
+    __str__ = render
+
+
+    def neighbours(self, fields, status=None, include=False, recursive=False, check=None):
+        """
+        Returns all neighbour fields of the given field list.
+        If 'status' is not None, only fields which status is 'status' will be
+        returned.
+        If 'include' is True, fields will be included into the result.
+        If 'recursive' is True, all reachable fields are returned.
+        """
+        assert isinstance(fields, set), "'fields' must be set of coordinates"
+        assert check == None or check != None and len(fields) == 1,\
+            "check only supported for single fields yet"
+        assert check == None or check == 'odd' or check == 'even',\
+            "check only supports values: None, odd, even"
+
+        start = self._mask(fields)
+        allowed = self.full if status == None else self._status_mask(status)
+
+        # One step is one shift into all directions. The recursive case
+        # simply repeats the step until the result does not grow anymore.
+        result = self._grow(start) & allowed
+        if recursive:
+            last = 0
+            while result != last:
+                last = result
+                result = self._grow(result) & allowed
+
+        if not include:
+            result &= ~start
+
+        # Keep the fields with the same QSUM (x+y)%2 as the given field
+        # for 'odd' or the other ones for 'even'.
+        if check != None:
+            (x, y) = next(iter(fields))
+            qsum = (x + y) % 2
+            if check == 'even':
+                qsum = (x + y + 1) % 2
+            result &= self.parity[qsum]
+
+        return self._fields(result)
+
+
+    def surround_with(self, field, status, what=None):
+        """
+        Set the surrounding fields of a region. The region is calculated from
+        one field and all neighbouring fields with equal status.
+        Returns the fields which were set.
+        """
+        fields = self.neighbours(self.get_region(field), status=what)
+        self.set_fields(fields, status)
+
+        return fields
+
+
+    def regions(self, size=1, status=None):
+        """
+        Returns a list of regions of a minimal size with fields status
+        (default :None).
+        """
+        assert size >  0, "size must be > 0"
+        assert size <= max(self.width, self.height), \
+            "size must not be greater then Y_SET and X_SET"
+
+        free = self._status_mask(status)
+
+        # The regions are returned in the same order as battleships.Map
+        # does: first all vertical ones (column by column), then all the
+        # horizontal ones (row by row).
+        vertical = self._runs(free, size, self.stride)
+        vertical.sort(key=lambda bit: (bit % self.stride, bit))
+        horizontal = self._runs(free, size, 1)
+
+        positions = []
+        koors = self.koors
+        for step, starts in ((self.stride, vertical), (1, horizontal)):
+            for bit in starts:
+                # the end of the run is the first field which is not free
+                end = bit
+                while free >> end & 1:
+                    end += step
+                positions.append(koors[bit:end:step])
+
+        return positions
+
+
+    def _runs(self, free, size, step):
+        """
+        Returns the bit numbers of all starts of runs in 'free' with a
+        minimal length of 'size' in direction 'step'.
+        """
+        # A run starts where the field before is not free...
+        starts = free & ~(free << step)
+
+        # ...and it is long enough if the next 'size-1' fields are free,
+        # too. The guard bits make sure that nothing wraps around.
+        long = free
+        for i in range(1, size):
+            long &= free >> (i * step)
+        starts &= long
+
+        bits = []
+        while starts:
+            low = starts & -starts
+            bits.append(low.bit_length() - 1)
+            starts ^= low
+        return bits
+
+
+    def find_ship(self, koor):
+        """
+        Returns the identifier (a field) of the ship at 'koor' or None if
+        there is no ship field.
+        """
+        ship = self.get_ship(koor)
+        if len(ship) == 0: return None
+        return min(ship)
+
+
+    def get_ship(self, koor):
+        """
+        Returns all fields of the ship at 'koor' -- all connected fields
+        with a status of SHIP_STATUS.
+        """
+        if self.get(koor) not in SHIP_STATUS: return set()
+        return self.neighbours(
+            {koor}, SHIP_STATUS, include=True, recursive=True
+        )
+
+
+    def get_region(self, field, what=None):
+        """
+        Returns a region containing 'field' and all fields with equal
+        status surrounding it.
+        If 'what' is set surrounding fields must have field status 'what'.
+        """
+        if what == None:
+            what = self.get(field)
+
+        return self.neighbours(
+            {field}, what, include=True, recursive=True
+        )
+
+
+class Test_BitMap(unittest.TestCase):
+    def setUp(self):
+        # the same random board for the bitmap and the dict map
+        self.dict_map = random_map(
+            4711, choices=(None, None, 'water', 'hit', 'sunk', 'ship')
+        )
+        self.bit_map = BitMap(dict(self.dict_map.map))
+
+    def test_get_fields(self):
+        for status in (None, 'water', 'hit', 'sunk', 'ship'):
+            self.assertEqual(
+                self.dict_map.get_fields(status),
+                self.bit_map.get_fields(status)
+            )
+            self.assertEqual(
+                self.dict_map.count(status),
+                self.bit_map.count(status)
+            )
+
+    def test_neighbours(self):
+        for field in ((0,0), (4,5), (9,9), (9,0)):
+            for status in (None, 'hit', {'hit', 'ship'}):
+                self.assertEqual(
+                    self.dict_map.neighbours({field}, status),
+                    self.bit_map.neighbours({field}, status)
+                )
+            for status in ('hit', {'hit', 'ship'}):
+                self.assertEqual(
+                    self.dict_map.get_region(field, status),
+                    self.bit_map.get_region(field, status)
+                )
+            for check in ('odd', 'even'):
+                for include in (False, True):
+                    fields = {field}
+                    self.assertEqual(
+                        self.dict_map.neighbours(fields, check=check, include=include),
+                        self.bit_map.neighbours({field}, check=check, include=include)
+                    )
+                    self.assertEqual({field}, fields, "fields are not changed")
+
+    def test_render(self):
+        self.assertEqual(self.dict_map.render(), self.bit_map.render())
+        self.assertEqual(self.dict_map.render(), str(self.bit_map))
+
+    def test_regions(self):
+        for size in range(1, 6):
+            for status in (None, 'water'):
+                self.assertEqual(
+                    self.dict_map.regions(size, status),
+                    self.bit_map.regions(size, status)
+                )
+
+    def test_get_ship(self):
+        # battleships.Map uses its union-find index, BitMap the bitmasks
+        for x in range(len(X_SET)):
+            for y in range(len(Y_SET)):
+                self.assertEqual(
+                    self.dict_map.get_ship((x,y)),
+                    self.bit_map.get_ship((x,y))
+                )
+
+        # a ship field which becomes water splits the ship
+        for koor in ((3,3), (4,5), (0,9)):
+            self.dict_map.set(koor, 'water')
+            self.bit_map.set(koor, 'water')
+        self.dict_map.set_fields([(5,5), (6,6)], 'hit')
+        self.bit_map.set_fields([(5,5), (6,6)], 'hit')
+        for x in range(len(X_SET)):
+            for y in range(len(Y_SET)):
+                self.assertEqual(
+                    self.dict_map.get_ship((x,y)),
+                    self.bit_map.get_ship((x,y))
+                )
+
+    def test_set_fields(self):
+        self.bit_map.set_fields([(1,1), (2,1)], 'sunk')
+        self.assertEqual('sunk', self.bit_map.get((2,1)))
+        self.bit_map.set((2,1), None)
+        self.assertEqual(None, self.bit_map.get((2,1)))
+        self.assertIn((2,1), self.bit_map.get_fields(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#EOF
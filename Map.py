@@ -1,20 +1,59 @@
 #! /usr/bin/env python3
 
 from builtins import tuple as _tuple
+from operator import itemgetter as _itemgetter
 import unittest
 
 
+# The status of a field and its sign on the terminal -- the same as
+# LEGENDE and STATUS_SET of battleships.py. That module imports this one,
+# so I can not import them from there and keep my own copy.
+_LEGENDE = {
+    None:    '.',
+    'water': 'o',
+    'hit':   '+',
+    'sunk':  '*',
+    'ship':  '#',
+}
+_STATUS_SET = set(_LEGENDE)
+
+
+# The cells around each cell (and the cell itself) only depend on the size
+# of a map. So I compute them once for each size and all maps of a size
+# share the table -- for the last AROUND_SIZES sizes, the oldest goes first.
+_AROUND = {}
+AROUND_SIZES = 8
+
+def _around_table(width, height):
+    key = (width, height)
+    if key not in _AROUND:
+        if len(_AROUND) >= AROUND_SIZES:
+            del _AROUND[next(iter(_AROUND))]
+        _AROUND[key] = tuple(
+            tuple(
+                yi * width + xi
+                for yi in range(max(y-1, 0), min(y+2, height))
+                for xi in range(max(x-1, 0), min(x+2, width))
+            )
+            for y in range(height) for x in range(width)
+        )
+    return _AROUND[key]
+
+
 class Coor(tuple):
     """
     Class for arbitrary 2-dimensional coordinates.
     """
 
+    # No __dict__ for each coordinate: 'x' and 'y' are read from the
+    # tuple itself (like a namedtuple does).
+    __slots__ = ()
+
     def __new__(_cls,x,y):
         return _tuple.__new__(_cls,[x,y])
 
-    def __init__(self,x,y):
-        self.x = x
-        self.y = y
+    x = property(_itemgetter(0), doc="the X coordinate")
+    y = property(_itemgetter(1), doc="the Y coordinate")
 
     def __repr__(self):
         return "Coor" + super().__repr__()
@@ -41,13 +80,39 @@ class Map(object):
         assert isinstance(y_list, (str, range, tuple))
 
         if not initial_map:
-            self.map = {}
             self.x_coor = tuple(x_list)
             self.y_coor = tuple(y_list)
+            self._make_cells()
+            self.map = [None] * len(self.coors)
         else:
-            self.map = initial_map
+            # the tables never change, so both maps can share them
             self.x_coor = initial_map.x_coor
             self.y_coor = initial_map.y_coor
+            self.x_pos  = initial_map.x_pos
+            self.y_pos  = initial_map.y_pos
+            self.coors  = initial_map.coors
+            self.cells  = initial_map.cells
+            self.around = initial_map.around
+            self.map = list(initial_map.map)
+
+
+    # The coordinates of this map are the elements of 'x_coor' and
+    # 'y_coor', they may be letters or numbers. Inside I number the fields
+    # (the cells) row by row: n = y * width + x, where x and y are the
+    # positions on the axes. 'map' is a list with the status of each cell.
+    #
+    # The coordinates are made once for each cell ('coors') and are found
+    # by a dictionary ('cells'), so I do not make new tuples all the time
+    # and never search the axes. 'around' is the shared table of the cells
+    # around each cell (see _around_table()).
+    def _make_cells(self):
+        self.x_pos = {x: n for n, x in enumerate(self.x_coor)}
+        self.y_pos = {y: n for n, y in enumerate(self.y_coor)}
+        self.coors = tuple(
+            Coor(x, y) for y in self.y_coor for x in self.x_coor
+        )
+        self.cells = {coor: n for n, coor in enumerate(self.coors)}
+        self.around = _around_table(len(self.x_coor), len(self.y_coor))
 
 
     def is_valid_coor(self, coor):
@@ -60,9 +125,7 @@ class Map(object):
         if len(coor) != 2:
             raise ValueError("coordinates exactly have two elements")
 
-        if coor[0] in self.x_coor and coor[1] in self.y_coor:
-            return True
-        return False
+        return coor in self.cells
 
 
     # A simple access function for the status of a field.
@@ -72,7 +135,7 @@ class Map(object):
         """
         assert self.is_valid_coor(coor),	"request tuple for coordinates"
 
-        return self.map.get(coor, None)
+        return self.map[self.cells[coor]]
 
 
     # This function returns all fields of a map with the given status.
@@ -85,25 +148,10 @@ class Map(object):
         Returns fields with 'status' (default: unknown status)
         """
 
-        # initialize the result fields
-        fields = set()
-
-        # I am searching the map (a dictionary) for fields which do not
-        # have a status. So I have to loop through all coordinates and see
-        # wheter there is some set or not. If nothing is set I add the
-        # coordinate to the list.
-        if status == None:
-            for x in range(len(X_SET)):
-                for y in range(len(Y_SET)):
-                    if (x,y) not in self.map: fields.add((x,y))
-            return fields
-
-        # Here I am searching for fields with a status. Thats easier because
-        # I loop through all entries of the dictionary only and look if the
-        # fields equals to the status.
-        for k,s in self.map.items():
-            if status == s: fields.add(k)
-        return fields
+        # I loop through the status of all cells and take the
+        # coordinates of the cells with 'status'.
+        coors = self.coors
+        return {coors[n] for n, s in enumerate(self.map) if s == status}
 
 
     # A simple access function for setting the the status of a field.
@@ -113,9 +161,10 @@ class Map(object):
         """
         assert isinstance(koor,tuple),	"request tuple for coordinates"
         assert len(koor) == 2,			"need two coordinates"
-        assert status in STATUS_SET,	"status must be STATUS_SET element"
+        assert status in _STATUS_SET,	"status must be STATUS_SET element"
+        assert self.is_valid_coor(koor), "coordinates must be on the map"
 
-        self.map[koor] = status
+        self.map[self.cells[koor]] = status
         return
 
 
@@ -128,33 +177,34 @@ class Map(object):
         assert isinstance(fields, (set,list,tuple)), \
             "'fields' must be a list or tuple of coordinates eg. '[(1,4)]'"
 
-        for (x,y) in fields:
-            self.map[(x,y)] = status
+        cells = self.cells
+        for koor in fields:
+            self.map[cells[koor]] = status
         return
 
 
     # Here it comes! the terminal output of the map!
     def print(self):
-        # I first print all cordinates of the X_SET with enough space for
+        # I first print all cordinates of the X-Axis with enough space for
         # remarks of the Y-Axis
         print( "    ", end="" )
-        for x in range(len(X_SET)):
-            print( X_SET[x], end=" ")
+        for x in self.x_coor:
+            print( x, end=" ")
         print()
-        print( "  +", len(X_SET) * '--', sep="")
+        print( "  +", len(self.x_coor) * '--', sep="")
 
         # Now print the Y-Axis and for each X-Axis it's element. If it's a
         # integer or float print is as integer. If the element is not a
         # number use the LEGEND to get it's map representation. In both
         # cases print it right assigned with a length of two ({0:2>}).
-        for y in range(len(Y_SET)):
-            print( "{0:2}|".format(Y_SET[y]), end="")
-            for x in range(len(X_SET)):
-                val = self.map.get((x,y), None)
+        width = len(self.x_coor)
+        for row, y in enumerate(self.y_coor):
+            print( "{0:2}|".format(y), end="")
+            for val in self.map[row * width:(row + 1) * width]:
                 if isinstance(val, (int,float)):
                     print("{0:>2}".format(int(val)), end='')
                 else:
-                    print("{0:>2}".format(LEGENDE[val]), end='')
+                    print("{0:>2}".format(_LEGENDE[val]), end='')
             print()
 
 
@@ -187,59 +237,39 @@ class Map(object):
         if status != None and not isinstance(status, set):
             status = {status}
 
-        # Second enhancement: neighbour() can act recursivly, so I needed
-        # the initial 'fields' for the final condition and save them in
-        # 'koor_last'.
-        koor_last = fields
-
         # How I do the calculation?
-        # I create two list of potential coordinates, one for the X-axis and
-        # the other for the Y-axis. I put all the possible coordinates into
-        # them (eg. for X-axis that is: x, x-1, x+1).
-        result_set = set()
+        # I take the cell of each field and all the cells around it (if
+        # they are on the map) and keep the cells with the right status.
+        cells, coors, state, around = self.cells, self.coors, self.map, self.around
+        found = set()
         for koor in fields:
-            (x, y) = koor
-            pot_x = (x,)
-            pot_y = (y,)
-
-            # calculate all possible x and y coordinates
-            # left and right
-            if x-1 in range(len(X_SET)):
-                pot_x = pot_x + (x-1,)
-            if x+1 in range(len(X_SET)):
-                pot_x = pot_x + (x+1,)
-
-            # up and down
-            if y-1 in range(len(Y_SET)):
-                pot_y = pot_y + (y-1,)
-            if y+1 in range(len(Y_SET)):
-                pot_y = pot_y + (y+1,)
-
-            # I loop through all the possible coordinates and add them to
-            # the result set if the status of the field is right.
-            # add all possible coordinates
-            for xi in pot_x:
-                for yi in pot_y:
-                    stat = self.get((xi,yi))
-                    if status == None or stat in status:
-                        result_set.add( (xi,yi) )
-
-            # Oh, the recursive thing!
-            # First check the 'recursive' flag and the final condition. That
-            # is: end recursion if initial field set and calculated field
-            # set have equal size. If not: call neighbour function again
-            # with the result set as input fields.
-            if recursive and len(result_set - koor_last) > 0:
-                result_set = self.neighbours(
-                    result_set, status, recursive=True, include=True
-                )
+            for n in around[cells[koor]]:
+                if status == None or state[n] in status:
+                    found.add(n)
+
+        # Second enhancement: neighbours() can act recursivly.
+        # Earlier this function called itself again and again, which was
+        # slow and too deep for big regions. Now I only look at the cells
+        # found in the last round (the 'frontier') until no new cells are
+        # found anymore.
+        if recursive:
+            frontier = found
+            while frontier:
+                new = set()
+                for c in frontier:
+                    for n in around[c]:
+                        if n in found or n in new: continue
+                        if status == None or state[n] in status:
+                            new.add(n)
+                found |= new
+                frontier = new
+
+        result_set = {coors[n] for n in found}
 
         # Third enhancement: do remove the initial fields from the result
         # set. This is very practical if you try to mark all fields around
         # of a ship as water...
         if not include:
-            #FIXME: if this is recursive, 'fields' do not hold the _inital_
-            #       set of fields!
             for koor in fields:
                 if koor in result_set: result_set.remove(koor)
 
@@ -247,8 +277,9 @@ class Map(object):
         # result set (eg. get all 'diagonal' fields of a field which was
         # hit)
         if check != None:
-            # I use only the first field for the calculation
-            field = fields.pop()
+            # I use only the first field for the calculation (and leave
+            # the caller's set alone)
+            field = next(iter(fields))
 
             # To do the calculation I define the QSUM of a coordinate as
             # QSUM := (x+y)%2
@@ -261,14 +292,20 @@ class Map(object):
             # Instead of comparing both of the QSUMs I add one to the
             # field's QSUM if we to check the 'even' fields. So I can
             # easily compare the values directly.
-            qsum = (field[0] + field[1]) % 2
+            # (The coordinates may be letters, so I use their positions
+            # on the axes.)
+            x_pos, y_pos = self.x_pos, self.y_pos
+            def position(k):
+                return x_pos[k[0]] + y_pos[k[1]]
+
+            qsum = position(field) % 2
             if check == 'even':
-                qsum = (field[0] + field[1] + 1) % 2
+                qsum = (position(field) + 1) % 2
 
             # Compute the QSUM of each field and take only the fields which
             # QSUM equals with the computed value above.
             result_set = set([k for k in result_set
-                if (k[0] + k[1]) % 2 == qsum
+                if position(k) % 2 == qsum
             ])
 
         return result_set
@@ -299,8 +336,8 @@ class Map(object):
         (default :None).
         """
         assert size >  0, "size must be > 0"
-        assert size <= max(len(X_SET), len(Y_SET)), \
-            "size must not be greater then Y_SET and X_SET"
+        assert size <= max(len(self.x_coor), len(self.y_coor)), \
+            "size must not be greater then the axes of the map"
 
         # Oh, I am searching for a much shorter variant for this function.
         # Let's bbegin to talk about it.
@@ -308,70 +345,28 @@ class Map(object):
         # First I initialize the result list.
         positions = []
 
-        # I will searching first for all regions which lying on the X-axis.
-        # Afterwards I do the same searching on the Y-axis. So this code has
-        # it's code doubled -- just the axis are swapped.
+        # I will searching first for all regions which lying on the X-axis
+        # (the columns), afterwards I do the same on the Y-axis (the rows).
+        # A line is a range of cell numbers: a column goes down in steps of
+        # the width, a row in steps of one.
+        width, height = len(self.x_coor), len(self.y_coor)
+        lines = [range(x, width * height, width) for x in range(width)] + \
+            [range(y * width, (y + 1) * width) for y in range(height)]
 
-        # Loop through X_SET and Y_SET, in that order.
-        for x in range(len(X_SET)):
+        coors, state = self.coors, self.map
+        for line in lines:
             # This is the list of the coordinates that may (or may not)
-            # build a region of the wanted size.
+            # build a region of the wanted size. I add all coordinates of
+            # fields with 'status' until there is another one. Then I see
+            # if we have enough coordinates for a region of 'size'.
             pos = []
-            for y in range(len(Y_SET)):
-
-                # I add all coodinates of empty fields into the 'pos' list
-                # until there is a field which is set.
-                if status == None:
-                    if (x,y) not in self.map:
-                        pos.append((x,y))
-                    else:
-                        # Have we enough coordinates to build a region with
-                        # a minimum of 'size'?
-                        # If we have, append the 'pos' list as region to the
-                        # result list and pass otherwise. And do not forget
-                        # to empty the 'pos' list!
-                        if len(pos) >= size:
-                            positions.append(pos)
-                        else:
-                            pass
-                        pos = []
-
-                # Here I have to add only fields with a special status. This
-                # is quite equal to the code above.
+            for n in line:
+                if state[n] == status:
+                    pos.append(coors[n])
                 else:
-                    if status == self.get((x,y)):
-                        pos.append((x,y))
-                    else:
-                        if len(pos) >= size:
-                            positions.append(pos)
-                        pos = []
-            if len(pos) >= size:
-                positions.append(pos); #print(x,y, 'got region', pos)
-
-        # Now I have done the vertical regions, now we have to do the same,
-        # just copy the code above and swap X_SET and Y_SET.
-        # It is quite a shame, but I have no idea yet to simplify the
-        # code...
-        for y in range(len(Y_SET)):
-            pos = []
-            for x in range(len(X_SET)):
-                if status == None:
-                    if (x,y) not in self.map:
-                        pos.append((x,y))
-                    else:
-                        if len(pos) >= size:
-                            positions.append(pos)
-                        else:
-                            pass
-                        pos = []
-
-                else:
-                    if status == self.get((x,y)):
-                        pos.append((x,y))
-                    else:
-                        if len(pos) >= size:
-                            positions.append(pos)
-                        pos = []
+                    if len(pos) >= size:
+                        positions.append(pos)
+                    pos = []
             if len(pos) >= size:
                 positions.append(pos)
 
@@ -442,6 +437,57 @@ class Test_Map(unittest.TestCase):
         self.assertFalse(m.is_valid_coor(('a',1)), "check invalid coor")
         self.assertFalse(m.is_valid_coor(('A',4)), "check invalid coor")
 
+    def test_axes(self):
+        m = Map("ABCDEFGHIJKL", range(1,6))
+        self.assertEqual(12 * 5, len(m.get_fields()), "all fields unknown")
+
+        m.set(('L',5), 'water')
+        self.assertEqual({('K',4), ('K',5), ('L',4)}, m.neighbours({('L',5)}))
+        self.assertEqual({('K',4)}, m.neighbours({('L',5)}, check='odd'))
+
+        # the rows are longer than the columns
+        self.assertEqual(5 + 12 - 1, len(m.regions(5)))
+        self.assertEqual(12 * 5 - 1, len(Map(initial_map=m).get_fields()))
+
+    def test_interned(self):
+        m = Map("ABC", range(1,4))
+        m.set(('B',2), 'hit')
+
+        # the same coordinate objects all the time, and no __dict__
+        found = m.neighbours({('A',1)}, include=True)
+        self.assertIn(('B',2), found)
+        for coor in found:
+            self.assertIs(m.coors[m.cells[coor]], coor)
+        self.assertFalse(hasattr(Coor(1,2), '__dict__'))
+
+        # a copy has its own status but shares the tables
+        other = Map(initial_map=m)
+        other.set(('A',1), 'water')
+        self.assertEqual(None, m.get(('A',1)))
+        self.assertIs(m.coors, other.coors)
+        self.assertIs(m.around, Map("ABC", "123").around)
+
+    def test_legende(self):
+        # my copy of the status is the one of the game
+        from battleships import LEGENDE
+        self.assertEqual(LEGENDE, _LEGENDE)
+
+    def test_recursive(self):
+        # a region much bigger than the recursion limit allows
+        m = Map(tuple(range(100)), tuple(range(100)))
+        m.set_fields([(x, 50) for x in range(100)], 'water')
+        m.set((0, 0), 'hit')
+        upper = m.neighbours({(5, 5)}, {None}, include=True, recursive=True)
+        self.assertEqual(100 * 50 - 1, len(upper))
+        self.assertNotIn((0, 0), upper)
+        self.assertNotIn((5, 60), upper)
+
+        # the fields asked for are not in the result
+        water = m.neighbours({(0, 50), (1, 50)}, 'water', recursive=True)
+        self.assertEqual(98, len(water))
+        self.assertNotIn((0, 50), water)
+        self.assertEqual(set(), m.neighbours({(0, 0)}, 'hit', recursive=True))
+
 
 
 if __name__ == '__main__':
@@ -0,0 +1,513 @@
+#! /usr/bin/env python3
+# A map of tiles for very big 'battleships' maps.
+#
+#   Copyright 2012 Olaf Ohlenmacher
+#
+#   This file is part of battleships.
+#
+#   Battleships is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Battleships is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with battleships.  If not, see <http://www.gnu.org/licenses/>.
+
+# On a map of 1000x1000 fields nearly all fields stay unknown for a long
+# time. This map cuts the map into tiles of TILE x TILE fields. A tile is
+# only created when one of its fields gets a status -- a missing tile is
+# a tile of unknown fields. Each tile is a bytearray with one byte per
+# field (the code of its status, like ArrayMap), and for each tile I
+# count the fields of each status.
+#
+# So the questions the KI asks all the time ("where are the hit fields?",
+# "give me some unknown fields") only look at the tiles which were
+# touched, not at the whole map.
+
+import random
+import sys
+import unittest
+
+from battleships import X_SET, Y_SET, STATUS_SET, SHIP_STATUS, render_map, \
+    random_map
+
+
+# The size of a tile (fields per side) and its shift (TILE = 1 << SHIFT).
+SHIFT = 6
+TILE  = 1 << SHIFT
+
+# The status and its code in a tile. The index of a status in this tuple
+# is its code, so unknown fields are 0.
+STATUS = (None, 'water', 'hit', 'sunk', 'ship')
+CODE = {status: code for code, status in enumerate(STATUS)}
+
+
+class TileMap(object):
+    """
+    Create a map object which holds the field status in tiles which are
+    created when they are needed. It has the same interface as
+    battleships.Map and can be used as drop-in for the maps of a Player.
+    """
+
+    def __init__(self, newmap=None, width=None, height=None):
+        if width == None: width = len(X_SET)
+        if height == None: height = len(Y_SET)
+
+        self.width  = width
+        self.height = height
+        self.across = (width + TILE - 1) >> SHIFT
+        self.down   = (height + TILE - 1) >> SHIFT
+
+        # the tiles and the number of fields of each status per tile
+        # (only the fields on the map), both by the number of the tile:
+        # ty * across + tx
+        self.tiles  = {}
+        self.counts = {}
+
+        # the number of all known fields
+        self.known = 0
+
+        if newmap != None:
+            for koor, status in newmap.items():
+                self.set(koor, status)
+
+
+    def _tile_area(self, t):
+        # the number of fields of tile 't' which are on the map
+        tx, ty = t % self.across, t // self.across
+        return min(TILE, self.width - (tx << SHIFT)) * \
+            min(TILE, self.height - (ty << SHIFT))
+
+
+    def _tile_fields(self, t, code):
+        # all fields of tile 't' with 'code'
+        tile = self.tiles.get(t)
+        x0 = (t % self.across) << SHIFT
+        y0 = (t // self.across) << SHIFT
+        fields = []
+
+        if tile == None:
+            if code == 0:
+                for y in range(y0, min(y0 + TILE, self.height)):
+                    for x in range(x0, min(x0 + TILE, self.width)):
+                        fields.append((x, y))
+            return fields
+
+        i = tile.find(code)
+        while i >= 0:
+            x, y = x0 + (i & (TILE - 1)), y0 + (i >> SHIFT)
+            # (the tiles at the right and lower edge are bigger than the
+            # map, their unknown fields outside do not count)
+            if x < self.width and y < self.height:
+                fields.append((x, y))
+            i = tile.find(code, i + 1)
+        return fields
+
+
+    def _adjacent(self, koor):
+        # all (valid) fields around 'koor' -- without 'koor' itself
+        (x, y) = koor
+        for xi in (x-1, x, x+1):
+            if xi < 0 or xi >= self.width: continue
+            for yi in (y-1, y, y+1):
+                if yi < 0 or yi >= self.height: continue
+                if xi != x or yi != y: yield (xi, yi)
+
+
+    def count(self, status=None):
+        """
+        Returns the number of fields with 'status'.
+        """
+        if status == None:
+            return self.width * self.height - self.known
+        code = CODE[status]
+        return sum(counts[code] for counts in self.counts.values())
+
+
+    def sample_unknown(self, limit, rand=None):
+        """
+        Returns a random sample of at most 'limit' unknown fields (all of
+        them, if there are not more).
+        """
+        if rand == None: rand = random
+        unknown = self.count(None)
+        if unknown <= limit:
+            return self.get_fields(None)
+
+        # If many fields are unknown, I find them fast by chance.
+        fields = set()
+        if 4 * unknown >= self.width * self.height:
+            while len(fields) < limit:
+                koor = (rand.randrange(self.width), rand.randrange(self.height))
+                if self.get(koor) == None: fields.add(koor)
+            return fields
+
+        # Otherwise I choose a tile by the number of its unknown fields
+        # first and then a field of this tile.
+        tiles = range(self.across * self.down)
+        weights = [
+            self.counts[t][0] if t in self.counts else self._tile_area(t)
+            for t in tiles
+        ]
+        candidates = {}
+        while len(fields) < limit:
+            t = rand.choices(tiles, weights)[0]
+            if t not in candidates:
+                candidates[t] = self._tile_fields(t, 0)
+            fields.add(rand.choice(candidates[t]))
+        return fields
+
+
+    ## the interface of battleships.Map
+
+    def get(self, koor):
+        """
+        Returns status of a field.
+        """
+        assert isinstance(koor,tuple),	"request tuple for coordinates"
+        assert len(koor) == 2,			"need two coordinates"
+
+        (x, y) = koor
+        tile = self.tiles.get((y >> SHIFT) * self.across + (x >> SHIFT))
+        if tile == None: return None
+        return STATUS[tile[((y & (TILE - 1)) << SHIFT) + (x & (TILE - 1))]]
+
+
+    def get_fields(self, status=None):
+        """
+        Returns fields with 'status' (default: unknown status)
+        """
+        # The unknown fields are everywhere, so I have to look at all
+        # tiles. All other fields are in the tiles with fields of their
+        # status.
+        code = CODE[status]
+        if code == 0:
+            tiles = range(self.across * self.down)
+        else:
+            tiles = [t for t, counts in self.counts.items() if counts[code] > 0]
+
+        fields = set()
+        for t in tiles:
+            fields.update(self._tile_fields(t, code))
+        return fields
+
+
+    def set(self, koor, status):
+        """
+        Set status of a field.
+        """
+        assert isinstance(koor,tuple),	"request tuple for coordinates"
+        assert len(koor) == 2,			"need two coordinates"
+        assert status in STATUS_SET,	"status must be STATUS_SET element"
+
+        (x, y) = koor
+        t = (y >> SHIFT) * self.across + (x >> SHIFT)
+        code = CODE[status]
+        tile = self.tiles.get(t)
+        if tile == None:
+            if code == 0: return
+            tile = self.tiles[t] = bytearray(TILE * TILE)
+            self.counts[t] = [0] * len(STATUS)
+            self.counts[t][0] = self._tile_area(t)
+
+        i = ((y & (TILE - 1)) << SHIFT) + (x & (TILE - 1))
+        old = tile[i]
+        if old == code: return
+        tile[i] = code
+
+        counts = self.counts[t]
+        counts[old] -= 1
+        counts[code] += 1
+        self.known += (code != 0) - (old != 0)
+
+        # a tile without any known field is not needed anymore
+        if code == 0 and counts[0] == self._tile_area(t):
+            del self.tiles[t]
+            del self.counts[t]
+        return
+
+
+    def set_fields(self, fields, status):
+        """
+        Set a list of fields to given status
+        """
+        assert isinstance(fields, (set,list,tuple)), \
+            "'fields' must be a list or tuple of coordinates eg. '[(1,4)]'"
+
+        for koor in fields:
+            self.set(koor, status)
+        return
+
+
+    def print(self):
+        sys.stdout.write(self.render())
+
+
+    def render(self):
+        """
+        Returns the map as string, as print() shows it.
+        """
+        return render_map(self)
+
+
+    __str__ = render
+
+
+    def neighbours(self, fields, status=None, include=False, recursive=False, check=None):
+        """
+        Returns all neighbour fields of the given field list.
+        If 'status' is not None, only fields which status is 'status' will be
+        returned.
+        If 'include' is True, fields will be included into the result.
+        If 'recursive' is True, all reachable fields are returned.
+        """
+        assert isinstance(fields, set), "'fields' must be set of coordinates"
+        assert check == None or check != None and len(fields) == 1,\
+            "check only supported for single fields yet"
+        assert check == None or check == 'odd' or check == 'even',\
+            "check only supports values: None, odd, even"
+
+        if status != None and not isinstance(status, set):
+            status = {status}
+
+        # the same as battleships.Map does, but with get()
+        result = set()
+        for koor in fields:
+            for f in ((koor,) + tuple(self._adjacent(koor))):
+                if status == None or self.get(f) in status:
+                    result.add(f)
+
+        if recursive:
+            frontier = result
+            while frontier:
+                found = set()
+                for koor in frontier:
+                    for f in self._adjacent(koor):
+                        if f in result or f in found: continue
+                        if status == None or self.get(f) in status:
+                            found.add(f)
+                result |= found
+                frontier = found
+
+        if not include:
+            result -= fields
+
+        if check != None:
+            (x, y) = next(iter(fields))
+            qsum = (x + y) % 2
+            if check == 'even':
+                qsum = (x + y + 1) % 2
+            result = {k for k in result if (k[0] + k[1]) % 2 == qsum}
+
+        return result
+
+
+    def surround_with(self, field, status, what=None):
+        """
+        Set the surrounding fields of a region. The region is calculated from
+        one field and all neighbouring fields with equal status.
+        Returns the fields which were set.
+        """
+        fields = self.neighbours(self.get_region(field), status=what)
+        self.set_fields(fields, status)
+
+        return fields
+
+
+    def find_ship(self, koor):
+        """
+        Returns the identifier (a field) of the ship at 'koor' or None if
+        there is no ship field.
+        """
+        ship = self.get_ship(koor)
+        if len(ship) == 0: return None
+        return min(ship)
+
+
+    def get_ship(self, koor):
+        """
+        Returns all fields of the ship at 'koor' -- all connected fields
+        with a status of SHIP_STATUS.
+        """
+        if self.get(koor) not in SHIP_STATUS: return set()
+        return self.neighbours(
+            {koor}, SHIP_STATUS, include=True, recursive=True
+        )
+
+
+    def get_region(self, field, what=None):
+        """
+        Returns a region containing 'field' and all fields with equal
+        status surrounding it.
+        If 'what' is set surrounding fields must have field status 'what'.
+        """
+        if what == None:
+            what = self.get(field)
+
+        return self.neighbours(
+            {field}, what, include=True, recursive=True
+        )
+
+
+    def _line(self, n, vertical):
+        # the codes of row 'n' (or column 'n') -- missing tiles are zeros
+        if vertical:
+            tx, i = n >> SHIFT, n & (TILE - 1)
+            line = bytearray()
+            for ty in range(self.down):
+                tile = self.tiles.get(ty * self.across + tx)
+                if tile == None:
+                    line += bytes(TILE)
+                else:
+                    line += tile[i::TILE]
+            return line[:self.height]
+
+        ty, i = n >> SHIFT, n & (TILE - 1)
+        line = bytearray()
+        for tx in range(self.across):
+            tile = self.tiles.get(ty * self.across + tx)
+            if tile == None:
+                line += bytes(TILE)
+            else:
+                line += tile[i << SHIFT:(i + 1) << SHIFT]
+        return line[:self.width]
+
+
+    def regions(self, size=1, status=None):
+        """
+        Returns a list of regions of a minimal size with fields status
+        (default :None).
+        """
+        assert size >  0, "size must be > 0"
+        assert size <= max(self.width, self.height), \
+            "size must not be greater then the width and height of the map"
+
+        # The runs of 'status' in each column and then in each row, like
+        # battleships.Map finds them.
+        code = CODE[status]
+        positions = []
+        for vertical, lines in ((True, self.width), (False, self.height)):
+            for n in range(lines):
+                line = self._line(n, vertical)
+                start = None
+                for i in range(len(line) + 1):
+                    if i < len(line) and line[i] == code:
+                        if start == None: start = i
+                        continue
+                    if start != None and i - start >= size:
+                        if vertical:
+                            positions.append([(n, k) for k in range(start, i)])
+                        else:
+                            positions.append([(k, n) for k in range(start, i)])
+                    start = None
+        return positions
+
+
+class Test_TileMap(unittest.TestCase):
+    def setUp(self):
+        self.dict_map = random_map(4711)
+        self.tile_map = TileMap(dict(self.dict_map.map))
+
+    def test_get_fields(self):
+        for status in (None, 'water', 'hit', 'sunk', 'ship'):
+            self.assertEqual(
+                self.dict_map.get_fields(status),
+                self.tile_map.get_fields(status)
+            )
+            self.assertEqual(
+                len(self.dict_map.get_fields(status)),
+                self.tile_map.count(status)
+            )
+
+    def test_neighbours(self):
+        for field in ((0,0), (4,5), (9,9)):
+            self.assertEqual(
+                self.dict_map.neighbours({field}, None),
+                self.tile_map.neighbours({field}, None)
+            )
+            self.assertEqual(
+                self.dict_map.get_region(field, {'hit', 'ship'}),
+                self.tile_map.get_region(field, {'hit', 'ship'})
+            )
+            self.assertEqual(
+                self.dict_map.neighbours({field}, check='odd'),
+                self.tile_map.neighbours({field}, check='odd')
+            )
+
+    def test_render(self):
+        self.assertEqual(self.dict_map.render(), self.tile_map.render())
+        self.assertEqual(self.dict_map.render(), str(self.tile_map))
+
+    def test_regions(self):
+        for size in range(1, 6):
+            self.assertEqual(
+                self.dict_map.regions(size),
+                self.tile_map.regions(size)
+            )
+
+    def test_many_tiles(self):
+        # a map of 3x3 tiles, the regions go over the edges of the tiles
+        dict_map = random_map(4712, 150, 130)
+        tile_map = TileMap(dict(dict_map.map), 150, 130)
+        self.assertEqual(9, len(tile_map.tiles))
+        for status in (None, 'water', 'hit', 'ship'):
+            self.assertEqual(dict_map.get_fields(status), tile_map.get_fields(status))
+            self.assertEqual(dict_map.count(status), tile_map.count(status))
+        for t, counts in tile_map.counts.items():
+            self.assertEqual(tile_map._tile_area(t), sum(counts))
+        for size in (1, 3, 5):
+            self.assertEqual(dict_map.regions(size), tile_map.regions(size))
+        for field in ((63,63), (64,64), (63,64), (127,0), (128,129), (149,65)):
+            self.assertEqual(
+                dict_map.neighbours({field}, None),
+                tile_map.neighbours({field}, None)
+            )
+            self.assertEqual(
+                dict_map.neighbours({field}, check='odd'),
+                tile_map.neighbours({field}, check='odd')
+            )
+            self.assertEqual(
+                dict_map.get_region(field, {'hit', 'ship'}),
+                tile_map.get_region(field, {'hit', 'ship'})
+            )
+        self.assertEqual(dict_map.render(), tile_map.render())
+
+    def test_big_map(self):
+        m = TileMap(width=1000, height=1000)
+        m.set_fields([(5,5), (999,999), (500,70)], 'hit')
+        self.assertEqual(3, len(m.tiles))
+        self.assertEqual({(5,5), (999,999), (500,70)}, m.get_fields('hit'))
+        self.assertEqual(1000 * 1000 - 3, m.count(None))
+
+        # a tile without known fields is dropped again
+        m.set((500,70), None)
+        self.assertEqual(2, len(m.tiles))
+
+        rand = random.Random(1)
+        sample = m.sample_unknown(10, rand)
+        self.assertEqual(10, len(sample))
+        for koor in sample:
+            self.assertEqual(None, m.get(koor))
+
+    def test_sample_unknown(self):
+        # nearly everything is known: only one column is left
+        m = TileMap(width=100, height=70)
+        for x in range(99):
+            m.set_fields([(x, y) for y in range(70)], 'water')
+        sample = m.sample_unknown(20, random.Random(2))
+        self.assertEqual(20, len(sample))
+        self.assertEqual({99}, {x for (x, y) in sample})
+        self.assertEqual(70, len(m.sample_unknown(100)))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#EOF
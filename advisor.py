@@ -0,0 +1,626 @@
+#! /usr/bin/env python3
+# A service which tells what the KI would play.
+#
+#   Copyright 2012 Olaf Ohlenmacher
+#
+#   This file is part of battleships.
+#
+#   Battleships is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Battleships is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with battleships.  If not, see <http://www.gnu.org/licenses/>.
+
+# Sometimes I only want to know where the KI would shoot on some board,
+# without playing a whole game. The advisor is a small HTTP service for
+# this (no web framework, only asyncio). A board is posted as JSON:
+#
+#   POST /move
+#   {
+#     "map":   ["..........",      the open map, one row per line, the
+#               "..o+......",      signs of the LEGENDE (no '#')
+#               ...],
+#     "fleet": [5, 4, 4, 3],       sizes of the foe's ships not sunk yet
+#                                  (default: all ships of SHIPS)
+#     "level": 50,                 the KI level (default: 50)
+#     "last":  "d2",               the last shot (optional)
+#     "seed":  1,                  for the random choices (optional)
+#     "rates": true                add the rates of all unknown fields
+#   }
+#
+#   -> {"move": "E2", "best": ["C2", "E2"], "rate": 20, "rates": {...}}
+#
+#   GET /stats
+#   -> {"requests": ..., "busy": ..., "p50": ..., "p99": ..., ...}
+#
+# The KI thinks in a pool of processes -- the event loop only reads and
+# writes. Sending each board to a process on its own costs more than
+# most boards take to think about, so the requests are collected into
+# batches: the first request waits at most BATCH_WAIT seconds for others
+# (or until BATCH are there), then the whole batch goes to one process
+# at once. Equal boards of a batch are only thought about once. While
+# all processes are busy, the requests wait in a queue of MAX_QUEUE --
+# if that is full, the service answers '503 busy' at once instead of
+# letting everybody wait longer and longer.
+
+import asyncio
+import concurrent.futures
+import json
+import os
+import random
+import sys
+import threading
+import time
+import unittest
+import unittest.mock
+from collections import Counter
+
+from battleships import Player, Map, SHIPS, LEGENDE, as_xy, as_koor
+from instrument import Stats
+from TileMap import TileMap
+
+
+# the limits of the service
+BATCH      = 32         # boards in one batch
+BATCH_WAIT = 0.002      # seconds a request waits for others
+MAX_QUEUE  = 1024       # requests waiting for a process
+MAX_BODY   = 65536      # bytes of a request
+MAX_SIZE   = 200        # width and height of a map
+LINE_LIMIT = 8192       # bytes of a header line
+
+# the status of each sign of an open map (there are no ships on it)
+STATUS = {sign: status for status, sign in LEGENDE.items() if status != 'ship'}
+
+# the names of the ships by size
+NAMES = {s['size']: s['name'] for s in SHIPS}
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           413: 'Payload Too Large', 500: 'Internal Server Error',
+           503: 'Service Unavailable'}
+
+
+def parse_board(board):
+    """
+    Returns a KI Player which sees the board 'board' (a dictionary, see
+    above) as its open map. Raises ValueError if the board is wrong.
+    """
+    if not isinstance(board, dict):
+        raise ValueError("the board must be an object")
+    rows = board.get('map')
+    if not isinstance(rows, list) or len(rows) == 0 \
+       or not all(isinstance(row, str) for row in rows):
+        raise ValueError("'map' must be a list of rows")
+    width, height = len(rows[0]), len(rows)
+    if any(len(row) != width for row in rows) or width == 0:
+        raise ValueError("all rows of 'map' must have the same length")
+    if width > MAX_SIZE or height > MAX_SIZE:
+        raise ValueError("the map is bigger than {0}x{0}".format(MAX_SIZE))
+
+    level = board.get('level', 50)
+    if not isinstance(level, int) or level not in range(101):
+        raise ValueError("'level' must be a number from 0 to 100")
+
+    fleet = board.get('fleet', [s['size'] for s in SHIPS for n in range(s['num'])])
+    if not isinstance(fleet, list) or len(fleet) == 0 or not all(
+        isinstance(size, int) and 0 < size <= max(width, height) for size in fleet
+    ):
+        raise ValueError("'fleet' must be a list of ship sizes")
+
+    seed = board.get('seed')
+    if not isinstance(seed, (int, str, type(None))):
+        raise ValueError("'seed' must be a number or a string")
+
+    # big maps like TileMap (as in simulation.py)
+    player = Player(ki=True, level=level, rand=random.Random(seed),
+                    map_class=Map if width * height <= 32 * 32 else TileMap,
+                    width=width, height=height)
+    for y, row in enumerate(rows):
+        for x, sign in enumerate(row):
+            if sign not in STATUS:
+                raise ValueError("unknown sign '{}' in 'map'".format(sign))
+            if STATUS[sign] != None:
+                player.hits.set((x, y), STATUS[sign])
+    if player.hits.count(None) == 0:
+        raise ValueError("there is no unknown field left")
+
+    player.save_foes_ships([
+        {'size': size, 'num': num, 'name': NAMES.get(size, str(size))}
+        for size, num in sorted(Counter(fleet).items(), reverse=True)
+    ])
+
+    # Without a last shot the KI would shoot at random. So I give it a
+    # last shot which tells nothing.
+    player.last_result = (None, None)
+    if board.get('last') != None:
+        koor = as_koor(str(board['last']), width, height)
+        if koor == None or player.hits.get(koor) == None:
+            raise ValueError("'last' must be a known field of the map")
+        player.last_result = (koor, player.hits.get(koor))
+    return player
+
+
+def advise(board):
+    """
+    Returns the answer for one board: the move of the KI, all best moves
+    and their rate -- and the rates of all unknown fields, if asked for.
+    """
+    player = parse_board(board)
+    target_map = player._best_moves()
+    best_rate = max(target_map.values())
+    best = sorted(k for k, v in target_map.items() if v == best_rate)
+
+    answer = {
+        'move': as_xy(player.rand.choice(best)),
+        'best': [as_xy(k) for k in best],
+        'rate': best_rate,
+    }
+    if board.get('rates'):
+        rates = player._rate_unknown_fields(player.foeships.largest)
+        answer['rates'] = {as_xy(k): v for k, v in sorted(rates.items())}
+    return answer
+
+
+def player_board(player, **more):
+    """
+    Returns the board of the open map of 'player' (the reverse of
+    parse_board()), with the entries 'more'.
+    """
+    hits = player.hits
+    board = {
+        'map': ["".join(LEGENDE[hits.get((x, y))] for x in range(player.width))
+                for y in range(player.height)],
+        'fleet': sorted(
+            [size for size, names in player.foeships.names.items() for n in names],
+            reverse=True
+        ),
+        'level': player.ki_level,
+    }
+    if player.last_result != None and player.last_result[0] != None:
+        board['last'] = as_xy(player.last_result[0])
+    board.update(more)
+    return board
+
+
+def _json(data):
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def evaluate(bodies):
+    """
+    Returns the answers for a batch of requests (their bodies): a tuple
+    of the HTTP status and the JSON of the answer for each of them. This
+    runs in the processes of the pool.
+    """
+    answers = {}
+    for body in bodies:
+        if body in answers: continue
+        try:
+            answers[body] = 200, _json(advise(json.loads(body)))
+        except ValueError as e:
+            # (json.JSONDecodeError is a ValueError, too)
+            answers[body] = 400, _json({'error': str(e)})
+        except Exception:
+            # a bug of mine -- but only this board gets no answer, not the
+            # whole batch
+            answers[body] = 500, _json({'error': 'internal error'})
+    return [answers[body] for body in bodies]
+
+
+def _response(code, data, keep=True):
+    return "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n" \
+        "Content-Length: {}\r\nConnection: {}\r\n\r\n".format(
+            code, REASONS[code], len(data), 'keep-alive' if keep else 'close'
+        ).encode() + data
+
+
+class Advisor(object):
+    """
+    The service with 'workers' processes (default: number of CPUs). Or
+    another 'executor', eg. a ThreadPoolExecutor.
+    """
+
+    def __init__(self, workers=None, batch=BATCH, wait=BATCH_WAIT,
+                 max_queue=MAX_QUEUE, executor=None):
+        if workers == None: workers = os.cpu_count() or 1
+        self.workers  = workers
+        self.batch    = batch
+        self.wait     = wait
+        self.max_queue = max_queue
+        self.executor = executor
+        self.own_executor = executor == None
+
+        self.queue    = None     # (body, future) of the waiting requests
+        self.batcher  = None
+        self.collecting = []     # the batch the batcher is making
+        self.closing  = False
+        self.running  = set()    # the batches being thought about
+        self.server   = None
+
+        # the time from the request to the answer, and of the batches
+        # (their 'cells' are the number of requests)
+        self.latency  = Stats()
+        self.batches  = Stats()
+        self.busy     = 0        # requests turned away
+
+
+    async def start(self, host='127.0.0.1', port=0):
+        """
+        Start the service and return its port.
+        """
+        if self.executor == None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(self.workers)
+        self.closing = False
+        self.queue = asyncio.Queue(self.max_queue)
+        self.batcher = asyncio.ensure_future(self._collect())
+        self.server = await asyncio.start_server(
+            self.handle, host, port, limit=LINE_LIMIT
+        )
+        return self.server.sockets[0].getsockname()[1]
+
+
+    async def close(self):
+        # No request may wait forever: the ones in the queue and in the
+        # batch being made are turned away, and so are new ones.
+        self.closing = True
+        self.server.close()
+        closed = 503, _json({'error': 'closed'})
+        waiting = self.collecting
+        while not self.queue.empty():
+            waiting.append(self.queue.get_nowait())
+        for body, future in waiting:
+            if not future.done(): future.set_result(closed)
+        self.collecting = []
+        self.batcher.cancel()
+        await self.server.wait_closed()
+        if self.own_executor:
+            self.executor.shutdown()
+
+
+    async def move(self, body):
+        """
+        Returns the HTTP status and the answer for the request 'body'.
+        """
+        start = time.perf_counter_ns()
+        if self.closing:
+            return 503, _json({'error': 'closed'})
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((body, future))
+        except asyncio.QueueFull:
+            self.busy += 1
+            return 503, _json({'error': 'busy'})
+        answer = await future
+        self.latency.add(time.perf_counter_ns() - start, 0)
+        return answer
+
+
+    async def _collect(self):
+        # Make the batches: as soon as a process is free I take the
+        # first request, and all others which come in within 'wait'.
+        loop = asyncio.get_running_loop()
+        free = asyncio.Semaphore(self.workers)
+        while True:
+            await free.acquire()
+            self.collecting = batch = [await self.queue.get()]
+            end = loop.time() + self.wait
+            while len(batch) < self.batch:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                try:
+                    batch.append(await asyncio.wait_for(
+                        self.queue.get(), end - loop.time()
+                    ))
+                except asyncio.TimeoutError:
+                    break
+            self.collecting = []
+            task = loop.create_task(self._evaluate(batch, free))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+
+    async def _evaluate(self, batch, free):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter_ns()
+        executor = self.executor
+        try:
+            answers = await loop.run_in_executor(
+                executor, evaluate, [body for body, future in batch]
+            )
+        except Exception as e:
+            # a process died or the KI has a bug -- the requests must
+            # get an answer anyway
+            answers = [(500, _json({'error': 'internal error'}))] * len(batch)
+            # A pool with a dead process takes no more work. If it is mine
+            # (and no other batch replaced it already), I start a new one.
+            if isinstance(e, concurrent.futures.BrokenExecutor) \
+                    and self.own_executor and self.executor is executor:
+                executor.shutdown(wait=False)
+                self.executor = concurrent.futures.ProcessPoolExecutor(self.workers)
+        finally:
+            free.release()
+        self.batches.add(time.perf_counter_ns() - start, len(batch))
+        for (body, future), answer in zip(batch, answers):
+            if not future.done(): future.set_result(answer)
+
+
+    def report(self):
+        """
+        Returns the statistics of the service: the number of requests
+        answered and turned away, the latency (p50/p99 in seconds) and
+        the size of the batches.
+        """
+        return {
+            'requests':   self.latency.calls,
+            'busy':       self.busy,
+            'queued':     self.queue.qsize() if self.queue != None else 0,
+            'p50':        self.latency.percentile(50),
+            'p99':        self.latency.percentile(99),
+            'batches':    self.batches.calls,
+            'batch_size': self.batches.cells / self.batches.calls
+                          if self.batches.calls else 0,
+        }
+
+
+    async def handle(self, reader, writer):
+        # one connection, many requests (keep-alive)
+        try:
+            while True:
+                line = await reader.readline()
+                words = line.decode('latin-1').split()
+                if len(words) != 3: break
+                method, path, version = words
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line.strip() == b'': break
+                    name, colon, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep = version == 'HTTP/1.1' \
+                    and headers.get('connection', '').lower() != 'close'
+
+                length = headers.get('content-length', '0')
+                if not length.isdigit() or int(length) > MAX_BODY:
+                    writer.write(_response(413, _json({'error': 'too long'}), False))
+                    break
+                body = await reader.readexactly(int(length))
+
+                if method == 'POST' and path == '/move':
+                    code, data = await self.move(body)
+                elif method == 'GET' and path == '/stats':
+                    code, data = 200, _json(self.report())
+                else:
+                    code, data = 404, _json({'error': 'not found'})
+                writer.write(_response(code, data, keep))
+                await writer.drain()
+                if not keep: break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            # (a too long line is a ValueError)
+            pass
+        finally:
+            writer.close()
+
+
+async def http_request(reader, writer, method, path, data=None):
+    """
+    Send a request over a connection to the advisor and return the HTTP
+    status and the answer (decoded from JSON).
+    """
+    body = b'' if data == None else _json(data)
+    writer.write("{} {} HTTP/1.1\r\nHost: advisor\r\nContent-Type: "
+        "application/json\r\nContent-Length: {}\r\n\r\n".format(
+            method, path, len(body)
+        ).encode() + body)
+    status = (await reader.readline()).split()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line.strip() == b'': break
+        name, colon, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return int(status[1]), json.loads(await reader.readexactly(length))
+
+
+class Test_Advisor(unittest.TestCase):
+    BOARD = [
+        "..........",
+        "..o+......",
+        "..........",
+        "...o......",
+        "..........",
+        ".ooo......",
+        ".o*o......",
+        ".o*o......",
+        ".ooo......",
+        "..........",
+    ]
+
+    def test_advise(self):
+        # the KI goes on with the hit ship at d2 -- left or right of it,
+        # the fields above and below are no ship
+        board = {'map': self.BOARD, 'fleet': [5, 4, 3, 3], 'level': 100,
+                 'last': 'D2', 'seed': 1, 'rates': True}
+        answer = advise(board)
+        self.assertEqual(['E2'], answer['best'])
+        self.assertEqual('E2', answer['move'])
+        self.assertNotIn('C3', answer['rates'])
+        self.assertNotIn('D2', answer['rates'])
+        self.assertEqual(answer, advise(board))
+
+        # and back
+        player = parse_board(board)
+        self.assertEqual(dict(board, rates=None, seed=None),
+                         player_board(player, rates=None, seed=None))
+
+    def test_wrong_boards(self):
+        for board in ({'map': ["...", ".."]},
+                      {'map': ["..#", "..."]},
+                      {'map': self.BOARD, 'level': 101},
+                      {'map': self.BOARD, 'fleet': [11]},
+                      {'map': self.BOARD, 'last': 'a1'},
+                      {'map': ["o"]}):
+            self.assertRaises(ValueError, advise, board)
+
+        answers = evaluate([b'{', _json({'map': self.BOARD})])
+        self.assertEqual(400, answers[0][0])
+        self.assertEqual(200, answers[1][0])
+
+    def test_internal_error(self):
+        # one board breaks the KI, the others of the batch get their moves
+        good = _json({'map': [".", "*", "+", "o", ".", ".", "+"], 'fleet': [4, 5],
+                      'seed': 1})
+        bad = _json({'map': self.BOARD})
+        def broken(board, advise=advise):
+            if board == {'map': self.BOARD}: raise IndexError("broken")
+            return advise(board)
+        with unittest.mock.patch(__name__ + '.advise', broken):
+            answers = evaluate([good, bad, good])
+        self.assertEqual([200, 500, 200], [code for code, data in answers])
+        self.assertEqual({'error': 'internal error'}, json.loads(answers[1][1]))
+        self.assertEqual(advise(json.loads(good)), json.loads(answers[0][1]))
+
+    def test_service(self):
+        async def main(executor):
+            advisor = Advisor(workers=2, wait=0.05, executor=executor)
+            port = await advisor.start()
+
+            async def ask(n):
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                answers = []
+                for r in range(3):
+                    answers.append(await http_request(reader, writer, 'POST', '/move',
+                        {'map': self.BOARD, 'seed': n % 4}
+                    ))
+                writer.close()
+                return answers
+
+            answers = await asyncio.gather(*[ask(n) for n in range(20)])
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            stats = await http_request(reader, writer, 'GET', '/stats')
+            missing = await http_request(reader, writer, 'GET', '/nothing')
+            writer.close()
+            await advisor.close()
+            return answers, stats, missing
+
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            answers, stats, missing = asyncio.run(main(executor))
+
+        answers = [a for client in answers for a in client]
+        self.assertEqual(60, len(answers))
+        self.assertTrue(all(code == 200 for code, answer in answers))
+
+        # the same seed gives the same answer
+        self.assertEqual(answers[0], answers[4 * 3])
+
+        code, stats = stats
+        self.assertEqual(200, code)
+        self.assertEqual(60, stats['requests'])
+        self.assertLess(stats['batches'], 60)
+        self.assertGreater(stats['p99'], 0)
+        self.assertEqual(404, missing[0])
+
+    def test_busy(self):
+        async def main():
+            advisor = Advisor(workers=1, max_queue=2,
+                              executor=concurrent.futures.ThreadPoolExecutor(1))
+            await advisor.start()
+            body = _json({'map': self.BOARD})
+            # nothing runs before the first await: the queue is full
+            # after two requests
+            tasks = [asyncio.ensure_future(advisor.move(body)) for n in range(5)]
+            codes = [code for code, data in await asyncio.gather(*tasks)]
+            report = advisor.report()
+            await advisor.close()
+            advisor.executor.shutdown()
+            return codes, report
+        codes, report = asyncio.run(main())
+        self.assertEqual([200, 200, 503, 503, 503], codes)
+        self.assertEqual(3, report['busy'])
+
+
+    def test_close(self):
+        # the waiting requests get an answer when the advisor closes
+        async def main(batch):
+            blocked = threading.Event()
+            executor = concurrent.futures.ThreadPoolExecutor(1)
+            executor.submit(blocked.wait)
+            advisor = Advisor(workers=1, batch=batch, wait=10.0, executor=executor)
+            await advisor.start()
+            body = _json({'map': self.BOARD})
+            tasks = [asyncio.ensure_future(advisor.move(body)) for n in range(4)]
+            await asyncio.sleep(0.05)
+            await advisor.close()
+            late = await advisor.move(body)
+            blocked.set()
+            answers = await asyncio.wait_for(asyncio.gather(*tasks), 5.0)
+            executor.shutdown()
+            return [code for code, data in answers + [late]]
+
+        # the first batch is evaluated, the others wait in the queue
+        self.assertEqual([200, 503, 503, 503, 503], asyncio.run(main(1)))
+        # all of them are in the batch which is being made
+        self.assertEqual([503, 503, 503, 503, 503], asyncio.run(main(10)))
+
+    def test_broken_pool(self):
+        # a process of the pool dies -- the advisor starts a new pool
+        async def main():
+            advisor = Advisor(workers=1)
+            port = await advisor.start()
+            advisor.executor.submit(os._exit, 1)
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            codes = []
+            for n in range(3):
+                code, answer = await http_request(reader, writer, 'POST', '/move',
+                    {'map': self.BOARD, 'seed': 1})
+                codes.append(code)
+                await asyncio.sleep(0.1)
+            writer.close()
+            await advisor.close()
+            return codes
+        codes = asyncio.run(main())
+        # (the first request may still find the dead pool)
+        self.assertEqual([200, 200], codes[1:])
+
+
+# Start the advisor:
+#     python3 advisor.py [port] [number of processes]
+# and ask it:
+#     curl -d '{"map": ["..........", ...]}' localhost:4712/move
+if __name__ == '__main__':
+    port = 4712
+    if len(sys.argv) > 1: port = int(sys.argv[1])
+    workers = None
+    if len(sys.argv) > 2: workers = int(sys.argv[2])
+
+    async def main():
+        advisor = Advisor(workers)
+        await advisor.start('0.0.0.0', port)
+        print("advisor on port {} with {} processes".format(port, advisor.workers))
+
+        # every ten seconds: how is it going?
+        requests = 0
+        while True:
+            await asyncio.sleep(10)
+            report = advisor.report()
+            if report['requests'] == requests: continue
+            requests = report['requests']
+            print("{requests} requests, {busy} busy, p50 {p50:.4f}s, "
+                  "p99 {p99:.4f}s, {batch_size:.1f} per batch".format(**report))
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#EOF
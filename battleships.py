@@ -23,10 +23,11 @@
 # a little bit about python. So I did ;-)
 
 # The 'import' statement reads python modules.
-# For 'battleships' I need some randomness and at one point I need to
-# make a "real" copy of a datastructure. So, I import the module 'copy', too.
+# For 'battleships' I need some randomness and regular expressions.
 import random
-import copy
+import re
+import sys
+import unittest
 
 from Map import *
 
@@ -74,6 +75,14 @@ LEGENDE = {
 # STATUS_SET.
 STATUS_SET = set(LEGENDE.keys())
 
+# These are the status of fields which belong to a ship. Connected fields
+# with one of these status are one ship (ships never touch each other).
+SHIP_STATUS = {'ship', 'hit', 'sunk'}
+
+# A field of a map is printed with two characters: the sign of the
+# LEGENDE right aligned.
+GLYPHS = {status: "{0:>2}".format(sign) for status, sign in LEGENDE.items()}
+
 
 # Here the set of ships are defined which will be placed by all players.
 # It's hard coded -- perhaps some day this will be placed in a config
@@ -97,6 +106,7 @@ LEVEL = {
 # For many thing I need randomness (e.g. the KI) or placing the ships on
 # the map. Because all parts of "battleshps" need random numbers we
 # define it here with global scope.
+# (A Player may get its own random generator, see Player.__init__().)
 #
 RAND = random.Random()
 
@@ -119,10 +129,19 @@ RAND = random.Random()
 # and how to interact with the player.
 class Player(object):
 
+	# On a big map there are very many fields which are equally good for
+	# the KI. It looks at a random sample of SAMPLE of them only.
+	SAMPLE = 64
+
 	# The init functions set all member of this class. It takes two
 	# optional arguments: 'ki' is set to True if this is the computer
-	# player, 'level' to define it's strength.
-	def __init__(self, ki=False, level=50):
+	# player, 'level' to define it's strength. With 'map_class' another
+	# implementation of the maps can be choosen (eg. BitMap). 'rand' is
+	# the random generator of this player (default: the global RAND).
+	# 'width' and 'height' give the size of the maps (default: the size
+	# of X_SET and Y_SET).
+	def __init__(self, ki=False, level=50, map_class=None, rand=None,
+	             width=None, height=None):
 
 		# Asking for 'human' I prefer before asking for dump, deadly
 		# fast calculating machines...so, I called the member 'human'.
@@ -131,23 +150,53 @@ class Player(object):
 		self.human		= not ki
 		self.ki_level	= level
 
+		# All random decisions of this player are done with 'rand'. When
+		# many games are played at once, each game can have its own
+		# generator and can be repeated exactly.
+		if rand == None: rand = RAND
+		self.rand		= rand
+
 		# The Player needs some counters for counting his ships
-		# 'ship_count' which not sunk so far and a list of ships his foe
-		# has already. This is 'foeships'.
+		# 'ship_count' which not sunk so far and the ships his foe has
+		# still (a FoeShips object, see save_foes_ships()). This is
+		# 'foeships'.
 		self.ship_count	= 0
-		self.foeships	= []
+		self.foeships	= FoeShips([])
+
+		# The Player remembers his own ships, too. Each ship gets a
+		# number: 'ship_at' holds the number of the ship at each ship
+		# field, 'ship_regions', 'ship_names' and 'ship_health' (the
+		# number of fields not hit yet) are lists by this number. So a
+		# bomb only has to count down the health of one ship.
+		self._clear_ships()
 
 		# Now the maps. Because the handling of maps may be difficult,
 		# this is encapsulated in another class called 'Map'. I called
 		# them 'ships' for the secret map the Player hold his own ships.
 		# And 'hits' which is his open map to track the bombardments.
-		self.ships	= Map()
-		self.hits	= Map()
+		# (I can not use 'map_class=Map' as default, because the Map class
+		# is defined further down in this file.)
+		if map_class == None: map_class = Map
+		if width == None: width = len(X_SET)
+		if height == None: height = len(Y_SET)
+		self.width	= width
+		self.height	= height
+		self.ships	= map_class(width=width, height=height)
+		self.hits	= map_class(width=width, height=height)
 
 		# The player (especially the KI) needs to remember the last
 		# turn's result. So here we hold space to save is...
 		self.last_result = None
 
+		# A human player may play on a full screen (see screen.py). Then
+		# all messages go there.
+		self.screen = None
+
+		# The KI counts where the foe's ships may be placed on the 'hits'
+		# map. This is set up when the foe's ships are known, see
+		# save_foes_ships().
+		self.placements = None
+
 
 		## public methods
 
@@ -175,35 +224,107 @@ class Player(object):
 		# Just get the map in a shorthand form.
 		mymap = self.ships
 
-		# I calculate a list with all free regions with a minimum size
-		# of the ship's size, this is done with 'mymap.regions(size)'.
-		# Then I choose a region randomly from this list an return None
-		# to the caller if there is no space left.
-		region = RAND.choice(mymap.regions(size))
-		if len(region) == 0: return None
-
-		# The returned region has a _minimum_ size and can be greater
-		# then the ship's size. I choose now the part of the region we
-		# use for the ship. I get the starting point first.
-		# This can be one of 'size - lenght-of-region' fields.
-		first = RAND.randint(0,len(region)-size)
-
-		# Now I set 'size' fields (beginning with the first field,
-		# choosen above) to the 'ship' status.
-		mymap.set_fields(region[first:first+size], 'ship')
+		# All placements of ships of this size are known in advance (see
+		# placements.py). I take the placements which have only unknown
+		# fields -- all others are blocked by ships or the water around
+		# them. Then I choose one of them randomly and return None to the
+		# caller if there is no space left.
+		from placements import get_index
+		index = get_index([size], self.width, self.height)
+		blocked = bytearray(index.cells)
+		for status in STATUS_SET - {None}:
+			for koor in mymap.get_fields(status):
+				blocked[index.number(koor)] = 1
+		free = index.free(size, blocked)
+		if len(free) == 0: return None
+		ship = index.region(self.rand.choice(free))
+
+		# Now I set the fields of the placement to the 'ship' status.
+		mymap.set_fields(ship, 'ship')
 
 		# Thats important!
 		# Because the ships are not allowed to be connected, I set all
 		# surrounding fields to 'water'. These fields not empty anymore,
 		# so they will not be choosen to place a ship again.
-		mymap.set_fields(
-			mymap.neighbours(set(region[first:first+size])),
-			'water'
-		)
+		mymap.set_fields(mymap.neighbours(set(ship)), 'water')
 
 		# count this ship and return the region used
+		self._register_ship(ship, what)
 		self.ship_count += 1
-		return region[first:first+size]
+		return ship
+
+
+	def place_ships(self, shipdefs):
+		"""
+		Randomly set all ships of the ship definitions onto the ship map.
+		"""
+		# The fleet (see fleet.py) finds a layout for all ships at once,
+		# so there is no water around the ships to clean up afterwards.
+		from fleet import Fleet
+		fleet = Fleet(shipdefs, self.width, self.height)
+
+		self.ships = self.ships.__class__(width=self.width, height=self.height)
+		self.ship_count = 0
+		self._clear_ships()
+		names = {s['size']: s['name'] for s in shipdefs}
+		for region in fleet.regions(fleet.layout(self.rand)):
+			self.ships.set_fields(region, 'ship')
+			self._register_ship(region, names[len(region)])
+			self.ship_count += 1
+
+		return
+
+
+	def set_ships(self, fields, shipdefs):
+		"""
+		Set the ship fields of a complete layout of the ship definitions
+		onto an empty ship map (eg. a layout of a library.py file).
+		"""
+		self.ships = self.ships.__class__(width=self.width, height=self.height)
+		self.ships.set_fields(fields, 'ship')
+		self.ship_count = sum([s['num'] for s in shipdefs])
+
+		# the layout has no ships, only fields -- the map knows which
+		# fields belong together
+		self._clear_ships()
+		names = {s['size']: s['name'] for s in shipdefs}
+		for f in fields:
+			if f not in self.ship_at:
+				region = sorted(self.ships.get_ship(f))
+				self._register_ship(region, names.get(len(region)))
+
+		return
+
+
+	def _clear_ships(self):
+		# forget all own ships
+		self.ship_at		= {}
+		self.ship_regions	= []
+		self.ship_names		= []
+		self.ship_health	= []
+
+
+	def _register_ship(self, region, name=None):
+		# remember a ship on the ship map and return its number
+		n = len(self.ship_regions)
+		for f in region:
+			self.ship_at[f] = n
+		self.ship_regions.append(tuple(region))
+		self.ship_names.append(name)
+		self.ship_health.append(
+			sum(1 for f in region if self.ships.get(f) == 'ship')
+		)
+		return n
+
+
+	def render(self):
+		"""
+		Returns the ship map and the open map next to each other.
+		"""
+		return side_by_side(
+			self.ships.render(), self.hits.render(),
+			("Deine Schiffe", "Deine Schüsse")
+		)
 
 
 	def cleanup_ships_map(self):
@@ -215,9 +336,15 @@ class Player(object):
 
 
 	def save_foes_ships(self, shipdef):
-		# I have to copy this dictionary deeply, not copying the
-		# reference to it only.
-		self.foeships = copy.deepcopy(shipdef)
+		# I count the foe's ships by their size -- the ship definitions
+		# themselves stay as they are.
+		self.foeships = FoeShips(shipdef)
+
+		# Now I know the sizes of the foe's ships and can count their
+		# placements. (placements.py needs this module, so I can not
+		# import it at the top.)
+		from placements import Placements
+		self.placements = Placements([s['size'] for s in shipdef], self.hits)
 
 
 	def is_all_sunk(self):
@@ -239,7 +366,9 @@ class Player(object):
 			if self.last_result:
 				lkoor,lstat = self.last_result
 				if lstat == 'sunk':
-					self.hits.surround_with(lkoor, 'water')
+					self._update_placements(
+						self.hits.surround_with(lkoor, 'water')
+					)
 
 				elif lstat == 'hit':
 					self._mark_hit_ship(lkoor)
@@ -249,50 +378,55 @@ class Player(object):
 
 			koor = None		# is a tuple()
 			while True:
-				line = input( "\nCaptain> " )
+				line = self._ask( "\nCaptain> " )
 				token = line.rstrip("\n").split()
 				token.append('')	# empty lines fail to pop()
 				cmd = token.pop(0).lower()
 				if re.match('^(resign|aufgeben|quit|exit|ende|stop)', cmd):
+					# leave the cursor below the screen for the shell
+					if self.screen != None: self.screen.close()
 					exit(0)
 				elif re.match('^(hilfe|help)', cmd):
-					_print_help()
+					_print_help(self._show)
 				elif re.match('^(skip)', cmd):
 					break
+				elif cmd == '' and self.screen != None:
+					self.screen.draw()
 				elif cmd == '':
-					bomb_map.print()
+					sys.stdout.write(self.render())
 				elif cmd == 'ships':
-					ship_map.print()
+					self._show(ship_map.render())
 				elif cmd == 'strategie':
 					t_map = self._best_moves()
-					Map(t_map).print()
+					self._show(Map(t_map).render())
 				elif cmd == 'tmap':
 					t_map = self._rate_unknown_fields(int(token[0]))
-					Map(t_map).print()
+					self._show(Map(t_map).render())
 				elif cmd == 'tipp':
 					t_map = self._best_moves()
-#					Map(t_map).print()
+#					self._say(Map(t_map).render())
 					best_rate = max(t_map.values())
 					best_moves= [k for k,v in t_map.items() if v == best_rate]
-					print('Mmmm..vieleicht auf {}'.format(as_xy(RAND.choice(best_moves))))
-				elif re.match('[a-z]\d+', cmd):
-					koor = as_koor(cmd)
+					self._say('Mmmm..vieleicht auf {}'.format(as_xy(self.rand.choice(best_moves))))
+				elif re.match('[a-z]+\d+', cmd):
+					koor = as_koor(cmd, self.width, self.height)
 					if koor == None:
-						print( "-- Gib ein Feld bitte mit einem Buchstaben und " \
-							"einer Zahl ein.\n-- Zum Beispiel: {0}{1}"\
-							.format(RAND.choice(X_SET),RAND.choice(Y_SET)) )
+						self._say( "-- Gib ein Feld bitte mit einem Buchstaben und " \
+							"einer Zahl ein.\n-- Zum Beispiel: {0}"\
+							.format(as_xy((self.rand.randrange(self.width),
+								self.rand.randrange(self.height)))) )
 						continue
 					elif bomb_map.get(koor) != None:
 						feld = bomb_map.get(koor)
-						print( "-- Oh, Captain!")
-						print( "-- Im Feld {0} ist doch schon '{1}'".format(
-							X_SET[koor[0]] + str(Y_SET[koor[1]]),
+						self._say( "-- Oh, Captain!")
+						self._say( "-- Im Feld {0} ist doch schon '{1}'".format(
+							as_xy(koor),
 							feld
 						))
 						continue
 					break
 				else:
-					print( "-- Häh? Versuche es mal mit 'hilfe'.")
+					self._say( "-- Häh? Versuche es mal mit 'hilfe'.")
 			return koor
 
 		# This is the KI part.
@@ -311,7 +445,7 @@ class Player(object):
 		best_moves = [xy for xy,val in target_map.items() if val == best_rate]
 
 		# Now, get one of the best moves and return it!
-		f =  RAND.choice(best_moves)
+		f =  self.rand.choice(best_moves)
 		##print('foes turn: {} with {} points'.format(f, target_map[f]))
 		return f
 
@@ -328,29 +462,29 @@ class Player(object):
 		# get the status of the bombed field
 		status = mymap.get(koor)
 		if status == 'ship' or status == 'hit':
+			# Which of our ships is it? If the ships were set onto the
+			# map without me, I ask the map once.
+			n = self.ship_at.get(koor)
+			if n == None:
+				n = self._register_ship(mymap.get_ship(koor))
+
 			# We are hit!
 			mymap.set(koor, 'hit')
+			if status == 'ship':
+				self.ship_health[n] -= 1
 
-			# check wheter our ship was completly sunk
-			# get all neighbouring 'ship' or 'hit' fields
-			ship = mymap.neighbours(
-				{koor}, status={'ship', 'hit'}, include=True, recursive=True
-			)
-			# get all 'hit' fields only
-			hits = mymap.neighbours(
-				{koor}, status='hit', include=True, recursive=True
-			)
-#			print('SHIP:',ship,'HITS:',hits)
-
-			# compare the number of fields in the sets, if there more
-			# hits than ship fields this ship must be sunk
-			if len(ship-hits) < 1:
-				mymap.set_fields(ship, 'sunk')
+			# if all fields of the ship are hit, this ship must be sunk
+			if self.ship_health[n] == 0:
+				mymap.set_fields(self.ship_regions[n], 'sunk')
 				self.ship_count -= 1
 				result =  (koor, 'sunk')
 			else:
 				result =  (koor, 'hit')
 
+			# tell the player which ship was hit
+			self.send_message('foe_has_' + result[1], result, self.ship_names[n])
+			return result
+
 		# Oh yeah, only water was hit
 		elif status == None or status == 'water':
 			mymap.set(koor, 'water')
@@ -379,19 +513,14 @@ class Player(object):
 		# Great! We sunk a ship!
 		if status == 'sunk':
 			mymap.set(koor, status)
-			ship = mymap.neighbours( {koor}, {'hit','sunk'}, True, True)
+			ship = mymap.get_ship(koor)
 
 			# mark sunken ship in my mymap
 			mymap.set_fields(ship, 'sunk')
 
-			# find the sunken ship in the list of foe's ships and count
-			# it down -- save the name for the following message
-			name = None
-			for s in self.foeships:
-				if s['size'] == len(ship):
-					s['num'] -= 1
-					name = s['name']
-					break
+			# count down the foe's ships of this size -- save the name
+			# for the following message
+			name = self.foeships.remove(len(ship))
 			if name == None:
 				raise Exception("Not existing ship sunk", [result,ship,len(ship)])
 
@@ -412,11 +541,39 @@ class Player(object):
 		else:
 			raise Exception("unable to handle result", result)
 
+		# The bombed field is known now.
+		self._update_placements({koor})
+
 		# Save the last result for later use and return
 		self.last_result = result
 		return
 
 
+	# The messages to a human player and his answers go to the screen
+	# if there is one, otherwise they are printed line by line.
+	def _say(self, *args):
+		text = " ".join(str(a) for a in args)
+		if self.screen != None:
+			self.screen.message(text)
+		else:
+			print(text)
+
+
+	# Longer texts (the help, a map) do not fit into the few lines for
+	# the messages of the screen. They get the whole screen for a while.
+	def _show(self, text):
+		if self.screen != None:
+			self.screen.page(text)
+		else:
+			print(text)
+
+
+	def _ask(self, prompt):
+		if self.screen != None:
+			return self.screen.ask(prompt.lstrip("\n"))
+		return input(prompt)
+
+
 	# This function does the communication part with the players. All
 	# possible messages are listed here. If you want to localize you
 	# only have to do this in this function.
@@ -432,50 +589,48 @@ class Player(object):
 		#FIXME: ask the player for his name in init code and use it here
 		name = 'Kapitän'
 		if msgid == 'ships_distributed':
-			print("{}! Es wurden {} Schiffe verteilt.".format(
+			self._say("{}! Es wurden {} Schiffe verteilt.".format(
 				name, args[0]
 			))
 
 		elif msgid == 'result_sunk':
-			print("{}! Wir haben ein {} versenkt!".format(
+			self._say("{}! Wir haben ein {} versenkt!".format(
 				name, args[0]
 			))
 
 		elif msgid == 'result_hit':
-			print("{}! Wir haben auf Feld {} ein Schiff getroffen!".format(
+			self._say("{}! Wir haben auf Feld {} ein Schiff getroffen!".format(
 				name, as_xy(args[0][0])
 			))
 
 		elif msgid == 'result_water':
-			print("{}! Wasser.".format(
+			self._say("{}! Wasser.".format(
 				name, args[0]
 			))
 
 		elif msgid == 'foe_has_sunk':
-			#FIXME: add type of the sunken ship
-			print("{}! Unser Gegner hat unser Schiff bei {} versenkt!".format(
-				name, as_xy(args[0][0])
+			self._say("{}! Unser Gegner hat unser {} bei {} versenkt!".format(
+				name, args[1] or 'Schiff', as_xy(args[0][0])
 			))
 
 		elif msgid == 'foe_has_hit':
-			#FIXME: add type of the hit ship
-			print("{}! Unser Gegner hat unser Schiff bei {} getroffen!".format(
-				name, as_xy(args[0][0])
+			self._say("{}! Unser Gegner hat unser {} bei {} getroffen!".format(
+				name, args[1] or 'Schiff', as_xy(args[0][0])
 			))
 
 		elif msgid == 'foe_has_water':
-			print("{}! Unser Gegner macht Wellen bei {}.".format(
+			self._say("{}! Unser Gegner macht Wellen bei {}.".format(
 				name, as_xy(args[0][0])
 			))
 
 		elif msgid == 'you_win':
-			print("{}! DU HAST GEWONNEN!".format(name))
+			self._say("{}! DU HAST GEWONNEN!".format(name))
 
 		elif msgid == 'you_lost':
-			print("{}! DU HAST LEIDER VERLOREN!".format(name))
+			self._say("{}! DU HAST LEIDER VERLOREN!".format(name))
 
 		else:
-			print("UNKNOWN MESSAGE:", msgid, '>>', args)
+			self._say("UNKNOWN MESSAGE:", msgid, '>>', args)
 
 		return
 
@@ -486,18 +641,25 @@ class Player(object):
 		there can not be another ship.
 		"""
 		assert isinstance(field, tuple), "field must be a tuple"
-		assert field[0] in range(len(X_SET)) and field[1] in range(len(Y_SET)),\
-			"field must be element of (X_SET, Y_SET)"
+		assert field[0] in range(self.width) and field[1] in range(self.height),\
+			"field must be on the map"
 
 		# find all 'diagonal' fields and mark them as water
-		self.hits.set_fields(
-			self.hits.neighbours({field}, check='odd'),
-			'water'
-		)
+		fields = self.hits.neighbours({field}, check='odd')
+		self.hits.set_fields(fields, 'water')
+		self._update_placements(fields)
 
 		return
 
 
+	def _update_placements(self, fields):
+		"""
+		Update the placement counts for fields changed on the open map.
+		"""
+		if self.placements != None:
+			self.placements.update(fields, self.hits)
+
+
 	# Oh yeah -- the magical function which calculates the best moves.
 	# This is the one which give you a hint or let the computer move.
 	def _best_moves(self):
@@ -514,6 +676,7 @@ class Player(object):
 		# I create a map with a rate for each field. The field with the
 		# highest rate will be bombed...
 		rate_map = dict()
+		counted = None
 
 		# I use the result from the last turn to calculate some
 		# additional information, eg. to mark a hit field or a sunken
@@ -523,49 +686,62 @@ class Player(object):
 
 			# to mark the 'diagonal' fields of a hit field is hard. (I
 			# got it after thinking a lot myself.)
-			if status == 'hit' and RAND.randint(0,100) <= level + LEVEL['hard']:
+			if status == 'hit' and self.rand.randint(0,100) <= level + LEVEL['hard']:
 				self._mark_hit_ship(field)
 				#print('level:',level,'mark_hit_ship_at:',field)
 
 			# mark a sunken ship my son got easily -- so it should easy
 			# too.
-			if status == 'sunk' and RAND.randint(0,100) <= level + LEVEL['easy']:
-				self.hits.surround_with(field, 'water')
+			if status == 'sunk' and self.rand.randint(0,100) <= level + LEVEL['easy']:
+				self._update_placements(
+					self.hits.surround_with(field, 'water')
+				)
 				#print('level:',level,'ship_is_sunk')
 
 			# got a rate for unknown fields i give the 'intermediate'
 			# level. My son got the idea fast (to bomb the big hole at
 			# the map), but to find the right field on the big holes are
 			# quite difficulty. 
-			if RAND.randint(0,100) <= level + LEVEL['intermediate']:
+			if self.rand.randint(0,100) <= level + LEVEL['intermediate']:
 				# what is the maximum ship size we are searching for?
-				maximum = max(
-					[shipdef['size'] for shipdef in self.foeships \
-					if shipdef['num'] > 0]
-				)
-				# get the rate map for the unknown fields and add them
-				# to our target map (rate_map)
-				rmap = self._rate_unknown_fields(size=maximum)
-				for f in rmap.keys():
-					rate_map[f] = rate_map.get(f,0) + rmap[f]
+				maximum = self.foeships.largest
+				# get the rate map for the unknown fields and use it as
+				# our target map (rate_map is still empty here) -- the
+				# placement counts are always up to date, so I use them
+				# if I can. Only the fields with the highest count can
+				# win, so I take only these (or a sample of them on a big
+				# map) and look up the counts of other fields when I need
+				# them below.
+				if self.placements != None:
+					rate, best = self.placements.best(
+						maximum, self.SAMPLE, self.rand
+					)
+					rate_map = {koor:rate for koor in best}
+					counted = maximum
+				else:
+					rate_map = dict(self._rate_unknown_fields(size=maximum))
 				#print('level:',level,'rate_fields_size:',maximum)
 
 			# suppose we hit a ship on a turn formerly. This code trys
 			# to sunk all this ships we find.
-			hits = self.hits.get_fields('hit')
-			if len(hits) > 0 and RAND.randint(0,100) <= level + LEVEL['easy']:
+			if self.hits.count('hit') > 0 and self.rand.randint(0,100) <= level + LEVEL['easy']:
+				hits = self.hits.get_fields('hit')
 				#print('level:', level, 'destroy_ship:',hits, end=' ')
 
 				# get one field, get the ship and find all empty neighbours
+				# ('status=None' would be _all_ neighbours, so I ask for
+				# the set of the unknown status)
 				field = hits.pop()
 				fields = self.hits.neighbours(
 					self.hits.get_region(field),
-					status=None
+					status={None}
 				)
 
 				# add rate to all this empty fields possibly containing
 				# the remaining ship -- use a static value of 20.
 				for f in fields:
+					if f not in rate_map and counted != None:
+						rate_map[f] = self.placements.count(counted, f)
 					rate_map[f] = rate_map.get(f,0) + 20
 
 		# This is a fall-back.
@@ -573,7 +749,7 @@ class Player(object):
 		# empty field with 1. At a result an empty field will be bombed
 		# randomly.
 		if self.last_result == None or len(rate_map) < 1:
-			rate_map = {koor:1 for koor in self.hits.get_fields(None)}
+			rate_map = {koor:1 for koor in self._unknown_fields(self.SAMPLE)}
 			#print('LEVEL', level, 'random_field')
 		#print('LEVEL', level, 'RATED MAP IS:')
 		#Map(rate_map).print()
@@ -581,6 +757,32 @@ class Player(object):
 		return rate_map
 
 
+	def _unknown_fields(self, limit):
+		"""
+		Returns the unknown fields of the open map -- or, on a big map, a
+		random sample of them.
+		"""
+		mymap = self.hits
+
+		# Some maps (eg. TileMap) know where their unknown fields are.
+		if hasattr(mymap, 'sample_unknown'):
+			return mymap.sample_unknown(limit, self.rand)
+
+		# On a big map most of the fields are unknown and I find some of
+		# them faster by chance than by looking at all fields.
+		if self.width * self.height > 4 * limit:
+			fields = set()
+			for n in range(4 * limit):
+				koor = (self.rand.randrange(self.width),
+					self.rand.randrange(self.height))
+				if mymap.get(koor) == None:
+					fields.add(koor)
+					if len(fields) == limit: break
+			if len(fields) > 0: return fields
+
+		return mymap.get_fields(None)
+
+
 	def _rate_unknown_fields(self, size=1, rate=1):
 		"""
 		Rate unknown fields of the open map and return a <target map>.
@@ -590,6 +792,11 @@ class Player(object):
 		<target map> (default: 1).
 		"""
 
+		# Some maps (eg. ArrayMap) can rate all regions at once. Let them
+		# do the work.
+		if hasattr(self.hits, 'rate_map'):
+			return self.hits.rate_map(size, rate)
+
 		# initialize the <target map> as an dictionary
 		t_map = dict()
 
@@ -611,17 +818,205 @@ class Player(object):
 
 
 
+# The attacking Player has to know which of the foe's ships are still
+# swimming: the biggest one for the rating of the fields, and the name of
+# a ship of some size when it is sunk. So I count them by size.
+class FoeShips(object):
+	"""
+	The ships of the ship definitions 'shipdefs' which are not sunk yet,
+	counted by size.
+	"""
+
+	def __init__(self, shipdefs):
+		# the names of the ships of each size, the last one is the next
+		# one to sink
+		self.names = {}
+		for shipdef in reversed(shipdefs):
+			self.names.setdefault(shipdef['size'], []).extend(
+				[shipdef['name']] * shipdef['num']
+			)
+		self.count = sum(len(names) for names in self.names.values())
+
+		# the size of the biggest ship (0 if there is none)
+		self.largest = max(
+			[size for size, names in self.names.items() if names], default=0
+		)
+
+	def __len__(self):
+		return self.count
+
+	def num(self, size):
+		"""
+		Returns the number of ships of 'size'.
+		"""
+		return len(self.names.get(size, ()))
+
+	def remove(self, size):
+		"""
+		Count down a ship of 'size' and return its name -- or None if there
+		is no ship of this size.
+		"""
+		names = self.names.get(size)
+		if not names: return None
+		name = names.pop()
+		self.count -= 1
+
+		# the biggest ship only gets smaller, so all sizes are passed
+		# only once during a game
+		while self.largest > 0 and self.num(self.largest) == 0:
+			self.largest -= 1
+		return name
+
+
+# The fields around a field never change for a map of a given size. So I
+# compute them only once for each field and keep them in a table for all
+# maps of that size: the eight fields around a field ('around'), the
+# four fields left, right, above and below ('cross') and the four
+# diagonal fields ('diagonal'). The fields of the tables are made once,
+# so looking up the neighbours does not make new tuples.
+#
+# The entry of a field is computed when it is asked for the first time.
+# So a table of a big map only holds the fields which were needed.
+OFFSETS = {
+	'around':   [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy],
+	'cross':    [(-1, 0), (0, -1), (0, 1), (1, 0)],
+	'diagonal': [(-1, -1), (-1, 1), (1, -1), (1, 1)],
+}
+_NEIGHBOURHOODS = {}
+
+
+class Neighbourhood(dict):
+	"""
+	A table field -> tuple of the fields around it (by 'kind', see
+	OFFSETS) for a map of 'width' x 'height' fields.
+	"""
+
+	def __init__(self, width, height, kind):
+		self.width   = width
+		self.height  = height
+		self.offsets = OFFSETS[kind]
+
+	def __missing__(self, koor):
+		(x, y) = koor
+		fields = tuple(
+			(x+dx, y+dy) for dx, dy in self.offsets
+			if 0 <= x+dx < self.width and 0 <= y+dy < self.height
+		)
+		self[koor] = fields
+		return fields
+
+	# The tables are shared by all maps of a size -- a copy of a map
+	# does not need a copy of them.
+	def __copy__(self):
+		return self
+
+	def __deepcopy__(self, memo):
+		return self
+
+
+def get_neighbourhood(width, height, kind):
+	"""
+	Returns the (shared) Neighbourhood of 'kind' for a map size.
+	"""
+	key = (width, height, kind)
+	if key not in _NEIGHBOURHOODS:
+		_NEIGHBOURHOODS[key] = Neighbourhood(width, height, kind)
+	return _NEIGHBOURHOODS[key]
+
+
+# The coordinates of all fields of a map never change either. So I make
+# them once for each size of a map, when a map first looks at all of its
+# fields (get_fields(None), regions()). 'coors' holds the coordinates
+# row by row, 'rows' and 'columns' hold the same tuples by row and by
+# column. Looking at all fields does not make new tuples then -- and the
+# sets and lists of fields a map hands out share these coordinates. The
+# map itself still keeps its fields by their (x, y) tuples.
+class Cells(object):
+	"""
+	The coordinates of the fields of a map of 'width' x 'height' fields.
+	"""
+
+	def __init__(self, width, height):
+		self.width   = width
+		self.height  = height
+		self.coors   = [(x, y) for y in range(height) for x in range(width)]
+		self.rows    = [self.coors[y * width:(y + 1) * width] for y in range(height)]
+		self.columns = [self.coors[x::width] for x in range(width)]
+
+	def __copy__(self):
+		return self
+
+	def __deepcopy__(self, memo):
+		return self
+
+
+# A program seldom has maps of more than one or two sizes -- but a long
+# running one (eg. the server with a size per game) may see many. I keep
+# the Cells of the last CELL_SIZES sizes only, the oldest one goes first.
+_CELLS = {}
+CELL_SIZES = 8
+
+def get_cells(width, height):
+	"""
+	Returns the (shared) Cells of a map size.
+	"""
+	key = (width, height)
+	if key not in _CELLS:
+		if len(_CELLS) >= CELL_SIZES:
+			del _CELLS[next(iter(_CELLS))]
+		_CELLS[key] = Cells(width, height)
+	return _CELLS[key]
+
+
 # This is the Map class. It defines one map with X/Y-Axis and methods for
 # accessing and manipulation the status for fields.
 #
-# The Contructor can be initialized with a dictionary.
+# The Contructor can be initialized with a dictionary. 'width' and
+# 'height' give the size of the map (default: the size of X_SET and
+# Y_SET).
 class Map(object):
-	def __init__(self, newmap=None):
+	# If CHECK is True, every change of the map checks the field index
+	# (see check_index()). This is slow and meant for the tests.
+	CHECK = False
+
+	def __init__(self, newmap=None, width=None, height=None):
 		if newmap == None:
 			self.map = {}
 		else:
 			self.map = newmap
 
+		if width == None: width = len(X_SET)
+		if height == None: height = len(Y_SET)
+		self.width  = width
+		self.height = height
+
+		# the tables of the neighbours of each field (see Neighbourhood)
+		self.around   = get_neighbourhood(width, height, 'around')
+		self.cross    = get_neighbourhood(width, height, 'cross')
+		self.diagonal = get_neighbourhood(width, height, 'diagonal')
+
+		# The Map knows the fields of each status, too. 'fields' holds a
+		# set of fields for each (known) status. set() and set_fields()
+		# keep them up to date, so nobody has to look through the whole
+		# map for the hit fields. Unknown fields are not in the
+		# dictionary at all.
+		for koor in [k for k, s in self.map.items() if s == None]:
+			del self.map[koor]
+		self.fields = {status: set() for status in STATUS_SET if status != None}
+		for koor, status in self.map.items():
+			if status in self.fields: self.fields[status].add(koor)
+
+		# The Map knows which ship fields are connected. This is done with
+		# an union-find structure: every ship field has a 'parent' field,
+		# and following the parents you end at the 'root' of the ship.
+		# 'members' holds all fields of a ship for each root.
+		# The index is updated by set() and set_fields(). If a ship field
+		# gets another status, the index is 'dirty' and will be rebuilt on
+		# the next question.
+		self.parent  = {}
+		self.members = {}
+		self.dirty   = newmap != None
+
 
 	# A simple access function for the status of a field.
 	def get(self, koor):
@@ -644,25 +1039,31 @@ class Map(object):
 		Returns fields with 'status' (default: unknown status)
 		"""
 
-		# initialize the result fields
-		fields = set()
-
 		# I am searching the map (a dictionary) for fields which do not
 		# have a status. So I have to loop through all coordinates and see
 		# wheter there is some set or not. If nothing is set I add the
-		# coordinate to the list.
+		# coordinate to the list. (The coordinates are made once, see
+		# Cells.)
 		if status == None:
-			for x in range(len(X_SET)):
-				for y in range(len(Y_SET)):
-					if (x,y) not in self.map: fields.add((x,y))
-			return fields
-
-		# Here I am searching for fields with a status. Thats easier because
-		# I loop through all entries of the dictionary only and look if the
-		# fields equals to the status.
-		for k,s in self.map.items():
-			if status == s: fields.add(k)
-		return fields
+			mymap = self.map
+			return {
+				koor for koor in get_cells(self.width, self.height).coors
+				if koor not in mymap
+			}
+
+		# The fields with a status are in the index. The caller gets a
+		# copy, it may change it.
+		return set(self.fields[status])
+
+
+	def count(self, status=None):
+		"""
+		Returns the number of fields with 'status' (default: unknown
+		status).
+		"""
+		if status == None:
+			return self.width * self.height - len(self.map)
+		return len(self.fields[status])
 
 
 	# A simple access function for setting the the status of a field.
@@ -674,7 +1075,9 @@ class Map(object):
 		assert len(koor) == 2,			"need two coordinates"
 		assert status in STATUS_SET,	"status must be STATUS_SET element"
 
-		self.map[koor] = status
+		self._index(koor, status)
+		self._store(koor, status)
+		if self.CHECK: self.check_index()
 		return
 
 
@@ -687,34 +1090,144 @@ class Map(object):
 		assert isinstance(fields, (set,list,tuple)), \
 			"'fields' must be a list or tuple of coordinates eg. '[(1,4)]'"
 
-		for (x,y) in fields:
-			self.map[(x,y)] = status
+		for koor in fields:
+			self._index(koor, status)
+			self._store(koor, status)
+		if self.CHECK: self.check_index()
 		return
 
 
+	def _store(self, koor, status):
+		# write the status into the dictionary and the field index
+		old = self.map.get(koor, None)
+		if old == status: return
+		if old in self.fields:
+			self.fields[old].discard(koor)
+		if status == None:
+			del self.map[koor]
+		else:
+			self.map[koor] = status
+			if status in self.fields: self.fields[status].add(koor)
+
+
+	def check_index(self):
+		"""
+		Checks the field index against the dictionary and raises an
+		AssertionError if they differ.
+		"""
+		for status, fields in self.fields.items():
+			expected = {k for k, s in self.map.items() if s == status}
+			assert fields == expected, \
+				"index of {!r} is {}, expected {}".format(status, fields, expected)
+		assert None not in self.map.values(), "unknown fields are stored"
+		assert self.count(None) == sum(
+			(x,y) not in self.map
+			for x in range(self.width) for y in range(self.height)
+		), "wrong number of unknown fields"
+
+
+	# The next functions maintain the index of the ships. You may read
+	# about 'union-find' or 'disjoint sets' to understand them.
+	def _index(self, koor, status):
+		if self.dirty: return
+
+		old = self.map.get(koor, None)
+		if old in SHIP_STATUS:
+			# a ship field becomes something else -- I can not take a
+			# field out of an union-find, so rebuild everything later
+			if status not in SHIP_STATUS: self.dirty = True
+			return
+
+		if status in SHIP_STATUS:
+			# a new ship field: it is its own ship first, then join it
+			# with all the ships around it
+			self.parent[koor]  = koor
+			self.members[koor] = {koor}
+			for f in self.around[koor]:
+				if f in self.parent: self._union(koor, f)
+
+
+	def _rebuild(self):
+		self.parent  = {}
+		self.members = {}
+		self.dirty   = False
+		for koor, status in list(self.map.items()):
+			if status in SHIP_STATUS:
+				del self.map[koor]
+				self._index(koor, status)
+				self.map[koor] = status
+
+
+	def _find(self, koor):
+		# find the root...
+		root = koor
+		while self.parent[root] != root:
+			root = self.parent[root]
+
+		# ...and let all fields on the way point to it directly (path
+		# compression) so the next search is faster
+		while self.parent[koor] != root:
+			self.parent[koor], koor = root, self.parent[koor]
+		return root
+
+
+	def _union(self, a, b):
+		a, b = self._find(a), self._find(b)
+		if a == b: return
+
+		# the smaller ship is joined to the bigger one
+		if len(self.members[a]) < len(self.members[b]):
+			a, b = b, a
+		self.parent[b] = a
+		self.members[a] |= self.members.pop(b)
+
+
+	def find_ship(self, koor):
+		"""
+		Returns the identifier (a field) of the ship at 'koor' or None if
+		there is no ship field.
+		"""
+		if self.dirty: self._rebuild()
+		if koor not in self.parent: return None
+		return self._find(koor)
+
+
+	def get_ship(self, koor):
+		"""
+		Returns all fields of the ship at 'koor' -- all connected fields
+		with a status of SHIP_STATUS.
+		"""
+		ship = self.find_ship(koor)
+		if ship == None: return set()
+		return set(self.members[ship])
+
+
 	# Here it comes! the terminal output of the map!
+	# (Printing each field on its own was slow on a remote terminal, so
+	# the map is rendered into one string first and written at once.)
 	def print(self):
-		# I first print all cordinates of the X_SET with enough space for
-		# remarks of the Y-Axis
-		print( "    ", end="" )
-		for x in range(len(X_SET)):
-			print( X_SET[x], end=" ")
-		print()
-		print( "  +", len(X_SET) * '--', sep="")
-
-		# Now print the Y-Axis and for each X-Axis it's element. If it's a
-		# integer or float print is as integer. If the element is not a
-		# number use the LEGEND to get it's map representation. In both
-		# cases print it right assigned with a length of two ({0:2>}).
-		for y in range(len(Y_SET)):
-			print( "{0:2}|".format(Y_SET[y]), end="")
-			for x in range(len(X_SET)):
-				val = self.map.get((x,y), None)
-				if isinstance(val, (int,float)):
-					print("{0:>2}".format(int(val)), end='')
-				else:
-					print("{0:>2}".format(LEGENDE[val]), end='')
-			print()
+		sys.stdout.write(self.render())
+
+
+	def render(self):
+		"""
+		Returns the map as string, as print() shows it.
+		"""
+		# I begin with a map of unknown fields and write the fields of
+		# the dictionary into it. If a field holds an integer or float
+		# (eg. a rate map) I show it as integer. If not, it gets the sign
+		# of the LEGENDE. In both cases it is right aligned with a length
+		# of two ({0:>2}).
+		rows = [[GLYPHS[None]] * self.width for y in range(self.height)]
+		for (x, y), val in self.map.items():
+			if isinstance(val, (int,float)):
+				rows[y][x] = "{0:>2}".format(int(val))
+			else:
+				rows[y][x] = GLYPHS[val]
+		return render_rows(rows)
+
+
+	__str__ = render
 
 
 	# BE CAREFUL!
@@ -731,8 +1244,7 @@ class Map(object):
 		If 'status' is not None, only fields which status is 'status' will be
 		returned.
 		If 'include' is True, fields will be included into the result.
-		If 'recursive' is True, neighbours() will be called recursivly onto
-		the result until all reachable fields are found.
+		If 'recursive' is True, all reachable fields are found.
 		"""
 		assert isinstance(fields, set), "'fields' must be set of coordinates"
 		assert check == None or check != None and len(fields) == 1,\
@@ -746,59 +1258,58 @@ class Map(object):
 		if status != None and not isinstance(status, set):
 			status = {status}
 
-		# Second enhancement: neighbour() can act recursivly, so I needed
-		# the initial 'fields' for the final condition and save them in
-		# 'koor_last'.
-		koor_last = fields
+		mymap = self.map
+		around = self.around
+
+		# The 'odd' fields around a single field are its diagonal ones,
+		# the 'even' fields are left, right, above and below of it (see
+		# the fourth enhancement below). Both are in a table, so I do not
+		# need to compute and filter all neighbours.
+		if check != None and not recursive:
+			(field,) = fields
+			if check == 'odd':
+				candidates = self.diagonal[field]
+				if include: candidates += (field,)
+			else:
+				candidates = self.cross[field]
+			return {
+				f for f in candidates
+				if status == None or mymap.get(f, None) in status
+			}
 
 		# How I do the calculation?
-		# I create two list of potential coordinates, one for the X-axis and
-		# the other for the Y-axis. I put all the possible coordinates into
-		# them (eg. for X-axis that is: x, x-1, x+1).
+		# I take all fields around (and including) each of the fields
+		# and add them to the result set if the status of the field is
+		# right.
 		result_set = set()
 		for koor in fields:
-			(x, y) = koor
-			pot_x = (x,)
-			pot_y = (y,)
-
-			# calculate all possible x and y coordinates
-			# left and right
-			if x-1 in range(len(X_SET)):
-				pot_x = pot_x + (x-1,)
-			if x+1 in range(len(X_SET)):
-				pot_x = pot_x + (x+1,)
-
-			# up and down
-			if y-1 in range(len(Y_SET)):
-				pot_y = pot_y + (y-1,)
-			if y+1 in range(len(Y_SET)):
-				pot_y = pot_y + (y+1,)
-
-			# I loop through all the possible coordinates and add them to
-			# the result set if the status of the field is right.
-			# add all possible coordinates
-			for xi in pot_x:
-				for yi in pot_y:
-					stat = self.get((xi,yi))
-					if status == None or stat in status:
-						result_set.add( (xi,yi) )
-
-			# Oh, the recursive thing!
-			# First check the 'recursive' flag and the final condition. That
-			# is: end recursion if initial field set and calculated field
-			# set have equal size. If not: call neighbour function again
-			# with the result set as input fields. 
-			if recursive and len(result_set - koor_last) > 0:
-				result_set = self.neighbours(
-					result_set, status, recursive=True, include=True
-				)
+			if status == None or mymap.get(koor, None) in status:
+				result_set.add(koor)
+			for f in around[koor]:
+				if status == None or mymap.get(f, None) in status:
+					result_set.add(f)
+
+		# Second enhancement: neighbours() can act recursivly.
+		# Earlier this function called itself again and again, which was
+		# slow and too deep for big regions. Now I only look at the fields
+		# found in the last round (the 'frontier') until no new fields are
+		# found anymore.
+		if recursive:
+			frontier = result_set
+			while frontier:
+				found = set()
+				for koor in frontier:
+					for f in around[koor]:
+						if f in result_set or f in found: continue
+						if status == None or mymap.get(f, None) in status:
+							found.add(f)
+				result_set |= found
+				frontier = found
 
 		# Third enhancement: do remove the initial fields from the result
 		# set. This is very practical if you try to mark all fields around
 		# of a ship as water... 
 		if not include:
-			#FIXME: if this is recursive, 'fields' do not hold the _inital_
-			#       set of fields!
 			for koor in fields:
 				if koor in result_set: result_set.remove(koor)
 
@@ -806,8 +1317,9 @@ class Map(object):
 		# result set (eg. get all 'diagonal' fields of a field which was
 		# hit)
 		if check != None:
-			# I use only the first field for the calculation
-			field = fields.pop()
+			# I use only the first field for the calculation (and leave
+			# the caller's set alone)
+			field = next(iter(fields))
 
 			# To do the calculation I define the QSUM of a coordinate as
 			# QSUM := (x+y)%2
@@ -837,6 +1349,7 @@ class Map(object):
 		"""
 		Set the surrounding fields of a region. The region is calculated from
 		one field and all neighbouring fields with equal status.
+		Returns the fields which were set.
 		"""
 
 		# This is a bit "syntactic sugar" for us. It a wrapper for
@@ -844,12 +1357,10 @@ class Map(object):
 		# But this function looks much prettier than the
 		#     set_fields( neighbour( get_region()))
 		# thing I have to use otherwise...
-		self.set_fields(
-			self.neighbours(self.get_region(field), status=what),
-			status
-		)
+		fields = self.neighbours(self.get_region(field), status=what)
+		self.set_fields(fields, status)
 
-		return
+		return fields
 
 
 	def regions(self, size=1, status=None):
@@ -858,8 +1369,8 @@ class Map(object):
 		(default :None).
 		"""
 		assert size >  0, "size must be > 0"
-		assert size <= max(len(X_SET), len(Y_SET)), \
-			"size must not be greater then Y_SET and X_SET"
+		assert size <= max(self.width, self.height), \
+			"size must not be greater then the width and height of the map"
 
 		# Oh, I am searching for a much shorter variant for this function.
 		# Let's bbegin to talk about it.
@@ -871,18 +1382,20 @@ class Map(object):
 		# Afterwards I do the same searching on the Y-axis. So this code has
 		# it's code doubled -- just the axis are swapped.
 
-		# Loop through X_SET and Y_SET, in that order.
-		for x in range(len(X_SET)):
+		# Loop through the X- and the Y-axis, in that order. The fields of
+		# each column and row are made once (see Cells).
+		cells = get_cells(self.width, self.height)
+		for column in cells.columns:
 			# This is the list of the coordinates that may (or may not)
 			# build a region of the wanted size.
 			pos = []
-			for y in range(len(Y_SET)):
+			for koor in column:
 
 				# I add all coodinates of empty fields into the 'pos' list
 				# until there is a field which is set.
 				if status == None:
-					if (x,y) not in self.map:
-						pos.append((x,y))
+					if koor not in self.map:
+						pos.append(koor)
 					else:
 						# Have we enough coordinates to build a region with
 						# a minimum of 'size'?
@@ -898,25 +1411,25 @@ class Map(object):
 				# Here I have to add only fields with a special status. This
 				# is quite equal to the code above.
 				else:
-					if status == self.get((x,y)):
-						pos.append((x,y))
+					if status == self.get(koor):
+						pos.append(koor)
 					else:
 						if len(pos) >= size:
 							positions.append(pos)
 						pos = []
 			if len(pos) >= size:
-				positions.append(pos); #print(x,y, 'got region', pos)
+				positions.append(pos); #print(koor, 'got region', pos)
 
 		# Now I have done the vertical regions, now we have to do the same,
-		# just copy the code above and swap X_SET and Y_SET.
+		# just copy the code above and swap the axes.
 		# It is quite a shame, but I have no idea yet to simplify the
 		# code...
-		for y in range(len(Y_SET)):
+		for row in cells.rows:
 			pos = []
-			for x in range(len(X_SET)):
+			for koor in row:
 				if status == None:
-					if (x,y) not in self.map:
-						pos.append((x,y))
+					if koor not in self.map:
+						pos.append(koor)
 					else:
 						if len(pos) >= size:
 							positions.append(pos)
@@ -925,8 +1438,8 @@ class Map(object):
 						pos = []
 
 				else:
-					if status == self.get((x,y)):
-						pos.append((x,y))
+					if status == self.get(koor):
+						pos.append(koor)
 					else:
 						if len(pos) >= size:
 							positions.append(pos)
@@ -962,15 +1475,15 @@ class Map(object):
 ## help to human players.
 ## These functions are implemented as classmethods.
 
-def _print_help():
-	print( """
+def _print_help(say=print):
+	say( """
 ende  - Du gibst auf und beendest das Spiel.
 skip  - Du verzichtest auf Deinen Zug.
 ships - Schau auf Deine geheime Karte.
 tipp  - Ich gebe Dir einen Tipp.
 hilfe - Ich zeige Dir die Befehle, die ich verstehe.
 
-Gibst Du mir keine Eingabe, zeige ich Dir Deine Karte.
+Gibst Du mir keine Eingabe, zeige ich Dir Deine Karten.
 Gibst Du mir einen Buchstaben und eine Zahl, wie A4, oder D10
 schießt Du auf dieses Feld.
 
@@ -1016,34 +1529,141 @@ def calc_points(region, rate=1):
 	return values
 
 
+# The name of a column. The first columns are named with the letters of
+# X_SET, then the names go on like in a spreadsheet: ..., Z, AA, AB, ...
+def x_name(x):
+	name = ''
+	x += 1
+	while x > 0:
+		x, r = divmod(x - 1, 26)
+		name = chr(ord('A') + r) + name
+	return name
+
+
+# The header of a rendered map: the names of the columns and a line. It
+# only depends on the width, so I make it only once for each width.
+_HEADERS = {}
+
+def map_header(width):
+	if width not in _HEADERS:
+		_HEADERS[width] = "    " + "".join(x_name(x) + " " for x in range(width)) + \
+			"\n  +" + width * '--' + "\n"
+	return _HEADERS[width]
+
+
+def render_rows(rows):
+	"""
+	Returns the string of a map from its rows, each row a list of the
+	strings of its fields (see GLYPHS).
+	"""
+	width = len(rows[0]) if rows else 0
+	return map_header(width) + "".join(
+		"{0:2}|{1}\n".format(y + 1, "".join(row)) for y, row in enumerate(rows)
+	)
+
+
+def known_fields(mymap):
+	"""
+	Returns a dictionary field -> status of all fields of any map which
+	have a status.
+	"""
+	fields = {}
+	for status in STATUS_SET - {None}:
+		for koor in mymap.get_fields(status):
+			fields[koor] = status
+	return fields
+
+
+def render_map(mymap):
+	"""
+	Returns the string of any map (Map, BitMap, ...). Only the fields with a
+	status are looked at.
+	"""
+	rows = [[GLYPHS[None]] * mymap.width for y in range(mymap.height)]
+	for status in STATUS_SET - {None}:
+		glyph = GLYPHS[status]
+		for (x, y) in mymap.get_fields(status):
+			rows[y][x] = glyph
+	return render_rows(rows)
+
+
+def side_by_side(left, right, titles=('', ''), gap=4):
+	"""
+	Returns two rendered maps (or other strings) next to each other, with
+	a title above each one.
+	"""
+	left  = [titles[0]] + left.splitlines()
+	right = [titles[1]] + right.splitlines()
+	if len(left) < len(right): left += [''] * (len(right) - len(left))
+	if len(right) < len(left): right += [''] * (len(left) - len(right))
+	width = max(len(line) for line in left) + gap
+	return "".join(
+		(l.ljust(width) + r).rstrip() + "\n" for l, r in zip(left, right)
+	)
+
+
 # Small function to get the string representation of a coordinate.
 def as_xy(koor):
-	return X_SET[koor[0]] + str(Y_SET[koor[1]])
+	return x_name(koor[0]) + str(koor[1] + 1)
 
 
 # The reverse function to as_xy(): calculate the coordinate from the string
-# representation.
-def as_koor(string):
-	# A coordinate have to be consist of 2 chars minimum.
-	if len(string) < 2: return None
-
-	# I assume, that the first character is the X-axis, the rest of the string
-	# is the number of the Y-axis.
-	xs = string[0:1].upper()
-	ys = int(string[1:])
-
-	# Get the correct index from the X_SET and Y_SET. If an error occurs, like
-	# 'index not found', simply return nothing.
-	try:
-		x = X_SET.index(string[0:1].upper())
-		y = Y_SET.index(int(string[1:]))
-	except:
+# representation. 'width' and 'height' give the size of the map (default:
+# the size of X_SET and Y_SET).
+def as_koor(string, width=None, height=None):
+	if width == None: width = len(X_SET)
+	if height == None: height = len(Y_SET)
+
+	# A coordinate have to be consist of 2 chars minimum: the letters of
+	# the X-axis and the number of the Y-axis.
+	match = re.match('^([a-zA-Z]+)([0-9]+)$', string)
+	if match == None: return None
+
+	x = 0
+	for c in match.group(1).upper():
+		x = x * 26 + ord(c) - ord('A') + 1
+	x -= 1
+	y = int(match.group(2)) - 1
+
+	# If the field is not on the map, simply return nothing.
+	if x not in range(width) or y not in range(height):
 		return None
 
 	# Return the result as tuple of X- and Y-axis.
 	return (x,y)
 
 
+# For the tests of the other maps: a Map with a random status on each
+# field, chosen with 'seed' from 'choices'. The other map gets the same
+# fields (eg. BitMap(dict(m.map))) and must give the same answers.
+def random_map(seed, width=None, height=None,
+               choices=(None, None, None, 'water', 'hit', 'ship')):
+	if width == None: width = len(X_SET)
+	if height == None: height = len(Y_SET)
+	rand = random.Random(seed)
+	mymap = Map(width=width, height=height)
+	for x in range(width):
+		for y in range(height):
+			status = rand.choice(choices)
+			if status != None:
+				mymap.set((x,y), status)
+	return mymap
+
+
+# Bigger maps need more ships. This function returns the ship definitions
+# 'ships' for a map of 'width' x 'height' fields: the number of each ship
+# grows with the area of the map. Two maps side by side need a line of
+# water between them, so I count one more row and column for each map.
+# (With the full density of the small map the ships of a big map do not
+# fit anymore -- somewhere there is always a ship left over.)
+def scale_ships(ships, width, height):
+	factor = (width + 1) * (height + 1) / ((len(X_SET) + 1) * (len(Y_SET) + 1))
+	return [
+		dict(shipdef, num=max(1, round(shipdef['num'] * factor)))
+		for shipdef in ships
+	]
+
+
 def print_copyright():
 	print("""
 
@@ -1063,13 +1683,80 @@ def print_copyright():
     along with battleships.  If not, see <http://www.gnu.org/licenses/>.
 
 """)
+
+
+class Test_Map(unittest.TestCase):
+	def test_checked_index(self):
+		# a whole game with the field index of Map checked on every change
+		from simulation import play_game
+		Map.CHECK = True
+		try:
+			self.assertEqual(play_game(3), play_game(3))
+		finally:
+			Map.CHECK = False
+
+	def test_shared_coordinates(self):
+		# all maps of a size hand out the same coordinates
+		a, b = Map(width=7, height=5), Map(width=7, height=5)
+		b.set((3,2), 'water')
+		fields = {id(k) for k in a.get_fields(None)}
+		self.assertEqual(35, len(fields))
+		self.assertTrue(all(id(k) in fields for k in b.get_fields(None)))
+		self.assertTrue(all(
+			id(k) in fields for region in b.regions(2) for k in region
+		))
+		self.assertEqual(6 + 4, len(b.regions(4)))
+
+	def test_cells_of_many_sizes(self):
+		# only the last CELL_SIZES sizes are kept
+		cells = get_cells(7, 5)
+		for size in range(1, CELL_SIZES + 1):
+			get_cells(size, 1)
+		self.assertEqual(CELL_SIZES, len(_CELLS))
+		self.assertNotIn((7, 5), _CELLS)
+		self.assertIsNot(cells, get_cells(7, 5))
+		self.assertEqual(cells.coors, get_cells(7, 5).coors)
+
+
+class Test_Player(unittest.TestCase):
+	def test_sink_ships(self):
+		# the player knows which of his ships is hit without asking the map
+		p = Player(ki=True, rand=random.Random(1))
+		p.set_ships([(0,0), (1,0), (3,3), (3,4), (3,5)], [
+			{'num': 1, 'size': 3, 'name': 'Zerstörer'},
+			{'num': 1, 'size': 2, 'name': 'U-Boot'},
+		])
+		self.assertEqual(['U-Boot', 'Zerstörer'], p.ship_names)
+		self.assertEqual(((0,0), 'hit'), p.bomb((0,0)))
+		self.assertEqual(((0,0), 'hit'), p.bomb((0,0)))
+		self.assertEqual(((1,0), 'sunk'), p.bomb((1,0)))
+		self.assertEqual('sunk', p.ships.get((0,0)))
+		self.assertEqual(((5,5), 'water'), p.bomb((5,5)))
+		self.assertEqual(1, p.ship_count)
+		self.assertEqual([0, 3], p.ship_health)
+
+
+class Test_FoeShips(unittest.TestCase):
+	def test_remove(self):
+		foe = FoeShips(SHIPS)
+		self.assertEqual((10, 5), (len(foe), foe.largest))
+		self.assertEqual('Schlachtschiff', foe.remove(5))
+		self.assertEqual(None, foe.remove(5))
+		self.assertEqual((9, 4, 2), (len(foe), foe.largest, foe.num(4)))
+		for n in range(2): foe.remove(4)
+		for n in range(3): foe.remove(3)
+		self.assertEqual(2, foe.largest)
+
+
 ##
 ##  MAIN
 ##
 
 if __name__ == '__main__':
 
-	import re
+	# set BATTLESHIPS_STATS to get the statistics of the functions
+	import instrument
+	instrument.from_environment(sys.modules[__name__])
 
 	print_copyright()
 
@@ -1078,17 +1765,19 @@ if __name__ == '__main__':
 	p1 = Player()
 	p2 = Player(ki=True, level=00)
 
-	# Now set all ships (for both players).
+	# Now set all ships (for both players). place_ships() takes a layout
+	# of the whole fleet (see fleet.py), where no ships are placed beneath
+	# each other -- there are no 'water' marks on the ship map to clean up.
 	#FIXME: Let the human player set it's ship himself.
-	for ship in SHIPS:
-		num = ship['num']
-		for n in range(num):
-			p1.place_ship(ship)
-			p2.place_ship(ship)
+	p1.place_ships(SHIPS)
+	p2.place_ships(SHIPS)
 
-	# After placing the ships, clean up the ship map from all the 'water'
-	# marks we used to ensure that no ships are placed beneath each other.
-	p1.cleanup_ships_map()
+	# On a real terminal the human player gets a full screen with both
+	# maps -- unless he asks for the line mode with '--lines'.
+	if '--lines' not in sys.argv:
+		from screen import open_screen
+		p1.screen = open_screen(p1)
+		if p1.screen != None: p1.screen.draw()
 
 	# Send a message to the players that the ships were placed.
 	p1.send_message('ships_distributed', p1.ship_count)
@@ -1096,8 +1785,7 @@ if __name__ == '__main__':
 	# Save the player one's ships for player two.
 	p2.save_foes_ships(SHIPS)
 
-	# Do cleanup, message and counting for player two, too.
-	p2.cleanup_ships_map()
+	# Message and counting for player two, too.
 	p2.send_message('ships_distributed', p2.ship_count)
 	p1.save_foes_ships(SHIPS)
 
@@ -1149,6 +1837,10 @@ if __name__ == '__main__':
 	# Send the last two messages of the game.
 	winner.send_message('you_win')
 	loser.send_message('you_lost')
+	if p1.screen != None:
+		p1.screen.update()
+		p1.screen.close()
+	instrument.dump()
 	exit(0)
 
 #EOF
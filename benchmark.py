@@ -0,0 +1,289 @@
+#! /usr/bin/env python3
+# Benchmarks of the maps and the KI.
+#
+#   Copyright 2012 Olaf Ohlenmacher
+#
+#   This file is part of battleships.
+#
+#   Battleships is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Battleships is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with battleships.  If not, see <http://www.gnu.org/licenses/>.
+
+# How fast are the functions the KI needs all the time? Each benchmark
+# runs one function on the same board again and again and counts how
+# often it runs per second. The boards are taken from games with fixed
+# seeds, so every run measures the same thing.
+#
+# The results can be saved as baseline (benchmark.json). The next runs
+# are compared with the baseline and a benchmark which got much slower
+# is marked as regression. The numbers depend on the machine, so the
+# baseline is not part of the sources: run with --save once on your own
+# machine (eg. before a change) and compare later runs with it.
+#
+#     python3 benchmark.py                  run and compare
+#     python3 benchmark.py --save           run and save as baseline
+#     python3 benchmark.py --map BitMap     benchmark another map
+#     python3 benchmark.py --map TileMap
+
+import argparse
+import copy
+import gc
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+import unittest
+
+from battleships import Player, SHIPS, Map, scale_ships
+from simulation import play_game
+
+
+# The default baseline file, next to this file.
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark.json')
+
+# Each benchmark runs in some rounds, the best round counts.
+ROUNDS = 5
+
+# A benchmark is a regression if it is slower than the baseline by this
+# part.
+TOLERANCE = 0.20
+
+
+def board(turns=30, seed=4711, map_class=None, size=10):
+    """
+    Returns two players after 'turns' turns of a KI game with 'seed' on
+    maps of 'size' x 'size' fields.
+    """
+    rand = random.Random(seed)
+    ships = scale_ships(SHIPS, size, size)
+    player = [
+        Player(ki=True, level=50, map_class=map_class, rand=rand,
+               width=size, height=size)
+        for n in range(2)
+    ]
+    for p in player:
+        p.place_ships(ships)
+    for p in player:
+        p.save_foes_ships(ships)
+
+    for turn in range(turns):
+        active, passive = player[turn % 2], player[(turn + 1) % 2]
+        active.handle_result(passive.bomb(active.turn()))
+
+    return player
+
+
+def benchmarks(map_class=None):
+    """
+    Returns a list of benchmarks: tuples of a name, a 'setup' function
+    which returns the arguments and the 'run' function which gets them.
+    """
+    p1, p2 = board(map_class=map_class)
+    hits = p1.hits
+    ships = p2.ships
+
+    # a field of a ship which is hit, but not sunk, and one free field
+    free = sorted(hits.get_fields(None))[0]
+    hit = (sorted(hits.get_fields('hit')) or [free])[0]
+    fields = sorted(ships.get_fields('ship'))
+
+    def same(*args):
+        return lambda: args
+
+    def fresh(player):
+        # for benchmarks which change the player
+        return lambda: (copy.deepcopy(player),)
+
+    result = [
+        ('get_fields(None)', same(hits), lambda m: m.get_fields(None)),
+        ('get_fields(hit)', same(hits), lambda m: m.get_fields('hit')),
+        ('neighbours', same(hits), lambda m: m.neighbours({hit})),
+        ('neighbours(recursive)', same(ships),
+            lambda m: m.neighbours({fields[0]}, {'ship', 'hit'}, True, True)),
+        ('neighbours(odd)', same(hits), lambda m: m.neighbours({hit}, check='odd')),
+        ('get_region', same(hits), lambda m: m.get_region(hit)),
+        ('surround_with', lambda: (copy.deepcopy(hits),),
+            lambda m: m.surround_with(hit, 'water')),
+    ]
+    for size in sorted({s['size'] for s in SHIPS}):
+        result.append((
+            'regions({})'.format(size), same(hits), lambda m, s=size: m.regions(s)
+        ))
+
+    # bomb a field of each ship in turn
+    shots = itertools.cycle(fields)
+    result += [
+        ('Player.bomb', fresh(p2), lambda p: p.bomb(next(shots))),
+        ('Player.handle_result', fresh(p1), lambda p: p.handle_result((free, 'water'))),
+        ('Player._best_moves', fresh(p1), lambda p: p._best_moves()),
+        ('Player._rate_unknown_fields', same(p1), lambda p: p._rate_unknown_fields(5)),
+        ('play_game', same(None), lambda n: play_game(1, map_class=map_class)),
+        ('render', same(hits), lambda m: m.render()),
+        ('Player.render', same(p1), lambda p: p.render()),
+    ]
+
+    # A turn on a big map should not cost much more than on a small one.
+    # (Only with Map and TileMap -- the other maps work on the whole map.)
+    if map_class in (None, Map) or map_class.__name__ == 'TileMap':
+        big = board(turns=300, map_class=map_class, size=100)[0]
+        result += [
+            ('Player.turn(100x100)', fresh(big), lambda p: p.turn()),
+            ('render(100x100)', same(big.hits), lambda m: m.render()),
+        ]
+    return result
+
+
+def measure(setup, run, seconds=0.2):
+    """
+    Returns the number of runs per second and the memory allocated by one
+    run (in bytes, the peak).
+    """
+    # Only the time of 'run' counts, but the setup may take much longer
+    # than the run itself. So each round stops after its part of
+    # 'seconds' all together. The best round counts (like timeit does):
+    # slower rounds only show that the computer did something else, too.
+    # The garbage collector is switched off while running, otherwise the
+    # setup of one run would be collected while the next run is measured.
+    best = 0.0
+    for r in range(ROUNDS):
+        runs = 0
+        spent = 0.0
+        end = time.perf_counter() + seconds / ROUNDS
+        while runs == 0 or time.perf_counter() < end:
+            args = setup()
+            gc.disable()
+            start = time.perf_counter()
+            run(*args)
+            spent += time.perf_counter() - start
+            gc.enable()
+            runs += 1
+        best = max(best, runs / spent)
+
+    # tracemalloc makes everything slow, so I measure the memory in
+    # another run.
+    args = setup()
+    tracemalloc.start()
+    run(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return best, peak
+
+
+def run_benchmarks(map_class=None, seconds=0.2, only=None):
+    """
+    Run all benchmarks and return a dictionary with name -> results.
+    """
+    results = {}
+    for name, setup, run in benchmarks(map_class):
+        if only != None and only not in name: continue
+        ops, peak = measure(setup, run, seconds)
+        results[name] = {'ops': ops, 'bytes': peak}
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Returns the names of all benchmarks which are slower than the
+    baseline by more than 'tolerance'.
+    """
+    slower = []
+    for name, result in results.items():
+        if name not in baseline: continue
+        if result['ops'] < baseline[name]['ops'] * (1 - tolerance):
+            slower.append(name)
+    return slower
+
+
+def print_results(results, baseline={}, slower=()):
+    print("{:<30} {:>12} {:>10} {:>10}".format(
+        'benchmark', 'ops/s', 'bytes', 'baseline'
+    ))
+    for name, result in results.items():
+        base = ''
+        if name in baseline:
+            base = "{:+.0%}".format(result['ops'] / baseline[name]['ops'] - 1)
+        print("{:<30} {:>12.1f} {:>10} {:>10} {}".format(
+            name, result['ops'], result['bytes'], base,
+            'REGRESSION' if name in slower else ''
+        ))
+
+
+class Test_Benchmark(unittest.TestCase):
+    def test_run(self):
+        results = run_benchmarks(seconds=0.01, only='regions(5)')
+        self.assertEqual(['regions(5)'], list(results))
+        self.assertGreater(results['regions(5)']['ops'], 0)
+
+    def test_compare(self):
+        baseline = {'a': {'ops': 100.0}, 'b': {'ops': 100.0}}
+        results = {'a': {'ops': 90.0}, 'b': {'ops': 70.0}, 'c': {'ops': 1.0}}
+        self.assertEqual(['b'], compare(results, baseline))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the maps and the KI.")
+    parser.add_argument('--map', default='Map',
+        help="map class: Map, BitMap, ArrayMap or TileMap (default: Map)")
+    parser.add_argument('--time', type=float, default=0.2,
+        help="seconds per benchmark (default: 0.2)")
+    parser.add_argument('--only', help="run benchmarks containing this name")
+    parser.add_argument('--baseline', default=BASELINE, help="baseline file")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+        help="allowed slowdown against the baseline (default: 0.20)")
+    parser.add_argument('--save', action='store_true',
+        help="save the results as baseline")
+    args = parser.parse_args()
+
+    if args.map == 'BitMap':
+        from BitMap import BitMap as map_class
+    elif args.map == 'ArrayMap':
+        from ArrayMap import ArrayMap as map_class
+    elif args.map == 'TileMap':
+        from TileMap import TileMap as map_class
+    else:
+        map_class = Map
+
+    results = run_benchmarks(map_class, args.time, args.only)
+
+    # the baseline holds the results of each map class
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if args.save:
+        baseline.setdefault(args.map, {}).update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print_results(results)
+        sys.exit(0)
+
+    if args.map not in baseline:
+        print_results(results)
+        print("\nno baseline for {} in {} -- save one with --save".format(
+            args.map, args.baseline
+        ))
+        sys.exit(0)
+
+    slower = compare(results, baseline.get(args.map, {}), args.tolerance)
+    print_results(results, baseline.get(args.map, {}), slower)
+    if slower:
+        print("\n{} regression(s) against {}".format(len(slower), args.baseline))
+        sys.exit(1)
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#EOF
@@ -0,0 +1,232 @@
+#! /usr/bin/env python3
+# Random layouts of a whole fleet.
+#
+#   Copyright 2012 Olaf Ohlenmacher
+#
+#   This file is part of battleships.
+#
+#   Battleships is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Battleships is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with battleships.  If not, see <http://www.gnu.org/licenses/>.
+
+# Player.place_ship() places one ship after the other onto the map and
+# writes water around it. That is fine for one game, but for many games
+# I need many layouts of the fleet -- and fast.
+#
+# A layout is a tuple of placement numbers (see placements.py), one for
+# each ship, the biggest ships first. I keep a bytearray of the blocked
+# fields: a placement is possible if its fields do not meet the halos
+# (the fields and their neighbours) of the ships placed before.
+#
+# Most of the time a random placement fits after a few tries. If it does
+# not, I take one of the free placements. And if there is none left, I
+# search all possible placements and go back to the ships before
+# (backtracking). So even fleets which only just fit onto the map can be
+# placed. Big fleets on big maps are never searched -- there are too many
+# ships to go back.
+
+import random
+import sys
+import time
+import unittest
+
+from battleships import SHIPS, RAND, scale_ships
+from placements import get_index
+
+
+class Fleet(object):
+    """
+    The ships of the ship definitions 'ships' on a map of 'width' x
+    'height' fields.
+    """
+
+    # How often I try a random placement before I take one of the free
+    # ones (PICKS) -- and how often I try the fast way before I search
+    # (TRIES).
+    PICKS = 16
+    TRIES = 8
+
+    # I only search for fleets of at most SEARCH ships.
+    SEARCH = 50
+
+    def __init__(self, ships=SHIPS, width=None, height=None):
+        self.ships = ships
+
+        # all sizes of all ships, the biggest first
+        self.sizes = sorted(
+            [s['size'] for s in ships for n in range(s['num'])], reverse=True
+        )
+        self.index = get_index(self.sizes, width, height)
+
+
+    def layout(self, rand=None):
+        """
+        Returns a random layout of the fleet. Raises ValueError if the
+        fleet does not fit onto the map.
+        """
+        if rand == None: rand = RAND
+
+        # First the fast way, some times. Then the slow way.
+        for t in range(self.TRIES):
+            layout = self._try(rand)
+            if layout != None: return layout
+
+        layout = None
+        if len(self.sizes) <= self.SEARCH:
+            layout = self._search(0, bytearray(self.index.cells), -1, rand)
+        if layout == None:
+            raise ValueError("the fleet does not fit onto the map")
+        return tuple(layout)
+
+
+    def _try(self, rand):
+        # Place the ships one after the other. For each ship I try some
+        # random placements, then I take one of the free ones. Returns
+        # None if there is no free placement left for a ship.
+        index = self.index
+        is_free = index.is_free
+
+        layout = []
+        blocked = bytearray(index.cells)
+        free, free_size = None, None
+        for size in self.sizes:
+            r = index.by_size[size]
+            first, count = r.start, len(r)
+            if count == 0: return None
+            for t in range(self.PICKS):
+                p = first + int(rand.random() * count)
+                if is_free(p, blocked): break
+            else:
+                # The free placements only get less. So I look for them
+                # once for all ships of a size and throw away the ones
+                # which got blocked meanwhile when I meet them.
+                if free_size != size:
+                    free, free_size = index.free(size, blocked), size
+                while True:
+                    if len(free) == 0: return None
+                    i = int(rand.random() * len(free))
+                    p = free[i]
+                    if is_free(p, blocked): break
+                    free[i] = free[-1]
+                    free.pop()
+            layout.append(p)
+            index.block(p, blocked)
+        return tuple(layout)
+
+
+    def _search(self, ship, blocked, last, rand, free=None):
+        # Place ship number 'ship' and all ships after it on the fields
+        # not 'blocked'. Returns the list of placements or None.
+        # Ships of the same size are interchangeable, so a ship only gets
+        # placements with a higher number than the ship before ('last').
+        # Otherwise I would try the same layouts again and again.
+        # 'free' are the placements which were free for the ship before,
+        # if it has the same size: only some of them are still free.
+        if ship == len(self.sizes): return []
+
+        size = self.sizes[ship]
+        if free == None:
+            free = self.index.free(size, blocked)
+        is_free = self.index.is_free
+        free = [p for p in free if p > last and is_free(p, blocked)]
+        if len(free) == 0: return None
+
+        # begin at a random placement to get random layouts
+        first = rand.randrange(len(free))
+        for p in free[first:] + free[:first]:
+            following, candidates = -1, None
+            if ship + 1 < len(self.sizes) and self.sizes[ship + 1] == size:
+                following, candidates = p, free
+            more = bytearray(blocked)
+            self.index.block(p, more)
+            rest = self._search(ship + 1, more, following, rand, candidates)
+            if rest != None: return [p] + rest
+        return None
+
+
+    def layouts(self, rand=None):
+        """
+        Yields random layouts of the fleet, forever.
+        """
+        if rand == None: rand = RAND
+        while True:
+            yield self.layout(rand)
+
+
+    def regions(self, layout):
+        """
+        Returns the regions (ships) of a layout.
+        """
+        return [self.index.region(p) for p in layout]
+
+
+    def mask(self, layout):
+        """
+        Returns the bitmask of all ship fields of a layout.
+        """
+        mask = 0
+        for p in layout:
+            for n in self.index.fields(p):
+                mask |= 1 << n
+        return mask
+
+
+class Test_Fleet(unittest.TestCase):
+    def check(self, fleet, layout):
+        # all ships are placed and no ship touches another one
+        self.assertEqual(len(fleet.sizes), len(layout))
+        blocked = bytearray(fleet.index.cells)
+        for p in layout:
+            self.assertTrue(fleet.index.is_free(p, blocked))
+            fleet.index.block(p, blocked)
+
+    def test_layouts(self):
+        fleet = Fleet()
+        rand = random.Random(3)
+        for n, layout in zip(range(100), fleet.layouts(rand)):
+            self.check(fleet, layout)
+
+    def test_dense_fleet(self):
+        # eight ships of size 4 fill every second row of a 4x15 map
+        fleet = Fleet([{'num': 8, 'size': 4, 'name': 'Kreuzer'}], 4, 15)
+        self.check(fleet, fleet.layout(random.Random(5)))
+
+    def test_too_many_ships(self):
+        fleet = Fleet([{'num': 9, 'size': 4, 'name': 'Kreuzer'}], 4, 15)
+        self.assertRaises(ValueError, fleet.layout)
+
+    def test_big_map(self):
+        fleet = Fleet(scale_ships(SHIPS, 100, 100), 100, 100)
+        self.assertEqual(843, len(fleet.sizes))
+        self.check(fleet, fleet.layout(random.Random(7)))
+
+
+# How many layouts do I get per second?
+#     python3 fleet.py [number of layouts] [size of the map]
+if __name__ == '__main__':
+    num = 100000
+    if len(sys.argv) > 1: num = int(sys.argv[1])
+    size = 10
+    if len(sys.argv) > 2: size = int(sys.argv[2])
+
+    fleet = Fleet(scale_ships(SHIPS, size, size), size, size)
+    start = time.perf_counter()
+    for n, layout in zip(range(num), fleet.layouts(random.Random(0))):
+        pass
+    seconds = time.perf_counter() - start
+    print("{} layouts in {:.2f}s ({:.0f} layouts/min)".format(
+        num, seconds, num / seconds * 60
+    ))
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#EOF
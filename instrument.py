@@ -0,0 +1,309 @@
+#! /usr/bin/env python3
+# Where does the time go?
+#
+#   Copyright 2012 Olaf Ohlenmacher
+#
+#   This file is part of battleships.
+#
+#   Battleships is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Battleships is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with battleships.  If not, see <http://www.gnu.org/licenses/>.
+
+# When the KI feels slow I want to know which function takes the time.
+# install() replaces the interesting functions of Player and the maps by
+# small wrappers which count the calls, sum up the time and count the
+# fields each call handed back. uninstall() puts the
+# original functions back. As long as nothing is installed, nothing
+# costs anything.
+#
+# The easiest way is the environment variable BATTLESHIPS_STATS with the
+# name of a file:
+#
+#     BATTLESHIPS_STATS=stats.json python3 simulation.py 1000
+#
+# Then the statistics are written as JSON into that file at the end of
+# the game(s), and every INTERVAL seconds while many games are played.
+# A '{pid}' in the file name is replaced by the process id, for the
+# worker processes of a tournament. Each process writes its file once
+# more when it ends -- the workers of a Pool end without atexit, so I
+# use the finalizers of multiprocessing, which they do run.
+#
+# The times of the calls are counted in buckets (four per power of two
+# nanoseconds), so the percentiles are good to about 20 percent and the
+# memory needed does not grow with the number of calls.
+
+import json
+import math
+import multiprocessing.util
+import os
+import sys
+import tempfile
+import time
+import unittest
+from collections import Counter
+
+import battleships
+
+
+ENVIRONMENT = 'BATTLESHIPS_STATS'
+
+# seconds between two dumps while playing many games
+INTERVAL = 10.0
+
+# buckets per power of two
+BUCKETS = 4
+
+
+def _area(m):
+    # the number of fields of a map
+    return getattr(m, 'width', len(battleships.X_SET)) * \
+        getattr(m, 'height', len(battleships.Y_SET))
+
+
+def _fields(regions):
+    # the number of fields of all regions
+    return sum(len(region) for region in regions)
+
+
+# The functions to instrument: the name of the method and a function
+# which returns the number of fields ('cells') of a call. It gets the
+# arguments of the call and its result. I do not guess how many fields
+# a function looks at inside (that depends on the map and on the
+# board), I count what it hands back: the fields it found, set or rated.
+# Only print() hands back nothing -- it shows all fields of the map.
+PLAYER = {
+    'turn':                 None,
+    '_best_moves':          lambda args, result: len(result),
+    '_rate_unknown_fields': lambda args, result: len(result),
+    '_mark_hit_ship':       None,
+    'bomb':                 None,
+    'handle_result':        None,
+    'send_message':         None,
+}
+MAP = {
+    'get_fields':   lambda args, result: len(result),
+    'neighbours':   lambda args, result: len(result),
+    'get_region':   lambda args, result: len(result),
+    'surround_with': lambda args, result: len(result),
+    'regions':      lambda args, result: _fields(result),
+    'print':        lambda args, result: _area(args[0]),
+}
+
+
+class Stats(object):
+    """
+    The statistics of one function.
+    """
+
+    def __init__(self):
+        self.calls   = 0
+        self.time    = 0
+        self.cells   = 0
+        self.buckets = Counter()
+
+    def add(self, ns, cells):
+        self.calls += 1
+        self.time  += ns
+        self.cells += cells
+        self.buckets[int(BUCKETS * math.log2(ns + 1))] += 1
+
+    def percentile(self, p):
+        """
+        Returns the time (in seconds) which 'p' percent of the calls did
+        not exceed -- the upper end of its bucket.
+        """
+        limit = p * self.calls / 100
+        count = 0
+        for bucket in sorted(self.buckets):
+            count += self.buckets[bucket]
+            if count >= limit:
+                return 2 ** ((bucket + 1) / BUCKETS) / 1e9
+        return 0.0
+
+    def report(self):
+        return {
+            'calls':    self.calls,
+            'time':     self.time / 1e9,
+            'p50':      self.percentile(50),
+            'p90':      self.percentile(90),
+            'p99':      self.percentile(99),
+            'cells':    self.cells,
+            'cells_per_call': self.cells / self.calls if self.calls else 0,
+        }
+
+
+# All statistics by name ('Class.method') and all replaced functions.
+STATS = {}
+_ORIGINAL = {}
+_LAST_DUMP = [0.0]
+_FINAL_DUMP = [None]
+
+
+def _wrap(name, func, cells):
+    stats = STATS.setdefault(name, Stats())
+    clock = time.perf_counter_ns
+
+    def wrapper(*args, **kwargs):
+        start = clock()
+        result = func(*args, **kwargs)
+        ns = clock() - start
+        stats.add(ns, cells(args, result) if cells != None else 0)
+        return result
+
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__  = func.__doc__
+    return wrapper
+
+
+def _targets(module):
+    # Player, Map and all other maps which are loaded
+    yield module.Player, PLAYER
+    yield module.Map, MAP
+    for module, name in (('BitMap', 'BitMap'), ('ArrayMap', 'ArrayMap'),
+                         ('TileMap', 'TileMap')):
+        if module in sys.modules:
+            yield getattr(sys.modules[module], name), MAP
+
+
+def install(module=battleships):
+    """
+    Replace the interesting functions by instrumented ones. 'module' is
+    the module of Player and Map -- when battleships.py is started as
+    program, this is '__main__'.
+    """
+    for cls, methods in _targets(module):
+        for method, cells in methods.items():
+            key = (cls, method)
+            if key in _ORIGINAL: continue
+            func = cls.__dict__[method]
+            _ORIGINAL[key] = func
+            setattr(cls, method, _wrap(cls.__name__ + '.' + method, func, cells))
+    _LAST_DUMP[0] = time.monotonic()
+
+
+def uninstall():
+    """
+    Put the original functions back.
+    """
+    for (cls, method), func in _ORIGINAL.items():
+        setattr(cls, method, func)
+    _ORIGINAL.clear()
+
+
+def installed():
+    return len(_ORIGINAL) > 0
+
+
+def reset():
+    """
+    Forget all statistics collected so far.
+    """
+    for stats in STATS.values():
+        stats.__init__()
+
+
+def report():
+    """
+    Returns the statistics of all functions as dictionary.
+    """
+    return {
+        name: stats.report() for name, stats in sorted(STATS.items())
+        if stats.calls > 0
+    }
+
+
+def dump(path=None):
+    """
+    Write the statistics as JSON into 'path' (default: the file of the
+    environment variable).
+    """
+    if path == None: path = os.environ.get(ENVIRONMENT)
+    if not path: return
+    path = path.replace('{pid}', str(os.getpid()))
+
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=1)
+    _LAST_DUMP[0] = time.monotonic()
+
+
+def tick():
+    """
+    Dump the statistics if the last dump is more than INTERVAL seconds
+    ago. Call this between games.
+    """
+    if installed() and time.monotonic() - _LAST_DUMP[0] >= INTERVAL:
+        dump()
+
+
+def from_environment(module=battleships):
+    """
+    Install the instrumentation if the environment variable is set.
+    """
+    if os.environ.get(ENVIRONMENT):
+        install(module)
+        # (a forked worker has the finalizer of its parent, but not
+        # registered for itself)
+        if _FINAL_DUMP[0] != os.getpid():
+            _FINAL_DUMP[0] = os.getpid()
+            multiprocessing.util.Finalize(None, dump, exitpriority=10)
+
+
+class Test_Instrument(unittest.TestCase):
+    def tearDown(self):
+        uninstall()
+        reset()
+
+    def test_install(self):
+        original = battleships.Map.regions
+        install()
+        self.assertIsNot(original, battleships.Map.regions)
+
+        m = battleships.Map()
+        m.set((4, 4), 'water')
+        m.regions(5)
+        m.regions(10)
+        stats = report()['Map.regions']
+        self.assertEqual(2, stats['calls'])
+        # 9 + 9 whole rows and columns, the two others are cut at (4, 4)
+        # into 4 and 5 fields
+        self.assertEqual(2 * (9 * 10 + 5) + 2 * 9 * 10, stats['cells'])
+        self.assertGreater(stats['p99'], 0)
+
+        uninstall()
+        self.assertIs(original, battleships.Map.regions)
+
+    def test_workers(self):
+        # the workers of a tournament write their statistics when they end
+        from tournament import tournament
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'stats-{pid}.json')
+            os.environ[ENVIRONMENT] = path
+            try:
+                tournament((50,), games=4, workers=2)
+            finally:
+                del os.environ[ENVIRONMENT]
+            # (a worker may have got no game at all)
+            turns = 0
+            for name in os.listdir(tmp):
+                with open(os.path.join(tmp, name)) as f:
+                    turns += json.load(f).get('Player.turn', {'calls': 0})['calls']
+            self.assertGreater(turns, 4 * 20)
+
+    def test_percentile(self):
+        s = Stats()
+        for ns in range(1, 1001):
+            s.add(ns * 1000, 0)
+        self.assertAlmostEqual(500e-6, s.percentile(50), delta=100e-6)
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#EOF
@@ -0,0 +1,220 @@
+#! /usr/bin/env python3
+# A library of fleet layouts on disk.
+#
+#   Copyright 2012 Olaf Ohlenmacher
+#
+#   This file is part of battleships.
+#
+#   Battleships is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Battleships is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with battleships.  If not, see <http://www.gnu.org/licenses/>.
+
+# For really many games I do not want to place the ships again and again.
+# Instead I generate a big number of layouts once (see fleet.py), write
+# them into a file and take one of them for each game.
+#
+# The file is simple: a header of 64 bytes, then one record per layout.
+# A record is the bitmask of all ship fields (see Fleet.mask()), stored
+# with as many bytes as needed for all fields of the map, little endian.
+#
+#   header:   8 bytes   magic 'BSLAYOUT'
+#             2 bytes   version (2)
+#             2 bytes   width of the map
+#             2 bytes   height of the map
+#             4 bytes   size of a record in bytes
+#             8 bytes   number of records
+#            32 bytes   key of the ship definitions (see ships_key())
+#             6 bytes   unused
+#
+# (Version 1 had only 2 bytes for the size of a record, which is too
+# little for maps bigger than about 724x724.)
+#
+# The file is read with mmap, so all processes reading the same library
+# share it in memory and nothing is copied before a record is used.
+
+import hashlib
+import mmap
+import os
+import random
+import struct
+import sys
+import tempfile
+import unittest
+
+from battleships import SHIPS, X_SET, Y_SET
+from fleet import Fleet
+
+
+MAGIC   = b'BSLAYOUT'
+VERSION = 2
+HEADER  = struct.Struct('<8sHHHIQ32s6x')
+
+
+def ships_key(ships):
+    """
+    Returns a key (32 bytes) for the ship definitions. Only sizes and
+    numbers of the ships count, not their names.
+    """
+    sizes = sorted((s['size'], s['num']) for s in ships)
+    return hashlib.sha256(repr(sizes).encode()).digest()
+
+
+def library_name(ships=SHIPS, width=None, height=None):
+    """
+    Returns a file name for a library of the given ships and map size.
+    """
+    if width == None: width = len(X_SET)
+    if height == None: height = len(Y_SET)
+    return "layouts-{}x{}-{}.bin".format(width, height, ships_key(ships).hex()[:12])
+
+
+def write_library(path, count, ships=SHIPS, width=None, height=None, rand=None):
+    """
+    Generate 'count' layouts and write them into the file 'path'.
+    """
+    if width == None: width = len(X_SET)
+    if height == None: height = len(Y_SET)
+    if rand == None: rand = random.Random()
+
+    fleet = Fleet(ships, width, height)
+    size = (width * height + 7) // 8
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(
+            MAGIC, VERSION, width, height, size, count, ships_key(ships)
+        ))
+        layouts = fleet.layouts(rand)
+        for n in range(count):
+            f.write(fleet.mask(next(layouts)).to_bytes(size, 'little'))
+
+
+class LayoutLibrary(object):
+    """
+    A library of layouts in the file 'path'. If 'ships', 'width' or
+    'height' are given, the library must fit to them.
+    """
+
+    def __init__(self, path, ships=None, width=None, height=None):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.width, self.height, self.size, self.count, \
+            self.key = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a layout library", path)
+        if len(self.mmap) < HEADER.size + self.count * self.size:
+            raise ValueError("layout library is too short", path)
+
+        if ships != None and ships_key(ships) != self.key:
+            raise ValueError("layout library is for other ships", path)
+        if width != None and width != self.width \
+           or height != None and height != self.height:
+            raise ValueError("layout library is for another map size", path)
+
+        self.data = memoryview(self.mmap)[HEADER.size:]
+
+
+    def __len__(self):
+        return self.count
+
+
+    def record(self, n):
+        """
+        Returns the record of layout 'n' (without copying it).
+        """
+        return self.data[n * self.size:(n + 1) * self.size]
+
+
+    def mask(self, n):
+        """
+        Returns the bitmask of layout 'n'.
+        """
+        return int.from_bytes(self.record(n), 'little')
+
+
+    def sample(self, rand=None):
+        """
+        Returns the bitmask of a random layout.
+        """
+        if rand == None: rand = random
+        return self.mask(rand.randrange(self.count))
+
+
+    def fields(self, mask):
+        """
+        Returns the ship fields of a bitmask.
+        """
+        fields = []
+        while mask:
+            low = mask & -mask
+            n = low.bit_length() - 1
+            fields.append((n % self.width, n // self.width))
+            mask ^= low
+        return fields
+
+
+    def close(self):
+        self.data.release()
+        self.mmap.close()
+
+
+class Test_LayoutLibrary(unittest.TestCase):
+    def test_write_and_read(self):
+        fleet = Fleet()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, library_name())
+            write_library(path, 50, rand=random.Random(1))
+
+            library = LayoutLibrary(path, SHIPS, len(X_SET), len(Y_SET))
+            self.assertEqual(50, len(library))
+
+            # the same layouts as the fleet makes with the same seed
+            layouts = fleet.layouts(random.Random(1))
+            for n in range(50):
+                self.assertEqual(fleet.mask(next(layouts)), library.mask(n))
+
+            fields = library.fields(library.sample(random.Random(2)))
+            self.assertEqual(sum(s['num'] * s['size'] for s in SHIPS), len(fields))
+            library.close()
+
+    def test_big_map(self):
+        # a record of 80000 bytes
+        ships = [{'num': 2, 'size': 2, 'name': 'U-Boot'}]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'layouts.bin')
+            write_library(path, 2, ships, 800, 800, random.Random(3))
+            library = LayoutLibrary(path, ships, 800, 800)
+            self.assertEqual(80000, library.size)
+            self.assertEqual(4, len(library.fields(library.mask(1))))
+            library.close()
+
+    def test_other_ships(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'layouts.bin')
+            write_library(path, 1)
+            self.assertRaises(ValueError, LayoutLibrary, path, SHIPS[:2])
+
+
+# Write a library:
+#     python3 library.py [number of layouts] [file]
+if __name__ == '__main__':
+    count = 1000000
+    if len(sys.argv) > 1: count = int(sys.argv[1])
+    path = library_name()
+    if len(sys.argv) > 2: path = sys.argv[2]
+
+    write_library(path, count)
+    print("{} layouts written to {}".format(count, path))
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#EOF
@@ -0,0 +1,335 @@
+#! /usr/bin/env python3
+# How much can the server and the advisor take?
+#
+#   Copyright 2012 Olaf Ohlenmacher
+#
+#   This file is part of battleships.
+#
+#   Battleships is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Battleships is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with battleships.  If not, see <http://www.gnu.org/licenses/>.
+
+# The load test lets many clients play real games, one after the other,
+# and measures how long the shots take:
+#
+#   - against the server (server.py): each client plays against the KI
+#     of the server with play_client(). A client is a KI itself or -- to
+#     keep the load test cheap -- a ScriptedPlayer, which shoots at the
+#     fields in a random order.
+#   - against the advisor (advisor.py): each client plays a game on its
+#     own (turn -> bomb -> handle_result), but asks the advisor for each
+#     turn.
+#
+# Each client waits 'think' seconds before a shot, so 'clients' / 'think'
+# is the number of shots per second asked for. The load goes up in
+# stages: each stage has 'factor' times the clients of the one before,
+# until the p99 of the shots is longer than the SLO (or a client fails).
+# For each stage I count the times of the connects, the shots and the
+# games in histograms (instrument.Stats) and the shots of each second.
+#
+# Thousands of clients need thousands of connections -- maybe the limit
+# of open files (ulimit -n) must be raised for this. Everything runs on
+# localhost only.
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import random
+import time
+import unittest
+from collections import Counter
+
+from battleships import Player, FoeShips, SHIPS, as_koor
+from instrument import Stats, BUCKETS
+from server import Server, play_client
+from advisor import Advisor, http_request, player_board
+
+
+HOST = '127.0.0.1'
+
+# the defaults of a load test
+CLIENTS = 10            # clients in the first stage
+FACTOR  = 2.0           # more clients in the next stage
+STAGE   = 10.0          # seconds of a stage
+SLO     = 0.05          # seconds for the p99 of the shots
+THINK   = 0.1           # seconds a client waits before a shot
+MAX_CLIENTS = 10000     # no stage has more clients
+
+
+class ScriptedPlayer(Player):
+    """
+    A Player who shoots at all fields in a random order. He does not
+    think, so he costs (almost) nothing.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.order = [(x, y) for x in range(self.width) for y in range(self.height)]
+        self.rand.shuffle(self.order)
+
+    def save_foes_ships(self, shipdef):
+        # no placement counts -- I do not need them
+        self.foeships = FoeShips(shipdef)
+
+    def turn(self):
+        while self.order:
+            koor = self.order.pop()
+            if self.hits.get(koor) == None: return koor
+        return None
+
+
+class Load(object):
+    """
+    The statistics of one stage with 'clients' clients.
+    """
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.stats = {'connect': Stats(), 'move': Stats(), 'game': Stats()}
+        self.games  = 0
+        self.failed = 0
+        self.start  = time.perf_counter()
+        self.end    = None
+        self.per_second = Counter()
+
+    def add(self, name, seconds):
+        """
+        Count the time of a 'connect', 'move' or 'game'.
+        """
+        self.stats[name].add(int(seconds * 1e9), 0)
+        if name == 'move':
+            self.per_second[int(time.perf_counter() - self.start)] += 1
+
+    def histogram(self, name):
+        """
+        Returns the histogram of 'name': the upper end of each bucket (in
+        seconds) -> number of calls.
+        """
+        buckets = self.stats[name].buckets
+        return {
+            2 ** ((b + 1) / BUCKETS) / 1e9: buckets[b] for b in sorted(buckets)
+        }
+
+    def report(self):
+        seconds = (self.end or time.perf_counter()) - self.start
+        moves = self.stats['move']
+        return {
+            'clients':    self.clients,
+            'seconds':    seconds,
+            'games':      self.games,
+            'failed':     self.failed,
+            'moves':      moves.calls,
+            'moves_per_second': moves.calls / seconds,
+            'p50':        moves.percentile(50),
+            'p99':        moves.percentile(99),
+            'connect_p99': self.stats['connect'].percentile(99),
+            'histograms': {name: self.histogram(name) for name in self.stats},
+            'per_second': [self.per_second[s] for s in range(int(seconds) + 1)],
+        }
+
+
+async def server_client(load, port, think, rand, ki=False, level=50):
+    """
+    Play games against the KI of the server until cancelled.
+    """
+    player_class = Player if ki else ScriptedPlayer
+    while True:
+        start = time.perf_counter()
+        result = await play_client(HOST, port, 'KI', level, rand,
+                                   player_class=player_class, think=think,
+                                   timing=load.add)
+        if result == None:
+            load.failed += 1
+            return
+        load.add('game', time.perf_counter() - start)
+        load.games += 1
+
+
+async def advisor_client(load, port, think, rand, ki=False, level=50):
+    """
+    Play games with the moves of the advisor until cancelled.
+    """
+    clock = time.perf_counter
+    start = clock()
+    reader, writer = await asyncio.open_connection(HOST, port)
+    load.add('connect', clock() - start)
+    try:
+        while True:
+            start = clock()
+            player, foe = Player(ki=True, level=level, rand=rand), Player(ki=True, rand=rand)
+            foe.place_ships(SHIPS)
+            player.foeships = FoeShips(SHIPS)
+            while not foe.is_all_sunk():
+                if think > 0: await asyncio.sleep(think)
+                move = clock()
+                code, answer = await http_request(reader, writer, 'POST', '/move',
+                    player_board(player, seed=rand.randrange(2 ** 32))
+                )
+                load.add('move', clock() - move)
+                if code != 200:
+                    load.failed += 1
+                    return
+                koor, status = foe.bomb(as_koor(answer['move']))
+                player.handle_result((koor, status))
+                if status == 'sunk':
+                    player.hits.surround_with(koor, 'water')
+            load.add('game', clock() - start)
+            load.games += 1
+    finally:
+        writer.close()
+
+
+async def run_stage(target, port, clients, seconds=STAGE, think=THINK,
+                    ki=False, level=50, seed=0):
+    """
+    Let 'clients' clients play against the 'target' ('server' or
+    'advisor') on 'port' for 'seconds'. Returns the Load.
+    """
+    client = server_client if target == 'server' else advisor_client
+    load = Load(clients)
+    tasks = [
+        asyncio.ensure_future(client(
+            load, port, think, random.Random("{}:{}".format(seed, n)), ki, level
+        ))
+        for n in range(clients)
+    ]
+    await asyncio.wait(tasks, timeout=seconds)
+    load.end = time.perf_counter()
+    for task in tasks:
+        task.cancel()
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, OSError):
+            # no connection, eg. too many open files
+            load.failed += 1
+    return load
+
+
+async def ramp(target, port, clients=CLIENTS, factor=FACTOR, seconds=STAGE,
+               slo=SLO, think=THINK, max_clients=MAX_CLIENTS, ki=False,
+               level=50, progress=None):
+    """
+    Run stages with more and more clients until the p99 of the shots
+    breaks the 'slo' (or a client fails). Returns the reports of all
+    stages; 'progress' is called with each of them.
+    """
+    reports = []
+    while True:
+        load = await run_stage(target, port, clients, seconds, think, ki, level,
+                               seed=len(reports))
+        report = load.report()
+        report['ok'] = report['failed'] == 0 and report['p99'] <= slo
+        reports.append(report)
+        if progress != None: progress(report)
+        if not report['ok'] or clients >= max_clients: break
+        clients = min(max(clients + 1, int(clients * factor)), max_clients)
+    return reports
+
+
+def print_report(report):
+    print("{clients:>6} clients  {moves_per_second:>8.1f} shots/s  "
+          "p50 {p50:.4f}s  p99 {p99:.4f}s  connect p99 {connect_p99:.4f}s  "
+          "{games} games  {failed} failed  {0}".format(
+              'ok' if report['ok'] else 'SLO broken', **report
+          ))
+
+
+class Test_LoadTest(unittest.TestCase):
+    def test_server(self):
+        async def main():
+            server = Server(seed=2)
+            port = await server.start()
+            reports = await ramp('server', port, clients=2, seconds=0.5,
+                                 think=0.0, slo=10.0, max_clients=4)
+            await server.close()
+            return reports
+        reports = asyncio.run(main())
+
+        # no SLO broken: stages with 2 and 4 clients
+        self.assertEqual([2, 4], [r['clients'] for r in reports])
+        for r in reports:
+            self.assertTrue(r['ok'])
+            self.assertGreater(r['moves'], 0)
+            self.assertEqual(r['moves'], sum(r['histograms']['move'].values()))
+            self.assertEqual(r['moves'], sum(r['per_second']))
+            self.assertGreaterEqual(sum(r["histograms"]["connect"].values()), r["clients"])
+
+    def test_advisor(self):
+        async def main():
+            with concurrent.futures.ThreadPoolExecutor(2) as executor:
+                advisor = Advisor(workers=2, executor=executor)
+                port = await advisor.start()
+                # nobody is faster than 0 seconds
+                reports = await ramp('advisor', port, clients=3, seconds=0.3,
+                                     think=0.0, slo=0.0)
+                requests = advisor.report()['requests']
+                await advisor.close()
+            return reports, requests
+        reports, requests = asyncio.run(main())
+        self.assertEqual(1, len(reports))
+        self.assertFalse(reports[0]['ok'])
+        self.assertEqual(0, reports[0]['failed'])
+        self.assertGreater(reports[0]['moves'], 0)
+        self.assertGreaterEqual(requests, reports[0]['moves'])
+
+
+# Start the server (or the advisor) and load it:
+#     python3 server.py 4711
+#     python3 loadtest.py --port 4711
+#     python3 advisor.py 4712
+#     python3 loadtest.py --advisor --port 4712 --think 0.5
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load the server or the advisor on localhost.")
+    parser.add_argument('--advisor', action='store_true',
+        help="load the advisor instead of the server")
+    parser.add_argument('--port', type=int, help="port (default: 4711 or 4712)")
+    parser.add_argument('--clients', type=int, default=CLIENTS,
+        help="clients in the first stage (default: {})".format(CLIENTS))
+    parser.add_argument('--factor', type=float, default=FACTOR,
+        help="more clients in each stage (default: {})".format(FACTOR))
+    parser.add_argument('--max-clients', type=int, default=MAX_CLIENTS,
+        help="clients in the last stage (default: {})".format(MAX_CLIENTS))
+    parser.add_argument('--time', type=float, default=STAGE,
+        help="seconds per stage (default: {})".format(STAGE))
+    parser.add_argument('--think', type=float, default=THINK,
+        help="seconds before each shot (default: {})".format(THINK))
+    parser.add_argument('--slo', type=float, default=SLO,
+        help="seconds for the p99 of the shots (default: {})".format(SLO))
+    parser.add_argument('--ki', action='store_true',
+        help="the clients of the server are KIs (default: scripted)")
+    parser.add_argument('--level', type=int, default=50, help="KI level (default: 50)")
+    parser.add_argument('--json', help="write the reports into this file")
+    args = parser.parse_args()
+
+    target = 'advisor' if args.advisor else 'server'
+    port = args.port or (4712 if args.advisor else 4711)
+    reports = asyncio.run(ramp(
+        target, port, args.clients, args.factor, args.time, args.slo,
+        args.think, args.max_clients, args.ki, args.level, print_report
+    ))
+
+    good = [r for r in reports if r['ok']]
+    if good:
+        print("\n{} takes {} clients ({:.1f} shots/s) within the SLO".format(
+            target, good[-1]['clients'], good[-1]['moves_per_second']
+        ))
+    else:
+        print("\n{} breaks the SLO already with {} clients".format(
+            target, reports[0]['clients']
+        ))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=1)
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#EOF
@@ -0,0 +1,545 @@
+#! /usr/bin/env python3
+# Count the possible placements of the foe's ships.
+#
+#   Copyright 2012 Olaf Ohlenmacher
+#
+#   This file is part of battleships.
+#
+#   Battleships is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Battleships is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with battleships.  If not, see <http://www.gnu.org/licenses/>.
+
+# Where could the foe's ships be? A ship of size 3 may lie on every 3
+# unknown fields in a row or in a column. For each unknown field I count
+# how many of these placements cover it. The more placements, the better
+# the chance to hit a ship there.
+#
+# Counting everything again after each bombardment is a waste of time:
+# one bombed field only changes the placements through this field, and
+# these are in the same row or column and not farther away than the size
+# of the ship. So the counts are kept up to date field by field.
+#
+# The placements of a map are numbered (see PlacementIndex). Fields and
+# placements are computed from the numbers, nothing is stored for each
+# placement -- so this works for a map of 1000x1000 fields, too. Placing
+# the own ships uses this index, too.
+
+import random
+import unittest
+from array import array
+from bisect import bisect_right
+
+from battleships import X_SET, Y_SET, STATUS_SET
+
+
+# The placements of a map never change -- only whether they are still
+# possible. So I compute them once for each size of map and each set of
+# ship sizes and share them. This dictionary holds all PlacementIndex
+# objects computed so far.
+_INDEX = {}
+
+# For maps with at most CACHE placements the fields and the halo of each
+# placement are computed in advance.
+CACHE = 10000
+
+
+def get_index(sizes, width=None, height=None):
+    """
+    Returns the (shared) PlacementIndex of a map of 'width' x 'height'
+    fields for ships of 'sizes'.
+    """
+    if width == None: width = len(X_SET)
+    if height == None: height = len(Y_SET)
+
+    key = (width, height, tuple(sorted(set(sizes))))
+    if key not in _INDEX:
+        _INDEX[key] = PlacementIndex(key[2], width, height)
+    return _INDEX[key]
+
+
+class PlacementIndex(object):
+    """
+    All horizontal and vertical placements of ships of the given sizes on
+    a map of 'width' x 'height' fields.
+    """
+
+    def __init__(self, sizes, width, height):
+        self.width  = width
+        self.height = height
+        self.sizes  = tuple(sizes)
+
+        # A field is numbered with 'y * width + x'.
+        self.cells = width * height
+
+        # The placements are numbered in blocks: for each size first all
+        # horizontal placements, then all vertical ones. Inside a block a
+        # placement is numbered by its first field, row by row. A block
+        # is a tuple of its first number, the size, the step from one
+        # field of the ship to the next, the number of columns of first
+        # fields and whether the ships lie across. (On a map of one column
+        # the step down is 1, too -- so the step does not tell.)
+        # 'by_size' gives the range of placement numbers for each size.
+        self.blocks  = []
+        self.by_size = {}
+        number = 0
+        for size in self.sizes:
+            first = number
+            for step, columns, rows, across in (
+                (1, width - size + 1, height, True),
+                (width, width, height - size + 1, False)
+            ):
+                if columns < 1 or rows < 1: columns = rows = 0
+                self.blocks.append((number, size, step, columns, across))
+                number += columns * rows
+            self.by_size[size] = range(first, number)
+        self.count = number
+        self.firsts = [block[0] for block in self.blocks]
+
+        # On a small map I compute everything in advance. The tables of
+        # start() and through() replace the methods: their __getitem__()
+        # is called like the method, but faster.
+        self.slices = self.halos = None
+        if self.count <= CACHE:
+            starts  = [self.start(p) for p in range(self.count)]
+            through = [self.through(n) for n in range(self.cells)]
+            self.start   = starts.__getitem__
+            self.through = through.__getitem__
+            self.slices = [self._slice(p) for p in range(self.count)]
+            self.halos  = [self._halo(p) for p in range(self.count)]
+
+
+    def number(self, koor):
+        """
+        Returns the number of a field.
+        """
+        return koor[1] * self.width + koor[0]
+
+
+    def koor(self, n):
+        """
+        Returns the coordinate of field number 'n'.
+        """
+        return (n % self.width, n // self.width)
+
+
+    def start(self, p):
+        """
+        Returns the number of the first field, the step to the next field
+        and the size of placement 'p'.
+        """
+        first, size, step, columns, across = self._block(p)
+        y, x = divmod(p - first, columns)
+        return y * self.width + x, step, size
+
+
+    def _block(self, p):
+        # the block of placement 'p'
+        return self.blocks[bisect_right(self.firsts, p) - 1]
+
+
+    def fields(self, p):
+        """
+        Returns the numbers of the fields of placement 'p'.
+        """
+        n, step, size = self.start(p)
+        return range(n, n + size * step, step)
+
+
+    def through(self, n):
+        """
+        Returns the numbers of all placements covering field number 'n'.
+        """
+        x, y = n % self.width, n // self.width
+        result = []
+        for first, size, step, columns, across in self.blocks:
+            if columns == 0: continue
+            if across:
+                # the first field is left of 'x' in the same row
+                for xi in range(max(x - size + 1, 0), min(x, columns - 1) + 1):
+                    result.append(first + y * columns + xi)
+            else:
+                # the first field is above 'y' in the same column
+                rows = self.height - size + 1
+                for yi in range(max(y - size + 1, 0), min(y, rows - 1) + 1):
+                    result.append(first + yi * columns + x)
+        return result
+
+
+    def region(self, p):
+        """
+        Returns the fields (coordinates) of a placement as region.
+        """
+        return [self.koor(n) for n in self.fields(p)]
+
+
+    def _slice(self, p):
+        # the fields of a placement as slice of a bytearray of all fields
+        n, step, size = self.start(p)
+        return slice(n, n + (size - 1) * step + 1, step)
+
+
+    def _halo(self, p):
+        # the fields of a placement and their neighbours as a list of
+        # slices (one per row) and the bytes to fill them
+        n, step, size = self.start(p)
+        w = self.width
+        x, y = n % w, n // w
+        if self._block(p)[4]:
+            x1, y1 = x + size - 1, y
+        else:
+            x1, y1 = x, y + size - 1
+
+        x0, x1 = max(x - 1, 0), min(x1 + 1, w - 1)
+        ones = b'\x01' * (x1 - x0 + 1)
+        return [
+            (slice(yi * w + x0, yi * w + x1 + 1), ones)
+            for yi in range(max(y - 1, 0), min(y1 + 2, self.height))
+        ]
+
+
+    def is_free(self, p, blocked):
+        """
+        Returns True if no field of placement 'p' is blocked. 'blocked'
+        is a bytearray with one byte for each field (not 0 is blocked).
+        """
+        if self.slices != None: return not any(blocked[self.slices[p]])
+        return not any(blocked[self._slice(p)])
+
+
+    def block(self, p, blocked):
+        """
+        Block the fields of placement 'p' and all of their neighbours in
+        the bytearray 'blocked'.
+        """
+        halo = self.halos[p] if self.halos != None else self._halo(p)
+        for rows, ones in halo:
+            blocked[rows] = ones
+
+
+    def free(self, size, blocked):
+        """
+        Returns the numbers of all placements of 'size' which have no
+        field blocked in the bytearray 'blocked' (sorted).
+        """
+        # A placement is free if it lies in a run of unblocked fields.
+        # The runs of a row or a column are found by splitting its bytes.
+        w, h = self.width, self.height
+        result = []
+        r = self.by_size[size]
+        if len(r) == 0: return result
+
+        first = r.start
+        columns = w - size + 1
+        if columns > 0:
+            for y in range(h):
+                p = first + y * columns
+                for run in blocked[y * w:(y + 1) * w].split(b'\x01'):
+                    n = len(run)
+                    if n >= size: result.extend(range(p, p + n - size + 1))
+                    p += n + 1
+            first += columns * h
+
+        if h - size + 1 > 0:
+            for x in range(w):
+                p = first + x
+                for run in blocked[x::w].split(b'\x01'):
+                    n = len(run)
+                    if n >= size: result.extend(range(p, p + (n - size + 1) * w, w))
+                    p += (n + 1) * w
+
+        result.sort()
+        return result
+
+
+class Counts(object):
+    """
+    The number of placements of ships of one 'size' covering each field
+    of the map of a PlacementIndex.
+    """
+
+    def __init__(self, index, size):
+        self.index = index
+        w, h = index.width, index.height
+
+        # On an empty map the count of a field is the number of placements
+        # through it in its row plus the number in its column.
+        def line(length):
+            return [
+                max(min(n, length - size) - max(n - size + 1, 0) + 1, 0)
+                for n in range(length)
+            ]
+        across, down = line(w), line(h)
+
+        # 'count' holds the count of each field. To find the fields with
+        # the highest count fast, I keep a list of the fields for each
+        # count ('buckets') and the number of fields with each count
+        # ('sizes'). When the count of a field changes, the field is only
+        # appended to its new bucket. It stays in the old one until best()
+        # meets it there -- this is much cheaper than taking it out at
+        # once.
+        rows = {c: bytes(a + c for a in across) for c in set(down)}
+        self.count = bytearray(b''.join(rows[c] for c in down))
+        self.buckets = [array('l') for c in range(2 * size + 1)]
+        self.sizes = [0] * (2 * size + 1)
+
+        xs = {}
+        for x, c in enumerate(across):
+            xs.setdefault(c, array('l')).append(x)
+        for y, c in enumerate(down):
+            for a, columns in xs.items():
+                self.buckets[a + c].extend(
+                    array('l', map((y * w).__add__, columns))
+                )
+        for c, bucket in enumerate(self.buckets):
+            self.sizes[c] = len(bucket)
+
+
+    def add(self, fields, n):
+        """
+        Add 'n' to the count of the fields (numbers).
+        """
+        count, buckets, sizes = self.count, self.buckets, self.sizes
+        for f in fields:
+            old = count[f]
+            new = count[f] = old + n
+            sizes[old] -= 1
+            sizes[new] += 1
+            if new > 0: buckets[new].append(f)
+
+
+    def best(self, limit=None, rand=None):
+        """
+        Returns the highest count and the numbers of the fields with this
+        count. If there are more than 'limit' fields, a random sample of
+        them is returned.
+        """
+        count = self.count
+        for c in range(len(self.buckets) - 1, 0, -1):
+            if self.sizes[c] == 0: continue
+            bucket = self.buckets[c]
+
+            # Only some fields: throw away all fields which have another
+            # count now (or are twice in the bucket) and take the rest.
+            if limit == None or self.sizes[c] <= limit:
+                fields = list(dict.fromkeys(f for f in bucket if count[f] == c))
+                self.buckets[c] = array('l', fields)
+                return c, fields
+
+            # Many fields: take random ones and throw away the ones with
+            # another count when I meet them.
+            if rand == None: rand = random
+            fields = {}
+            while len(fields) < limit:
+                i = int(rand.random() * len(bucket))
+                f = bucket[i]
+                if count[f] == c:
+                    fields[f] = True
+                else:
+                    bucket[i] = bucket[-1]
+                    bucket.pop()
+            return c, list(fields)
+        return 0, []
+
+
+class Placements(object):
+    """
+    The number of placements of ships of each size covering each unknown
+    field of a map.
+    """
+
+    def __init__(self, sizes, mymap=None, width=None, height=None):
+        if mymap != None and width == None:
+            width, height = mymap.width, mymap.height
+        self.index = index = get_index(sizes, width, height)
+
+        # 'known' marks the fields which are known for me, 'blocked'
+        # holds the number of known fields of each placement. A placement
+        # is only possible if it has no known field.
+        self.known   = bytearray(index.cells)
+        self.blocked = bytearray(index.count)
+
+        # the counts of the fields for each ship size
+        self.counts = {size: Counts(index, size) for size in index.by_size}
+
+        # take over all fields which are already known on the map -- I ask
+        # for the known ones, there are much less of them on a big map
+        if mymap != None:
+            known = set()
+            for status in STATUS_SET - {None}:
+                known |= mymap.get_fields(status)
+            if len(known) > 0:
+                self.update(sorted(known, key=index.number), mymap)
+
+
+    def update(self, fields, mymap=None):
+        """
+        Update the counts for 'fields' which have changed on 'mymap'. If
+        'mymap' is not given, all fields are known now.
+        """
+        index = self.index
+        blocked = self.blocked
+        for field in fields:
+            n = index.number(field)
+            known = mymap == None or mymap.get(field) != None
+            if known == self.known[n]: continue
+            self.known[n] = known
+
+            # A field which gets known blocks all placements through it, a
+            # field which gets unknown again frees them. Only the first
+            # block and the last free changes the counts.
+            if known:
+                for p in index.through(n):
+                    blocked[p] += 1
+                    if blocked[p] == 1:
+                        first, step, size = index.start(p)
+                        self.counts[size].add(range(first, first + size * step, step), -1)
+            else:
+                for p in index.through(n):
+                    blocked[p] -= 1
+                    if blocked[p] == 0:
+                        first, step, size = index.start(p)
+                        self.counts[size].add(range(first, first + size * step, step), 1)
+
+
+    def count(self, size, field):
+        """
+        Returns the number of placements of 'size' covering 'field'.
+        """
+        if size not in self.counts: return 0
+        return self.counts[size].count[self.index.number(field)]
+
+
+    def best(self, size, limit=None, rand=None):
+        """
+        Returns the highest number of placements of 'size' and the fields
+        with this number (at most 'limit' of them, chosen with 'rand').
+        """
+        if size not in self.counts: return 0, []
+        rate, fields = self.counts[size].best(limit, rand)
+        return rate, [self.index.koor(n) for n in fields]
+
+
+    def rate_map(self, size):
+        """
+        Returns the <target map> with the number of placements of 'size'
+        for each field.
+        """
+        if size not in self.counts: return {}
+        koor = self.index.koor
+        return {
+            koor(n): c for n, c in enumerate(self.counts[size].count) if c > 0
+        }
+
+
+class Test_Placements(unittest.TestCase):
+    def test_empty_map(self):
+        p = Placements([5])
+        # in a corner there is one placement per direction, in the middle
+        # of a 10 fields line there are 5 per direction
+        self.assertEqual(2, p.rate_map(5)[(0,0)])
+        self.assertEqual(10, p.rate_map(5)[(4,4)])
+        self.assertEqual((10, [(4,4), (4,5), (5,4), (5,5)]),
+            (p.best(5)[0], sorted(p.best(5)[1])))
+
+    def test_index(self):
+        index = get_index([2, 5])
+        self.assertIs(index, get_index([5, 2, 2]), "index is shared")
+
+        # 9 placements of size 2 per line and direction
+        self.assertEqual(2 * 10 * 9, len(index.by_size[2]))
+        for p in index.through(index.number((3,4))):
+            self.assertIn((3,4), index.region(p))
+        # size 2: 2 across and 2 down, size 5: 4 across (x=3) and 5 down
+        self.assertEqual(2 + 2 + 4 + 5, len(index.through(index.number((3,4)))))
+
+    def test_free(self):
+        # a map which is not square: 7 columns, 3 rows
+        index = get_index([3], 7, 3)
+        blocked = bytearray(7 * 3)
+        self.assertEqual(list(index.by_size[3]), index.free(3, blocked))
+
+        # a ship in the middle blocks everything but the left and right
+        # column
+        p = 1 * 5 + 2
+        self.assertEqual([(2,1), (3,1), (4,1)], index.region(p))
+        index.block(p, blocked)
+        self.assertEqual([[(0,0), (0,1), (0,2)], [(6,0), (6,1), (6,2)]],
+            [index.region(q) for q in index.free(3, blocked)])
+
+        blocked = bytearray(7 * 3)
+        blocked[index.number((6,0))] = 1
+        for q in index.free(3, blocked):
+            self.assertTrue(index.is_free(q, blocked))
+            self.assertNotIn((6,0), index.region(q))
+        self.assertEqual(len(index.by_size[3]) - 2, len(index.free(3, blocked)))
+
+    def test_update(self):
+        from battleships import Map
+
+        rand = random.Random(1)
+        mymap = Map(width=12, height=8)
+        p = Placements([2, 3, 5], mymap)
+        for n in range(80):
+            koor = (rand.randrange(12), rand.randrange(8))
+            mymap.set(koor, rand.choice(('water', 'hit', None)))
+            p.update({koor}, mymap)
+
+            # the incremental counts are the same as counting again
+            fresh = Placements([2, 3, 5], mymap)
+            for size in (2, 3, 5):
+                self.assertEqual(fresh.rate_map(size), p.rate_map(size))
+                self.assertEqual(fresh.best(size)[0], p.best(size)[0])
+                self.assertEqual(
+                    sorted(fresh.best(size)[1]), sorted(p.best(size)[1])
+                )
+
+    def test_same_best_moves(self):
+        # Before the placement counts the KI rated the unknown fields by
+        # the rows and columns around them (_rate_unknown_fields()). On
+        # these boards both ratings pick the same fields.
+        from battleships import Player, SHIPS
+        import random
+
+        def best(rate_map):
+            top = max(rate_map.values())
+            return {koor for koor, rate in rate_map.items() if rate == top}
+
+        for water in ([(0,0)], [(4,4), (5,5), (2,7), (7,2)]):
+            player = Player(ki=True, level=100, rand=random.Random(1))
+            player.save_foes_ships(SHIPS)
+            for koor in water:
+                player.handle_result((koor, 'water'))
+            counted = best(player._best_moves())
+            player.placements = None
+            rated = best(player._best_moves())
+            self.assertEqual(rated, counted)
+
+    def test_one_column(self):
+        # on a map of one column the ships lie down, with a step of 1
+        index = get_index([3], 1, 7)
+        self.assertEqual(5, len(index.by_size[3]))
+        self.assertEqual([0, 1, 2], index.through(index.number((0,2))))
+        blocked = bytearray(7)
+        index.block(0, blocked)
+        self.assertEqual(bytearray(b'\x01' * 4 + b'\x00' * 3), blocked)
+
+        from simulation import play_game
+        ships = [{'num': 2, 'size': 2, 'name': 'U-Boot'}]
+        self.assertIn(play_game(1, ships, width=1, height=7).winner, (0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#EOF
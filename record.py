@@ -0,0 +1,412 @@
+#! /usr/bin/env python3
+# Records of played games.
+#
+#   Copyright 2012 Olaf Ohlenmacher
+#
+#   This file is part of battleships.
+#
+#   Battleships is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Battleships is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with battleships.  If not, see <http://www.gnu.org/licenses/>.
+
+# To look at past games again I write down what happened: the seed, the
+# size of the maps, the ships and where both players placed them, and
+# then every shot with its result. With this a game can be replayed
+# without the random generator (and without the KI).
+#
+# A record file begins with a header of 16 bytes. Then the games follow
+# one after the other, new games are appended at the end:
+#
+#   file:     8 bytes   magic 'BSRECORD'
+#             2 bytes   version (1)
+#             6 bytes   unused
+#
+#   game:     4 bytes   'GAME'
+#             2 bytes   width of the map
+#             2 bytes   height of the map
+#             1 byte    KI level of player 0
+#             1 byte    KI level of player 1
+#             1 byte    type of the seed (0: None, 1: int, 2: str)
+#             1 byte    unused
+#             2 bytes   number of ship definitions
+#             4 bytes   size of a layout in bytes
+#             2 bytes   length of the seed
+#             ...       the seed (as text)
+#             ...       ship definitions: 2 bytes size, 2 bytes number,
+#                       1 byte length of the name, the name (UTF-8)
+#             ...       the layouts of both players (bitmasks of the ship
+#                       fields, like in library.py)
+#             ...       the shots, 5 bytes each: 4 bytes the number of
+#                       the field (y * width + x), 1 byte the player
+#                       (bit 7) and the result (1: water, 2: hit,
+#                       3: sunk)
+#             5 bytes   the end of the game: field 0xffffffff, result 0
+#
+# All numbers are little endian. A shot is a fixed size entry, so the
+# shots of a game are read with struct.iter_unpack() in one go.
+
+import mmap
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import unittest
+
+from battleships import Player, Map, SHIPS
+
+
+MAGIC   = b'BSRECORD'
+VERSION = 1
+HEADER  = struct.Struct('<8sH6x')
+GAME    = struct.Struct('<4sHHBBBxHIH')
+SHIP    = struct.Struct('<HHB')
+SHOT    = struct.Struct('<IB')
+
+# the results of a shot and their codes
+RESULTS = (None, 'water', 'hit', 'sunk')
+CODE = {result: code for code, result in enumerate(RESULTS)}
+SUNK = CODE['sunk']
+
+END = SHOT.pack(0xffffffff, 0)
+
+SEED_TYPES = (type(None), int, str)
+
+
+def layout_mask(mymap):
+    """
+    Returns the bitmask of the ship fields of a map.
+    """
+    mask = 0
+    for (x, y) in mymap.get_fields('ship'):
+        mask |= 1 << (y * mymap.width + x)
+    return mask
+
+
+class GameWriter(object):
+    """
+    Appends the records of games to the file 'path'.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(HEADER.pack(MAGIC, VERSION))
+        self.buffer = None
+
+
+    def begin(self, seed, width, height, ships, layouts, levels=(0, 0)):
+        """
+        Begin the record of a game. 'layouts' are the ship maps (or their
+        bitmasks) of both players.
+        """
+        size = (width * height + 7) // 8
+        seed_text = b'' if seed == None else str(seed).encode()
+        self.width = width
+        self.buffer = bytearray(GAME.pack(
+            b'GAME', width, height, levels[0], levels[1],
+            SEED_TYPES.index(type(seed)), len(ships), size, len(seed_text)
+        ))
+        self.buffer += seed_text
+        for s in ships:
+            name = s['name'].encode()
+            self.buffer += SHIP.pack(s['size'], s['num'], len(name)) + name
+        for layout in layouts:
+            if not isinstance(layout, int): layout = layout_mask(layout)
+            self.buffer += layout.to_bytes(size, 'little')
+
+
+    def shot(self, player, koor, result):
+        """
+        Record the shot of 'player' (0 or 1) at 'koor' and its 'result'.
+        """
+        # (This is called for every shot, so it should be cheap: the
+        # shots are collected in memory and written with the end of the
+        # game.)
+        self.buffer += SHOT.pack(koor[1] * self.width + koor[0],
+                                 player << 7 | CODE[result])
+
+
+    def end(self):
+        """
+        End the record of a game and write it.
+        """
+        self.buffer += END
+        self.file.write(self.buffer)
+        self.buffer = None
+
+
+    def close(self):
+        self.file.close()
+
+
+class Game(object):
+    """
+    The record of one game, as read by read_games().
+    """
+
+    def __init__(self, seed, width, height, levels, ships, layouts, shots):
+        self.seed    = seed
+        self.width   = width
+        self.height  = height
+        self.levels  = levels
+        self.ships   = ships
+        self.layouts = layouts
+        self.data    = shots
+
+
+    def __len__(self):
+        return len(self.data) // SHOT.size
+
+
+    def raw_shots(self):
+        """
+        Yields each shot as tuple of the field number and the code
+        (player << 7 | result code).
+        """
+        return SHOT.iter_unpack(self.data)
+
+
+    def shots(self):
+        """
+        Yields each shot as tuple of the player, the field and the result.
+        """
+        width = self.width
+        for n, code in SHOT.iter_unpack(self.data):
+            yield code >> 7, (n % width, n // width), RESULTS[code & 0x7f]
+
+
+    def fields(self, player):
+        """
+        Returns the ship fields of the layout of 'player'.
+        """
+        mask = self.layouts[player]
+        fields = []
+        while mask:
+            low = mask & -mask
+            n = low.bit_length() - 1
+            fields.append((n % self.width, n // self.width))
+            mask ^= low
+        return fields
+
+
+    def players(self, map_class=None):
+        """
+        Returns both players with their ships placed, before the first
+        shot.
+        """
+        player = [
+            Player(ki=True, level=level, map_class=map_class,
+                   rand=random.Random(self.seed),
+                   width=self.width, height=self.height)
+            for level in self.levels
+        ]
+        for n, p in enumerate(player):
+            p.set_ships(self.fields(n), self.ships)
+        for p in player:
+            p.save_foes_ships(self.ships)
+        return player
+
+
+    def replay(self, map_class=None, shots=None):
+        """
+        Replay the first 'shots' shots (default: all) with Player.bomb()
+        and Player.handle_result() and return both players. Raises
+        ValueError if a result differs from the record.
+        """
+        player = self.players(map_class)
+        for active, koor, result in self.shots():
+            if shots != None:
+                if shots == 0: break
+                shots -= 1
+            got = player[1 - active].bomb(koor)
+            if got[1] != result:
+                raise ValueError("replay differs from the record", koor, result, got)
+            player[active].handle_result(got)
+        return player
+
+
+    def boards(self, shots=None):
+        """
+        Returns the open maps of both players after the first 'shots'
+        shots (default: all) as bytearrays with the result code of each
+        field (y * width + x). A sunk ship is marked completely.
+        This is much faster than replay(), there is no Player involved.
+        """
+        width, cells = self.width, self.width * self.height
+        data = self.data
+        if shots != None: data = data[:shots * SHOT.size]
+
+        # the ship fields of both layouts, for the sunk ships
+        ships = []
+        for mask in self.layouts:
+            ship = bytearray(cells)
+            for (x, y) in self.fields(len(ships)):
+                ship[y * width + x] = 1
+            ships.append(ship)
+
+        boards = (bytearray(cells), bytearray(cells))
+        for n, code in SHOT.iter_unpack(data):
+            board = boards[code >> 7]
+            result = code & 0x7f
+            board[n] = result
+            if result == SUNK:
+                # Ships are straight and do not touch each other, so I
+                # walk from the field into all four directions while
+                # there is a ship field of the foe's layout.
+                ship = ships[1 - (code >> 7)]
+                row = n // width
+                for step in (1, -1, width, -width):
+                    f = n + step
+                    while 0 <= f < cells and ship[f] and \
+                          (abs(step) == width or f // width == row):
+                        board[f] = SUNK
+                        f += step
+        return boards
+
+
+    def maps(self, map_class=None, shots=None):
+        """
+        Returns the open maps of both players after the first 'shots'
+        shots as maps of 'map_class' (default: Map).
+        """
+        if map_class == None: map_class = Map
+        result = []
+        for board in self.boards(shots):
+            m = map_class(width=self.width, height=self.height)
+            for n, code in enumerate(board):
+                if code:
+                    m.set((n % self.width, n // self.width), RESULTS[code])
+            result.append(m)
+        return result
+
+
+def read_games(path):
+    """
+    Yields the records (Game objects) of all games in the file 'path'.
+    """
+    # The file is read with mmap (like the layout library), only the
+    # parts which are used are read from the disk.
+    if os.path.getsize(path) < HEADER.size:
+        raise ValueError("not a game record", path)
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a game record", path)
+
+    view = memoryview(data)
+    pos = HEADER.size
+    while pos < len(data):
+        marker, width, height, level0, level1, seed_type, num_ships, size, \
+            seed_len = GAME.unpack_from(data, pos)
+        if marker != b'GAME':
+            raise ValueError("broken game record", path, pos)
+        pos += GAME.size
+
+        seed = bytes(data[pos:pos + seed_len]).decode()
+        seed = SEED_TYPES[seed_type](seed) if seed_type else None
+        pos += seed_len
+
+        ships = []
+        for n in range(num_ships):
+            ship_size, num, name_len = SHIP.unpack_from(data, pos)
+            pos += SHIP.size
+            name = bytes(data[pos:pos + name_len]).decode()
+            pos += name_len
+            ships.append({'num': num, 'size': ship_size, 'name': name})
+
+        layouts = []
+        for n in range(2):
+            layouts.append(int.from_bytes(view[pos:pos + size], 'little'))
+            pos += size
+
+        # the shots go up to the end mark -- which must be at the border
+        # of a shot (a game which was not finished has none)
+        end = data.find(END, pos)
+        while end >= 0 and (end - pos) % SHOT.size:
+            end = data.find(END, end + 1)
+        if end < 0:
+            end = pos + (len(data) - pos) // SHOT.size * SHOT.size
+            following = len(data)
+        else:
+            following = end + SHOT.size
+
+        yield Game(seed, width, height, (level0, level1), ships,
+                   tuple(layouts), view[pos:end])
+        pos = following
+
+
+class Test_Record(unittest.TestCase):
+    def setUp(self):
+        from simulation import play_game
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'games.bsr')
+        writer = GameWriter(self.path)
+        self.results = [play_game(seed, record=writer) for seed in (1, 'zwei')]
+        writer.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_read(self):
+        games = list(read_games(self.path))
+        self.assertEqual([1, 'zwei'], [g.seed for g in games])
+        self.assertEqual(SHIPS, games[0].ships)
+        self.assertEqual(self.results[0].turns, len(games[0]))
+
+    def test_replay(self):
+        for game, result in zip(read_games(self.path), self.results):
+            player = game.replay()
+            self.assertTrue(player[1 - result.winner].is_all_sunk())
+
+            # the fast way gives the same open maps
+            boards = game.maps()
+            for n in range(2):
+                self.assertEqual(
+                    player[n].hits.get_fields('sunk'), boards[n].get_fields('sunk')
+                )
+                self.assertEqual(
+                    player[n].hits.get_fields('hit'), boards[n].get_fields('hit')
+                )
+
+    def test_unfinished(self):
+        writer = GameWriter(self.path)
+        writer.begin(3, 10, 10, SHIPS, [0, 0])
+        writer.shot(0, (4, 5), 'water')
+        writer.file.write(writer.buffer)
+        writer.close()
+
+        games = list(read_games(self.path))
+        self.assertEqual(3, len(games))
+        self.assertEqual([(0, (4, 5), 'water')], list(games[2].shots()))
+
+
+# Replay the games of a record and tell me how fast it was:
+#     python3 record.py file
+if __name__ == '__main__':
+    start = time.perf_counter()
+    games = shots = 0
+    for game in read_games(sys.argv[1]):
+        game.boards()
+        games += 1
+        shots += len(game)
+    seconds = time.perf_counter() - start
+    print("{} games, {} shots in {:.2f}s ({:.0f} shots/s)".format(
+        games, shots, seconds, shots / seconds
+    ))
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#EOF
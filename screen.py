@@ -0,0 +1,267 @@
+#! /usr/bin/env python3
+# A full screen terminal for 'battleships'.
+#
+#   Copyright 2012 Olaf Ohlenmacher
+#
+#   This file is part of battleships.
+#
+#   Battleships is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Battleships is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with battleships.  If not, see <http://www.gnu.org/licenses/>.
+
+# When I play over a slow connection, printing both maps after each
+# command takes its time, and the messages scroll the maps away. So the
+# Screen shows both maps of the human player once and afterwards only
+# writes the fields which changed -- it moves the cursor to the field
+# with an ANSI escape sequence and writes its sign. The messages have
+# their own lines below the maps.
+#
+# The Screen remembers the sign of every known field it has shown. To
+# find the changed fields it asks the maps for their known fields only,
+# so an update costs nearly nothing when little has changed.
+#
+# Terminals which do not understand the escape sequences (TERM=dumb, no
+# terminal at all, or a terminal too small for the maps) do not get a
+# Screen -- the game uses the old line mode there.
+
+import io
+import os
+import shutil
+import sys
+import unittest
+import unittest.mock
+
+from battleships import LEGENDE, known_fields, side_by_side
+
+
+# The escape sequences: clear the screen, move the cursor (row and column
+# begin with 1) and clear the rest of the line.
+CLEAR = "\x1b[H\x1b[2J"
+MOVE  = "\x1b[{};{}H"
+ERASE = "\x1b[K"
+
+# the space between the two maps and the titles above them
+GAP = 4
+TITLES = ("Deine Schiffe", "Deine Schüsse")
+
+# the lines of the message area at least
+MESSAGES = 3
+
+# the prompt below a page (see page())
+BACK = "[Return] zurück zum Spiel"
+
+
+
+def open_screen(player, out=None):
+    """
+    Returns a Screen for the human 'player' -- or None if the terminal can
+    not show one.
+    """
+    if out == None: out = sys.stdout
+    if os.environ.get('TERM', 'dumb') in ('', 'dumb'): return None
+    if not out.isatty(): return None
+
+    columns, lines = shutil.get_terminal_size()
+    screen = Screen(player, out, lines)
+    if screen.columns > columns or screen.prompt_line + MESSAGES > lines:
+        return None
+    return screen
+
+
+class Screen(object):
+    """
+    A full screen view of both maps of 'player' on the terminal 'out'
+    with 'lines' lines.
+    """
+
+    def __init__(self, player, out, lines=24):
+        self.player = player
+        self.out    = out
+        self.lines  = lines
+
+        # The layout is the one of Player.render(): a title, the header
+        # of the maps (two lines) and one line for each row. The sign of
+        # field x is in column 4 + 2*x of the rendered line, the right
+        # map begins after the left one and the gap.
+        left = [TITLES[0]] + player.ships.render().splitlines()
+        self.offset = max(len(line) for line in left) + GAP
+        self.columns = self.offset + len(player.hits.render().splitlines()[-1])
+        self.top = 3
+        self.prompt_line = self.top + player.height + 2
+
+        # the signs shown for each map, by field -- unknown fields are
+        # missing
+        self.shown = ({}, {})
+        self.messages = []
+
+
+    def _maps(self):
+        return (self.player.ships, self.player.hits)
+
+
+    def _signs(self, mymap):
+        # the signs of all known fields of a map
+        return {k: LEGENDE[s] for k, s in known_fields(mymap).items()}
+
+
+    def _move(self, line, column):
+        # the escape sequence to move the cursor to 'line' and 'column'
+        # (both begin with 0)
+        return MOVE.format(line + 1, column + 1)
+
+
+    def draw(self):
+        """
+        Draw everything again.
+        """
+        ships, hits = self._maps()
+        text = CLEAR + side_by_side(ships.render(), hits.render(), TITLES, GAP)
+        self.shown = tuple(self._signs(m) for m in (ships, hits))
+        self.out.write(text + self._message_area())
+        self.out.flush()
+
+
+    def update(self):
+        """
+        Write the fields which changed since the last draw() or update().
+        Returns the number of fields written.
+        """
+        parts = []
+        for n, mymap in enumerate(self._maps()):
+            shown = self.shown[n]
+            signs = self._signs(mymap)
+            left = 0 if n == 0 else self.offset
+
+            changed = [k for k, s in signs.items() if shown.get(k) != s]
+            changed += [k for k in shown if k not in signs]
+            for (x, y) in changed:
+                sign = signs.get((x, y), LEGENDE[None])
+                parts.append(self._move(self.top + y, left + 4 + 2*x) + sign)
+            self.shown[n].clear()
+            self.shown[n].update(signs)
+
+        if parts:
+            parts.append(self._move(self.prompt_line, 0))
+            self.out.write("".join(parts))
+            self.out.flush()
+        return len(parts) - (1 if parts else 0)
+
+
+    def _message_area(self, new=None):
+        # The message lines below the prompt, each line cleared before.
+        # As long as the area is not full, only the 'new' lines are
+        # written -- afterwards all lines move up.
+        first = self.prompt_line + 1
+        count = max(self.lines - first - 1, MESSAGES)
+        if new != None and len(self.messages) <= count:
+            start = len(self.messages) - new
+        else:
+            start = 0
+            self.messages = self.messages[-count:]
+        shown = self.messages + [''] * (count - len(self.messages))
+        return "".join(
+            self._move(first + n, 0) + ERASE + shown[n]
+            for n in range(start, len(shown) if new == None else len(self.messages))
+        ) + self._move(self.prompt_line, 0)
+
+
+    def message(self, text):
+        """
+        Show a message (may have several lines) in the message area.
+        """
+        lines = text.strip("\n").split("\n")
+        self.messages += lines
+        self.out.write(self._message_area(len(lines)))
+        self.out.flush()
+
+
+    def page(self, text):
+        """
+        Show a longer text (eg. the help) on the whole screen until the
+        player presses return, then draw the maps again.
+        """
+        self.out.write(CLEAR + text.strip("\n") + "\n\n")
+        self.out.flush()
+        input(BACK)
+        self.draw()
+
+
+    def close(self):
+        """
+        Leave the cursor below everything, for the shell.
+        """
+        self.out.write(self._move(self.lines - 1, 0) + "\n")
+        self.out.flush()
+
+
+    def ask(self, prompt):
+        """
+        Ask for a command on the prompt line and return the answer.
+        """
+        self.update()
+        self.out.write(self._move(self.prompt_line, 0) + ERASE)
+        self.out.flush()
+        return input(prompt)
+
+
+class Test_Screen(unittest.TestCase):
+    def setUp(self):
+        from battleships import Player, SHIPS
+
+        import random
+        self.player = Player(ki=True, rand=random.Random(3))
+        self.player.place_ships(SHIPS)
+        self.out = io.StringIO()
+        self.screen = Screen(self.player, self.out)
+
+    def test_update(self):
+        self.screen.draw()
+        self.assertIn("Deine Schiffe", self.out.getvalue())
+        self.assertEqual(0, self.screen.update())
+
+        # one bomb onto the water and a hit on the open map: two fields
+        self.out.seek(0)
+        self.out.truncate()
+        self.player.bomb((0,0))
+        self.player.handle_result(((4,5), 'hit'))
+        self.assertEqual(2, self.screen.update())
+        self.assertIn(MOVE.format(3 + 5 + 1, self.screen.offset + 4 + 8 + 1) + '+',
+            self.out.getvalue())
+
+    def test_messages(self):
+        self.screen.message("Wasser.\nNoch mal.")
+        self.assertEqual(["Wasser.", "Noch mal."], self.screen.messages)
+        self.assertIn(ERASE + "Noch mal.", self.out.getvalue())
+
+        # only the new line is written as long as there is room
+        self.out.seek(0)
+        self.out.truncate()
+        self.screen.message("Treffer!")
+        self.assertEqual(1, self.out.getvalue().count(ERASE))
+
+    def test_page(self):
+        # the whole help is shown, then the maps again
+        from battleships import _print_help
+        with unittest.mock.patch('builtins.input', return_value='') as ask:
+            _print_help(self.screen.page)
+        ask.assert_called_once_with(BACK)
+        text = self.out.getvalue()
+        for command in ('ende', 'skip', 'ships', 'tipp', 'hilfe'):
+            self.assertIn(command + " ", text)
+        self.assertIn("Deine Schiffe", text[text.rindex(CLEAR):])
+
+    def test_dumb_terminal(self):
+        self.assertEqual(None, open_screen(self.player, io.StringIO()))
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#EOF
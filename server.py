@@ -0,0 +1,676 @@
+#! /usr/bin/env python3
+# A server for many games of 'battleships' at once.
+#
+#   Copyright 2012 Olaf Ohlenmacher
+#
+#   This file is part of battleships.
+#
+#   Battleships is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Battleships is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with battleships.  If not, see <http://www.gnu.org/licenses/>.
+
+# Inside one program two Players play with turn(), bomb() and
+# handle_result(). The server does the same over TCP: the players are
+# clients (humans or KIs somewhere else), or a KI of the server. The
+# server keeps both Players of each game -- their maps are the truth --
+# and only tells the clients what they need to know.
+#
+# The protocol is made of lines of text (UTF-8), the fields are written
+# like on the terminal ('a5'):
+#
+#   client                      server
+#   KI [level]                  start a game against the KI of the server
+#   JOIN                        start a game against the next client who
+#                               joins, too
+#                               GAME <width> <height> <ships as JSON>
+#                               SHIPS <field> <field> ...  (your ships)
+#                               TURN                     (your turn)
+#   BOMB <field>                RESULT <field> <water|hit|sunk>
+#                               FOE <field> <water|hit|sunk> (foe's shot)
+#                               ERROR <text>             (try again)
+#   QUIT                        give up
+#                               WIN / LOST               (end of the game)
+#
+# Everybody may watch a game. A spectator gets the open maps of both
+# players once and then only what changed with each shot. A field is
+# written with its sign of the LEGENDE ('c5*' is a sunk ship at c5):
+#
+#   GAMES                       GAMES <number> <number> ...
+#   WATCH <number>              SNAPSHOT <number> <width> <height> <shots>
+#                               MAP <player> <field> <field> ...
+#                               MAP <player> ...
+#                               MOVE <shot> <player> <field> <status> <changed field> ...
+#                               END <winner>
+#
+# The changed fields are the ones the shooter's open map got since his
+# last shot -- the rest of a sunk ship and the water the KI marked.
+# Each MOVE is encoded once and the same bytes go to all spectators. A
+# spectator who does not read fast enough gets nothing until his
+# connection catches up -- then he gets a new snapshot instead of all
+# the moves he missed.
+#
+# Each game is a coroutine, so thousands of games only cost their maps.
+# A turn of the KI may take its time on a big map, so it runs in a
+# thread pool -- while it thinks, the other games go on. The number of
+# games, the length of a line and the time for a turn are limited, so a
+# game can not take more than its share of memory and time.
+
+import asyncio
+import concurrent.futures
+import json
+import random
+import sys
+import time
+import unittest
+
+from battleships import Player, SHIPS, LEGENDE, as_xy, as_koor, known_fields
+
+
+# the limits of the server
+MAX_GAMES    = 10000     # games at once
+LINE_LIMIT   = 1024      # bytes of a line from a client
+TURN_TIMEOUT = 60.0      # seconds for a turn of a client
+TRIES        = 3         # wrong moves of a client in one turn
+KI_THREADS   = 4         # threads for the KI turns
+BEHIND       = 65536     # bytes not yet sent to a spectator who is behind
+
+
+class KISeat(object):
+    """
+    A seat of a game taken by the KI of the server. The KI is the
+    server's Player of this seat itself.
+    """
+
+    def __init__(self, server):
+        self.server = server
+
+    async def send(self, *words):
+        pass
+
+    async def turn(self, player):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.server.executor, player.turn)
+
+    def close(self):
+        pass
+
+
+class ClientSeat(object):
+    """
+    A seat of a game taken by a client.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def send(self, *words):
+        self.writer.write((" ".join(words) + "\n").encode())
+        await self.writer.drain()
+
+    async def read(self, timeout=None):
+        # the words of the next line -- None if the client is gone
+        try:
+            line = await asyncio.wait_for(self.reader.readline(), timeout)
+        except (asyncio.TimeoutError, ValueError, ConnectionError):
+            return None
+        if not line: return None
+        return line.decode(errors='replace').split()
+
+    async def turn(self, player):
+        # Ask for a shot. Returns None if the client gives up, is gone
+        # or does not answer in time.
+        await self.send('TURN')
+        for t in range(TRIES):
+            words = await self.read(TURN_TIMEOUT)
+            if words == None or words[:1] == ['QUIT']: return None
+            if len(words) == 2 and words[0] == 'BOMB':
+                koor = as_koor(words[1], player.width, player.height)
+                if koor != None and player.hits.get(koor) == None:
+                    return koor
+            await self.send('ERROR', 'wrong move')
+        return None
+
+    def close(self):
+        self.writer.close()
+
+
+def _field(koor, status):
+    # a field for the spectators: its name and its sign ('c5*')
+    return as_xy(koor) + LEGENDE[status]
+
+
+class Match(object):
+    """
+    A running game with the number 'number' between the Players 'player'
+    and its spectators.
+    """
+
+    def __init__(self, number, player):
+        self.number = number
+        self.player = player
+        self.shots  = 0
+
+        # the open maps as the spectators know them (field -> status)
+        self.shown = ({}, {})
+        self.spectators = set()
+        self.snapshot = None
+        self.done = asyncio.get_running_loop().create_future()
+
+
+    def _changes(self, n):
+        # the fields of the open map of player 'n' which changed since
+        # the spectators saw it the last time
+        fields = known_fields(self.player[n].hits)
+        shown = self.shown[n]
+        changed = [(k, s) for k, s in fields.items() if shown.get(k) != s]
+        changed += [(k, None) for k in shown if k not in fields]
+        self.shown = tuple(fields if m == n else self.shown[m] for m in range(2))
+        return changed
+
+
+    def _snapshot(self):
+        # the snapshot for new spectators -- made once for each shot
+        if self.snapshot == None:
+            p = self.player[0]
+            lines = ["SNAPSHOT {} {} {} {}".format(
+                self.number, p.width, p.height, self.shots
+            )]
+            for n in range(2):
+                lines.append(" ".join(["MAP", str(n)] + [
+                    _field(k, s) for k, s in sorted(self.shown[n].items())
+                ]))
+            self.snapshot = ("\n".join(lines) + "\n").encode()
+        return self.snapshot
+
+
+    def watch(self, writer):
+        """
+        Add a spectator (the StreamWriter of his connection).
+        """
+        self.spectators.add(writer)
+        writer.behind = False
+        writer.write(self._snapshot())
+
+
+    def move(self, active, result):
+        """
+        Tell the spectators about the shot of player 'active' with
+        'result'.
+        """
+        koor, status = result
+        changed = [_field(k, s) for k, s in self._changes(active) if k != koor]
+        line = "MOVE {} {} {} {} {}".format(
+            self.shots, active, as_xy(koor), status, " ".join(changed)
+        )
+        self.shots += 1
+        self.snapshot = None
+        self.broadcast(line.rstrip() + "\n")
+
+
+    def broadcast(self, text):
+        """
+        Send 'text' to all spectators which are not behind.
+        """
+        data = text.encode()
+        for writer in list(self.spectators):
+            if writer.is_closing():
+                self.spectators.discard(writer)
+                continue
+            waiting = writer.transport.get_write_buffer_size()
+            if writer.behind:
+                # he missed some moves -- a snapshot replaces all of them
+                if waiting > 0: continue
+                writer.behind = False
+                writer.write(self._snapshot())
+            elif waiting > BEHIND:
+                writer.behind = True
+            else:
+                writer.write(data)
+
+
+    def finish(self, winner):
+        """
+        The game is over: tell the spectators and let them go.
+        """
+        # No more moves will come, so nobody can wait for his buffer to
+        # drain: who is behind gets the snapshot and the END right now.
+        end = "END {}\n".format(winner).encode()
+        for writer in list(self.spectators):
+            if writer.is_closing():
+                self.spectators.discard(writer)
+                continue
+            if writer.behind:
+                writer.behind = False
+                writer.write(self._snapshot())
+            writer.write(end)
+        self.done.set_result(winner)
+
+
+class Server(object):
+    """
+    The server for many games. 'level' is the KI level if the client
+    does not ask for one, 'width' and 'height' the size of the maps.
+    """
+
+    def __init__(self, width=10, height=10, ships=SHIPS, level=50,
+                 max_games=MAX_GAMES, map_class=None, seed=None):
+        self.width     = width
+        self.height    = height
+        self.ships     = ships
+        self.level     = level
+        self.max_games = max_games
+        self.map_class = map_class
+        self.rand      = random.Random(seed)
+        self.executor  = concurrent.futures.ThreadPoolExecutor(KI_THREADS)
+
+        self.games   = 0          # games running now
+        self.played  = 0          # games finished
+        self.waiting = None       # a client waiting for a foe (see JOIN)
+        self.server  = None
+        self.matches = {}         # the running games by number
+        self.number  = 0          # the number of the last game
+
+
+    async def start(self, host='127.0.0.1', port=0):
+        """
+        Start listening. Returns the port (useful for port 0).
+        """
+        self.server = await asyncio.start_server(
+            self.handle, host, port, limit=LINE_LIMIT
+        )
+        return self.server.sockets[0].getsockname()[1]
+
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+
+    async def handle(self, reader, writer):
+        # a new client: what does it want?
+        seat = ClientSeat(reader, writer)
+        try:
+            words = await seat.read(TURN_TIMEOUT)
+            if not words: return
+
+            if self.games >= self.max_games:
+                await seat.send('ERROR', 'busy')
+
+            elif words[0] == 'KI':
+                level = self.level
+                if len(words) > 1 and words[1].isdigit():
+                    level = min(int(words[1]), 100)
+                await self.play([seat, KISeat(self)], (50, level))
+
+            elif words[0] == 'JOIN':
+                # The first one waits until the game with the second one
+                # is over, the second one plays it.
+                if self.waiting == None:
+                    self.waiting = (seat, asyncio.get_running_loop().create_future())
+                    await self.waiting[1]
+                else:
+                    first, done = self.waiting
+                    self.waiting = None
+                    try:
+                        await self.play([first, seat], (50, 50))
+                    finally:
+                        done.set_result(None)
+
+            elif words[0] == 'GAMES':
+                await seat.send('GAMES', *[str(n) for n in sorted(self.matches)])
+
+            elif words[0] == 'WATCH' and len(words) == 2 and words[1].isdigit():
+                await self.watch(seat, int(words[1]))
+
+            else:
+                await seat.send('ERROR', 'unknown command')
+        except ConnectionError:
+            pass
+        finally:
+            if self.waiting != None and self.waiting[0] is seat:
+                self.waiting = None
+            seat.close()
+
+
+    async def watch(self, seat, number):
+        # a spectator: he gets the moves until the game is over or he
+        # goes away
+        match = self.matches.get(number)
+        if match == None:
+            await seat.send('ERROR', 'no such game')
+            return
+        match.watch(seat.writer)
+        gone = asyncio.ensure_future(seat.reader.read())
+        try:
+            await asyncio.wait([match.done, gone],
+                               return_when=asyncio.FIRST_COMPLETED)
+            await seat.writer.drain()
+        finally:
+            gone.cancel()
+            match.spectators.discard(seat.writer)
+
+
+    def _players(self, levels):
+        # the Players of a game with their ships placed
+        rand = random.Random(self.rand.random())
+        player = [
+            Player(ki=True, level=level, map_class=self.map_class, rand=rand,
+                   width=self.width, height=self.height)
+            for level in levels
+        ]
+        for p in player:
+            p.place_ships(self.ships)
+        for p in player:
+            p.save_foes_ships(self.ships)
+        return player
+
+
+    async def play(self, seats, levels):
+        """
+        Play a game between two seats. Returns the number of the winner.
+        """
+        self.games += 1
+        self.number += 1
+        match = None
+        winner = None
+        try:
+            player = self._players(levels)
+            match = Match(self.number, player)
+            self.matches[match.number] = match
+            for seat, p in zip(seats, player):
+                await seat.send('GAME', str(self.width), str(self.height),
+                                json.dumps(self.ships, ensure_ascii=False))
+                await seat.send('SHIPS', *sorted(
+                    as_xy(f) for f in p.ships.get_fields('ship')
+                ))
+
+            # the same as simulation.play_game(), with seats
+            turn = 0
+            while True:
+                active  = turn % 2
+                passive = (turn + 1) % 2
+
+                if player[active].is_all_sunk():
+                    winner = passive
+                    break
+
+                koor = await seats[active].turn(player[active])
+                if koor == None:
+                    winner = passive
+                    break
+
+                result = player[passive].bomb(koor)
+                player[active].handle_result(result)
+                field, status = as_xy(result[0]), result[1]
+                await seats[active].send('RESULT', field, status)
+                await seats[passive].send('FOE', field, status)
+                match.move(active, result)
+                turn += 1
+
+            for n, seat in enumerate(seats):
+                try:
+                    await seat.send('WIN' if n == winner else 'LOST')
+                except ConnectionError:
+                    pass
+            return winner
+        finally:
+            if match != None:
+                del self.matches[match.number]
+                match.finish(winner)
+            self.games -= 1
+            self.played += 1
+
+
+async def play_client(host, port, command='KI', level=50, rand=None,
+                      executor=None, player_class=Player, think=0.0,
+                      timing=None):
+    """
+    Connect to a server and let a KI of 'level' play one game. Returns
+    'WIN' or 'LOST' (or None if the game broke off). 'command' is 'KI'
+    (against the server's KI) or 'JOIN'. 'player_class' is the class of
+    the KI, it waits 'think' seconds before each shot. 'timing' (if
+    given) is called with a name and the seconds of the connect and of
+    each shot (from BOMB to RESULT).
+    """
+    clock = time.perf_counter
+    start = clock()
+    reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+    if timing != None: timing('connect', clock() - start)
+    loop = asyncio.get_running_loop()
+    player = None
+    try:
+        writer.write((command + "\n").encode())
+        while True:
+            line = await reader.readline()
+            if not line: return None
+            words = line.decode().split()
+
+            if words[0] == 'GAME':
+                width, height = int(words[1]), int(words[2])
+                ships = json.loads(line.decode().split(None, 3)[3])
+                player = player_class(ki=True, level=level, rand=rand,
+                                      width=width, height=height)
+                player.save_foes_ships(ships)
+
+            elif words[0] == 'TURN':
+                koor = await loop.run_in_executor(executor, player.turn)
+                if think > 0: await asyncio.sleep(think)
+                writer.write("BOMB {}\n".format(as_xy(koor)).encode())
+                start = clock()
+
+            elif words[0] == 'RESULT':
+                if timing != None: timing('move', clock() - start)
+                koor = as_koor(words[1], player.width, player.height)
+                player.handle_result((koor, words[2]))
+
+            elif words[0] in ('WIN', 'LOST'):
+                return words[0]
+
+            elif words[0] == 'ERROR' and player == None:
+                return None
+    finally:
+        writer.close()
+
+
+class Test_Server(unittest.TestCase):
+    def run_games(self, clients):
+        async def main():
+            server = Server(seed=1)
+            port = await server.start()
+            try:
+                return await asyncio.gather(*[
+                    play_client('127.0.0.1', port, command, rand=random.Random(n))
+                    for n, command in enumerate(clients)
+                ]), server
+            finally:
+                await server.close()
+        return asyncio.run(main())
+
+    def test_against_ki(self):
+        results, server = self.run_games(['KI'] * 20)
+        self.assertEqual(20, server.played)
+        self.assertEqual(0, server.games)
+        for r in results:
+            self.assertIn(r, ('WIN', 'LOST'))
+
+    def test_join(self):
+        results, server = self.run_games(['JOIN', 'JOIN'])
+        self.assertEqual(1, server.played)
+        self.assertEqual(['LOST', 'WIN'], sorted(results))
+
+    def test_wrong_move(self):
+        async def main():
+            server = Server(seed=2)
+            port = await server.start()
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b"KI 0\n")
+            lines = []
+            while not lines or lines[-1] != 'TURN':
+                lines.append((await reader.readline()).decode().strip())
+            writer.write(b"BOMB z99\n")
+            error = (await reader.readline()).decode().strip()
+            writer.write(b"QUIT\n")
+            last = (await reader.readline()).decode().strip()
+            writer.close()
+            await server.close()
+            return lines, error, last
+        lines, error, last = asyncio.run(main())
+        self.assertTrue(lines[0].startswith('GAME 10 10 '))
+        self.assertEqual('ERROR wrong move', error)
+        self.assertEqual('LOST', last)
+
+    def test_watch(self):
+        async def main():
+            server = Server(seed=4)
+            port = await server.start()
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b"KI 0\n")
+            while (await reader.readline()) != b"TURN\n":
+                pass
+
+            # a spectator comes in
+            g_reader, g_writer = await asyncio.open_connection('127.0.0.1', port)
+            g_writer.write(b"GAMES\n")
+            games = await g_reader.readline()
+            g_writer.close()
+            s_reader, s_writer = await asyncio.open_connection('127.0.0.1', port)
+            s_writer.write(b"WATCH 1\n")
+            snapshot = await s_reader.readline()
+
+            writer.write(b"BOMB a1\n")
+            await reader.readline()
+            writer.write(b"QUIT\n")
+            seen = (await s_reader.read()).decode().splitlines()
+            writer.close()
+            s_writer.close()
+            await server.close()
+            return games, snapshot, seen
+        games, snapshot, seen = asyncio.run(main())
+        self.assertEqual(b"GAMES 1\n", games)
+        self.assertEqual(b"SNAPSHOT 1 10 10 0\n", snapshot)
+        self.assertEqual(['MAP 0', 'MAP 1'], seen[:2])
+        self.assertTrue(seen[2].startswith('MOVE 0 0 A1 '))
+        self.assertEqual('END 1', seen[-1])
+
+
+class Test_Match(unittest.TestCase):
+    class Writer(object):
+        # a StreamWriter which collects the data, 'waiting' is its buffer
+        def __init__(self):
+            self.data = []
+            self.waiting = 0
+            self.transport = self
+        def get_write_buffer_size(self):
+            return self.waiting
+        def write(self, data):
+            self.data.append(data)
+        def is_closing(self):
+            return False
+
+    def test_moves(self):
+        async def main():
+            server = Server(seed=3)
+            player = server._players((50, 50))
+            match = Match(1, player)
+            fast, slow = self.Writer(), self.Writer()
+            match.watch(fast)
+            match.watch(slow)
+
+            for turn in range(40):
+                active = turn % 2
+                if turn == 10: slow.waiting = BEHIND + 1
+                if turn == 30: slow.waiting = 0
+                result = player[1 - active].bomb(player[active].turn())
+                player[active].handle_result(result)
+                match.move(active, result)
+            match.finish(None)
+            return player, fast, slow
+        player, fast, slow = asyncio.run(main())
+
+        # all spectators get the same bytes
+        self.assertIs(fast.data[5], slow.data[5])
+
+        # the moves give the open maps of the players (without the fields
+        # the KI marked in its last turn)
+        maps = ({}, {})
+        for line in b"".join(fast.data).decode().splitlines():
+            words = line.split()
+            if words[0] != 'MOVE': continue
+            for w in [words[3] + LEGENDE[words[4]]] + words[5:]:
+                maps[int(words[2])][w[:-1]] = w[-1]
+        for n in range(2):
+            self.assertEqual(
+                {as_xy(k): LEGENDE[s] for k, s in known_fields(player[n].hits).items()},
+                maps[n]
+            )
+
+        # the slow one missed 20 moves and got a snapshot instead
+        slow_lines = b"".join(slow.data).decode().splitlines()
+        self.assertEqual(2, sum(1 for l in slow_lines if l.startswith('SNAPSHOT')))
+        self.assertEqual(40 - 21, sum(1 for l in slow_lines if l.startswith('MOVE')))
+        self.assertEqual('END None', slow_lines[-1])
+
+    def test_behind_at_end(self):
+        async def main():
+            server = Server(seed=3)
+            player = server._players((50, 50))
+            match = Match(1, player)
+            slow = self.Writer()
+            match.watch(slow)
+
+            for turn in range(10):
+                active = turn % 2
+                if turn == 3: slow.waiting = BEHIND + 1
+                if turn == 5: slow.waiting = 0
+                result = player[1 - active].bomb(player[active].turn())
+                player[active].handle_result(result)
+                match.move(active, result)
+                # the buffer does not drain before the end
+                if turn == 5: slow.waiting = BEHIND + 1
+            match.finish(1)
+            return match, slow
+        match, slow = asyncio.run(main())
+
+        # he gets the last state of the maps and the END, just once
+        lines = b"".join(slow.data).decode().splitlines()
+        self.assertEqual(['END 1'], [l for l in lines if l.startswith('END')])
+        self.assertEqual('END 1', lines[-1])
+        self.assertEqual(match._snapshot().decode().splitlines(), lines[-4:-1])
+        self.assertFalse(slow.behind)
+
+
+# Start a server:
+#     python3 server.py [port] [size of the map]
+if __name__ == '__main__':
+    from battleships import scale_ships
+
+    port = 4711
+    if len(sys.argv) > 1: port = int(sys.argv[1])
+    size = 10
+    if len(sys.argv) > 2: size = int(sys.argv[2])
+
+    async def main():
+        server = Server(size, size, scale_ships(SHIPS, size, size))
+        await server.start('0.0.0.0', port)
+        print("battleships server on port {}".format(port))
+        await server.server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#EOF
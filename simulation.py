@@ -0,0 +1,172 @@
+#! /usr/bin/env python3
+# Headless games between two KI players.
+#
+#   Copyright 2012 Olaf Ohlenmacher
+#
+#   This file is part of battleships.
+#
+#   Battleships is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Battleships is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with battleships.  If not, see <http://www.gnu.org/licenses/>.
+
+# The game loop in battleships.py talks to a human: it prints, it asks
+# for input() and it calls exit() at the end. To find out how good the
+# KI plays I need many games without all of this. Here is the same game
+# loop again, but it only returns a small result record.
+
+import random
+import sys
+import time
+import unittest
+from collections import namedtuple
+
+from battleships import Player, SHIPS, scale_ships
+from BitMap import BitMap
+from TileMap import TileMap
+import instrument
+
+
+# The result of one game:
+#   seed    - the seed the game was played with
+#   winner  - the number of the winning player (0 or 1)
+#   turns   - the number of turns of both players together
+#   hits    - a tuple with the number of hit (or sunk) fields per player
+GameResult = namedtuple('GameResult', 'seed winner turns hits')
+
+
+def play_game(seed=None, ships=SHIPS, levels=(50, 50), map_class=None,
+              library=None, width=None, height=None, record=None):
+	"""
+	Play one game between two KI players and return a GameResult.
+	'levels' is a tuple with the KI level of both players. If 'library'
+	(a LayoutLibrary) is given, the ships are taken from it. 'width' and
+	'height' give the size of the maps. If 'record' (a GameWriter, see
+	record.py) is given, the game is written into it.
+	"""
+	# Each game gets its own random generator, so a game depends on its
+	# seed only -- and not on the games played before.
+	rand = random.Random(seed)
+
+	# Set up both players like the main game does.
+	player = [
+		Player(ki=True, level=level, map_class=map_class, rand=rand,
+		       width=width, height=height)
+		for level in levels
+	]
+	for p in player:
+		if library != None:
+			p.set_ships(library.fields(library.sample(rand)), ships)
+		else:
+			p.place_ships(ships)
+	for p in player:
+		p.save_foes_ships(ships)
+	if record != None:
+		record.begin(seed, player[0].width, player[0].height, ships,
+		             [p.ships for p in player], levels)
+
+	# And play!
+	hits = [0, 0]
+	turn = 0
+	while True:
+		active  = turn % 2
+		passive = (turn + 1) % 2
+
+		if player[active].is_all_sunk():
+			winner = passive
+			break
+
+		koor = player[active].turn()
+		if koor != None:
+			result = player[passive].bomb(koor)
+			player[active].handle_result(result)
+			if record != None:
+				record.shot(active, koor, result[1])
+			if result[1] != 'water':
+				hits[active] += 1
+
+		turn += 1
+
+	if record != None:
+		record.end()
+	return GameResult(seed, winner, turn, tuple(hits))
+
+
+def play_games(seeds, ships=SHIPS, levels=(50, 50), map_class=None,
+               library=None, width=None, height=None, record=None):
+	"""
+	Play one game for each seed and yield the GameResult of each game.
+	"""
+	for seed in seeds:
+		yield play_game(seed, ships, levels, map_class, library, width,
+		                height, record)
+		instrument.tick()
+
+
+class Test_Simulation(unittest.TestCase):
+	def test_play_game(self):
+		result = play_game(1)
+		self.assertIn(result.winner, (0, 1))
+
+		# the winner has hit all fields of all ships
+		fields = sum(s['num'] * s['size'] for s in SHIPS)
+		self.assertEqual(fields, result.hits[result.winner])
+		self.assertLess(result.hits[1 - result.winner], fields)
+
+	def test_same_seed_same_game(self):
+		self.assertEqual(play_game(42), play_game(42))
+
+	def test_play_games(self):
+		results = list(play_games(range(3)))
+		self.assertEqual([0, 1, 2], [r.seed for r in results])
+
+	def test_big_map(self):
+		ships = scale_ships(SHIPS, 30, 20)
+		result = play_game(5, ships, width=30, height=20)
+		fields = sum(s['num'] * s['size'] for s in ships)
+		self.assertEqual(fields, result.hits[result.winner])
+
+
+# Play some games and tell me how fast it was:
+#     python3 simulation.py [number of games] [size of the map] [record file]
+# Big maps are played with TileMap, which only looks at the tiles it needs.
+if __name__ == '__main__':
+	num = 100
+	if len(sys.argv) > 1: num = int(sys.argv[1])
+	size = 10
+	if len(sys.argv) > 2: size = int(sys.argv[2])
+	map_class = BitMap if size <= 32 else TileMap
+	ships = scale_ships(SHIPS, size, size)
+
+	# the games are appended to a record file (see record.py) if given
+	record = None
+	if len(sys.argv) > 3:
+		from record import GameWriter
+		record = GameWriter(sys.argv[3])
+
+	# set BATTLESHIPS_STATS to get the statistics of the functions
+	instrument.from_environment()
+
+	start = time.perf_counter()
+	wins = [0, 0]
+	turns = 0
+	for result in play_games(range(num), ships, map_class=map_class,
+	                         width=size, height=size, record=record):
+		wins[result.winner] += 1
+		turns += result.turns
+	seconds = time.perf_counter() - start
+	if record != None: record.close()
+
+	print("{} games in {:.2f}s ({:.1f} games/s)".format(num, seconds, num/seconds))
+	print("wins: {} / {}, turns per game: {:.1f}".format(wins[0], wins[1], turns/num))
+	instrument.dump()
+
+#EOF
@@ -0,0 +1,180 @@
+#! /usr/bin/env python3
+# A tournament between KI levels on all CPU cores.
+#
+#   Copyright 2012 Olaf Ohlenmacher
+#
+#   This file is part of battleships.
+#
+#   Battleships is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Battleships is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with battleships.  If not, see <http://www.gnu.org/licenses/>.
+
+# To tune the LEVEL table and the KI levels I let the KI play against
+# itself -- many, many games. Every pairing of two levels plays the same
+# number of games, and the games are spread over a pool of processes.
+#
+# Each game gets its own seed, which is made from the master seed, the
+# pairing and the number of the game. So the result of a tournament
+# depends on the master seed only, no matter how many processes play
+# the games or in which order they finish.
+
+import itertools
+import multiprocessing
+import sys
+import unittest
+from collections import Counter
+
+from battleships import SHIPS
+from simulation import play_game
+import instrument
+
+
+class Pairing(object):
+    """
+    The statistics of all games of one pairing of two KI levels.
+    """
+
+    def __init__(self, levels):
+        self.levels = levels
+        self.games  = 0
+        self.wins   = [0, 0]
+        self.turns  = Counter()
+
+    def add(self, result):
+        """
+        Add the GameResult of one game.
+        """
+        self.games += 1
+        self.wins[result.winner] += 1
+        self.turns[result.turns] += 1
+
+    def win_rate(self, player=0):
+        """
+        Returns the part of the games won by 'player' (0 or 1).
+        """
+        if self.games == 0: return 0.0
+        return self.wins[player] / self.games
+
+    def percentile(self, p):
+        """
+        Returns the number of turns which 'p' percent of the games did not
+        exceed.
+        """
+        if self.games == 0: return None
+        limit = p * self.games / 100
+        count = 0
+        for turns in sorted(self.turns):
+            count += self.turns[turns]
+            if count >= limit: return turns
+
+    def __eq__(self, other):
+        return (self.levels, self.games, self.wins, self.turns) == \
+            (other.levels, other.games, other.wins, other.turns)
+
+
+def game_seed(master_seed, levels, number):
+    """
+    Returns the seed of one game of a tournament.
+    """
+    # random.Random() accepts strings as seed and makes a good seed of
+    # the whole string, so I simply write everything into it.
+    return "{}:{}:{}:{}".format(master_seed, levels[0], levels[1], number)
+
+
+def _play(task):
+    # This runs in the worker processes. A task is a tuple of the levels
+    # of both players, the seed and the ship definitions.
+    levels, seed, ships, map_class = task
+    result = play_game(seed, ships, levels, map_class)
+    instrument.tick()
+    return levels, result
+
+
+def tournament(levels, games=100, master_seed=0, workers=None,
+               ships=SHIPS, map_class=None, progress=None):
+    """
+    Play 'games' games for every pairing of the KI 'levels' and return a
+    dictionary with a Pairing for each pair of levels.
+    'workers' is the number of processes (default: number of CPUs).
+    'progress' is called with the Pairing of each finished game.
+    """
+    pairings = list(itertools.product(levels, repeat=2))
+    result = {p: Pairing(p) for p in pairings}
+
+    tasks = (
+        (p, game_seed(master_seed, p, n), ships, map_class)
+        for p in pairings for n in range(games)
+    )
+
+    # With a single worker there is no need for other processes.
+    if workers == 1:
+        finished = map(_play, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers, instrument.from_environment)
+        finished = pool.imap_unordered(_play, tasks, chunksize=16)
+
+    try:
+        for p, game in finished:
+            result[p].add(game)
+            if progress != None: progress(result[p])
+    finally:
+        if pool != None:
+            pool.close()
+            pool.join()
+
+    return result
+
+
+def print_tournament(result):
+    """
+    Print the statistics of a tournament.
+    """
+    print("levels      games   wins 1st   turns p10 / p50 / p90")
+    for p, pairing in sorted(result.items()):
+        print("{:>3} vs {:>3}  {:>6}   {:>7.1%}   {:>5} / {:>3} / {:>3}".format(
+            p[0], p[1], pairing.games, pairing.win_rate(0),
+            pairing.percentile(10), pairing.percentile(50),
+            pairing.percentile(90)
+        ))
+
+
+class Test_Tournament(unittest.TestCase):
+    def test_reproducible(self):
+        one = tournament((0, 100), games=3, master_seed=7, workers=1)
+        two = tournament((0, 100), games=3, master_seed=7, workers=2)
+        self.assertEqual(one, two)
+        self.assertEqual(3, one[(0, 100)].games)
+
+
+# Run a tournament:
+#     python3 tournament.py [games per pairing] [master seed] [workers]
+if __name__ == '__main__':
+    from BitMap import BitMap
+
+    args = [int(a) for a in sys.argv[1:]] + [None, None, None]
+    games       = args[0] or 100
+    master_seed = args[1] or 0
+    workers     = args[2]
+
+    # set BATTLESHIPS_STATS to get the statistics of the functions, use
+    # '{pid}' in the file name to get one file per process
+    instrument.from_environment()
+    result = tournament(
+        (0, 25, 50, 75, 100), games, master_seed, workers, map_class=BitMap
+    )
+    print_tournament(result)
+    instrument.dump()
+
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#EOF